@@ -22,6 +22,7 @@ const AdminPanel = () => {
   const navigate = useNavigate();
   const [stats, setStats] = useState(null);
   const [users, setUsers] = useState([]);
+  const [usersCursor, setUsersCursor] = useState(null);
   const [plans, setPlans] = useState([]);
   const [loading, setLoading] = useState(true);
   const [activeTab, setActiveTab] = useState("users"); // users, plans, or transactions
@@ -62,6 +63,16 @@ const AdminPanel = () => {
     fetchData();
   }, []);
 
+  const loadMoreUsers = async () => {
+    try {
+      const response = await axios.get(`${API}/admin/users`, { params: { cursor: usersCursor } });
+      setUsers([...users, ...response.data.users]);
+      setUsersCursor(response.data.next_cursor);
+    } catch (error) {
+      toast.error("Failed to load more users");
+    }
+  };
+
   const fetchData = async () => {
     try {
       const token = localStorage.getItem("token");
@@ -75,6 +86,7 @@ const AdminPanel = () => {
 
       setStats(statsRes.data);
       setUsers(usersRes.data.users);
+      setUsersCursor(usersRes.data.next_cursor);
       setPlans(plansRes.data.plans);
     } catch (error) {
       if (error.response?.status === 403) {
@@ -406,6 +418,17 @@ const AdminPanel = () => {
                 </tbody>
               </table>
             </div>
+            {usersCursor && (
+              <div className="text-center mt-4">
+                <Button
+                  onClick={loadMoreUsers}
+                  variant="outline"
+                  className="border-slate-300 hover:border-blue-600 hover:text-blue-600 rounded-full"
+                >
+                  Load More
+                </Button>
+              </div>
+            )}
           </Card>
         )}
 
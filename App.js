@@ -25,6 +25,45 @@ axios.interceptors.request.use((config) => {
   return config;
 });
 
+// Access tokens are short-lived: on 401, refresh once (shared by parallel requests) and retry
+let refreshPromise = null;
+// Requests whose 401 means bad credentials or a dead refresh token, not an expired access token
+const NO_REFRESH_PATHS = ["/auth/refresh", "/auth/login", "/auth/signup", "/auth/logout"];
+axios.interceptors.response.use(
+  (response) => response,
+  async (error) => {
+    const original = error.config;
+    const refreshToken = localStorage.getItem("refresh_token");
+    if (
+      error.response?.status !== 401 ||
+      !refreshToken ||
+      original._retried ||
+      NO_REFRESH_PATHS.some((path) => original.url?.includes(path))
+    ) {
+      return Promise.reject(error);
+    }
+    original._retried = true;
+    try {
+      // Read the token again: another request may have rotated it meanwhile
+      refreshPromise = refreshPromise || axios.post(`${API}/auth/refresh`, {
+        refresh_token: localStorage.getItem("refresh_token")
+      });
+      const { data } = await refreshPromise;
+      localStorage.setItem("token", data.token);
+      localStorage.setItem("refresh_token", data.refresh_token);
+    } catch (refreshError) {
+      localStorage.removeItem("token");
+      localStorage.removeItem("refresh_token");
+      localStorage.removeItem("user");
+      window.location.href = "/auth";
+      return Promise.reject(error);
+    } finally {
+      refreshPromise = null;
+    }
+    return axios(original);
+  }
+);
+
 const ProtectedRoute = ({ children }) => {
   const token = localStorage.getItem("token");
   if (!token) {
@@ -35,6 +35,7 @@ const Auth = () => {
       const response = await axios.post(`${API}${endpoint}`, payload);
       
       localStorage.setItem("token", response.data.token);
+      localStorage.setItem("refresh_token", response.data.refresh_token);
       localStorage.setItem("user", JSON.stringify(response.data.user));
       
       toast.success(isLogin ? "Login successful!" : "Account created successfully!");
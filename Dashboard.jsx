@@ -15,6 +15,8 @@ const Dashboard = () => {
   const [stats, setStats] = useState(null);
   const [loading, setLoading] = useState(true);
   const [downloading, setDownloading] = useState(null);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
 
   useEffect(() => {
     fetchData();
@@ -30,6 +32,7 @@ const Dashboard = () => {
 
       setUser(userRes.data);
       setPapers(papersRes.data.papers);
+      setNextCursor(papersRes.data.next_cursor);
       setStats(statsRes.data);
     } catch (error) {
       toast.error("Failed to load data");
@@ -38,8 +41,26 @@ const Dashboard = () => {
     }
   };
 
+  const loadMorePapers = async () => {
+    setLoadingMore(true);
+    try {
+      const response = await axios.get(`${API}/papers`, { params: { cursor: nextCursor } });
+      setPapers([...papers, ...response.data.papers]);
+      setNextCursor(response.data.next_cursor);
+    } catch (error) {
+      toast.error("Failed to load more papers");
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const handleLogout = () => {
+    const refreshToken = localStorage.getItem("refresh_token");
+    if (refreshToken) {
+      axios.post(`${API}/auth/logout`, { refresh_token: refreshToken }).catch(() => {});
+    }
     localStorage.removeItem("token");
+    localStorage.removeItem("refresh_token");
     localStorage.removeItem("user");
     navigate("/auth");
   };
@@ -190,7 +211,7 @@ const Dashboard = () => {
             <div className="flex items-center justify-between mb-4">
               <FileText className="w-8 h-8" />
             </div>
-            <div className="text-3xl font-bold mb-1">{papers.length}</div>
+            <div className="text-3xl font-bold mb-1">{papers.length}{nextCursor ? "+" : ""}</div>
             <div className="text-blue-100 text-sm">Papers Generated</div>
           </Card>
 
@@ -344,6 +365,19 @@ const Dashboard = () => {
                   </div>
                 </Card>
               ))}
+              {nextCursor && (
+                <div className="text-center">
+                  <Button
+                    data-testid="load-more-papers-btn"
+                    onClick={loadMorePapers}
+                    disabled={loadingMore}
+                    variant="outline"
+                    className="border-slate-300 hover:border-blue-600 hover:text-blue-600 rounded-full"
+                  >
+                    {loadingMore ? "Loading..." : "Load More"}
+                  </Button>
+                </div>
+              )}
             </div>
           )}
         </div>
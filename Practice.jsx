@@ -1,5 +1,5 @@
-import { useState, useEffect } from "react";
-import { useParams, useNavigate } from "react-router-dom";
+import { useState, useEffect, useRef } from "react";
+import { useParams, useNavigate, useSearchParams } from "react-router-dom";
 import axios from "axios";
 import { API } from "@/App";
 import { Button } from "@/components/ui/button";
@@ -10,6 +10,9 @@ import { Toaster } from "@/components/ui/sonner";
 
 const Practice = () => {
   const { paperId } = useParams();
+  const [searchParams] = useSearchParams();
+  // Set when a student opens a teacher's paper through a classroom assignment
+  const assignmentId = searchParams.get("assignment");
   const navigate = useNavigate();
   const [paper, setPaper] = useState(null);
   const [currentQuestion, setCurrentQuestion] = useState(0);
@@ -18,15 +21,51 @@ const Practice = () => {
   const [result, setResult] = useState(null);
   const [loading, setLoading] = useState(true);
   const [submitting, setSubmitting] = useState(false);
+  const [timeSpent, setTimeSpent] = useState({});
+  const questionStartRef = useRef(Date.now());
+  const [sessionId, setSessionId] = useState(null);
+  // Answers changed since the last autosave
+  const dirtyRef = useRef({});
+  const saveTimerRef = useRef(null);
+  // Session-scoped token for the page-close save, which cannot refresh an expired access token
+  const saveTokenRef = useRef(null);
+  const [revealed, setRevealed] = useState({});
 
   useEffect(() => {
     fetchPaper();
   }, [paperId]);
 
+  // Answers still waiting for the debounced save are sent when the page is closed or left;
+  // keepalive lets the request outlive the page
+  useEffect(() => {
+    if (!sessionId) return;
+    const flushUnsaved = () => {
+      clearTimeout(saveTimerRef.current);
+      if (Object.keys(dirtyRef.current).length === 0) return;
+      fetch(`${API}/practice/sessions/${sessionId}/unload-save`, {
+        method: "POST",
+        keepalive: true,
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ answers: dirtyRef.current, save_token: saveTokenRef.current })
+      });
+      dirtyRef.current = {};
+    };
+    window.addEventListener("beforeunload", flushUnsaved);
+    return () => {
+      window.removeEventListener("beforeunload", flushUnsaved);
+      flushUnsaved();
+    };
+  }, [sessionId]);
+
   const fetchPaper = async () => {
     try {
-      const response = await axios.get(`${API}/papers/${paperId}`);
+      // Question-only payload; answers come from reveal or the submit response
+      const response = await axios.get(`${API}/papers/${paperId}/practice`, {
+        params: assignmentId ? { assignment_id: assignmentId } : {}
+      });
       setPaper(response.data);
+      await resumeSession();
+      questionStartRef.current = Date.now();
     } catch (error) {
       toast.error("Failed to load paper");
       navigate("/dashboard");
@@ -35,6 +74,59 @@ const Practice = () => {
     }
   };
 
+  // Restore saved answers so a reload does not lose the attempt
+  const resumeSession = async () => {
+    try {
+      const response = await axios.post(`${API}/practice/sessions`, {
+        paper_id: paperId,
+        assignment_id: assignmentId
+      });
+      const session = response.data.session;
+      saveTokenRef.current = response.data.save_token;
+      setSessionId(session.id);
+      setAnswers(session.answers || {});
+      setTimeSpent(session.time_spent || {});
+      setCurrentQuestion(session.current_question || 0);
+    } catch (error) {
+      console.error("Session error:", error);
+    }
+  };
+
+  // Send only the changed answers (plus any progress fields); the server batches these writes
+  const saveProgress = (progress = {}) => {
+    if (!sessionId) return;
+    clearTimeout(saveTimerRef.current);
+    const changed = dirtyRef.current;
+    dirtyRef.current = {};
+    axios.patch(`${API}/practice/sessions/${sessionId}`, {
+      answers: changed,
+      ...progress
+    }).catch(() => {
+      // Keep the unsaved answers for the next save
+      dirtyRef.current = { ...changed, ...dirtyRef.current };
+    });
+  };
+
+  // Add the time since the current question was shown to its running total
+  const recordTimeSpent = () => {
+    const questionId = paper.questions[currentQuestion].id;
+    const elapsed = (Date.now() - questionStartRef.current) / 1000;
+    questionStartRef.current = Date.now();
+    const updated = { ...timeSpent, [questionId]: (timeSpent[questionId] || 0) + elapsed };
+    setTimeSpent(updated);
+    return updated;
+  };
+
+  const goToQuestion = (index) => {
+    const updated = recordTimeSpent();
+    const questionId = paper.questions[currentQuestion].id;
+    saveProgress({
+      time_spent: { [questionId]: updated[questionId] },
+      current_question: index
+    });
+    setCurrentQuestion(index);
+  };
+
   const handleSubmit = async () => {
     if (Object.keys(answers).length === 0) {
       toast.error("Please answer at least one question");
@@ -42,12 +134,24 @@ const Practice = () => {
     }
 
     setSubmitting(true);
+    const finalTimeSpent = recordTimeSpent();
+
+    clearTimeout(saveTimerRef.current);
 
     try {
-      const response = await axios.post(`${API}/quiz/submit`, {
-        paper_id: paperId,
-        answers: answers
-      });
+      // All answers are sent: autosaves buffered by another server worker may not be stored yet
+      const response = sessionId
+        ? await axios.post(`${API}/practice/sessions/${sessionId}/finalize`, {
+            answers: answers,
+            time_spent: finalTimeSpent
+          })
+        : await axios.post(`${API}/quiz/submit`, {
+            paper_id: paperId,
+            answers: answers,
+            time_spent: finalTimeSpent,
+            assignment_id: assignmentId
+          });
+      dirtyRef.current = {};
       
       setResult(response.data.result);
       setSubmitted(true);
@@ -60,8 +164,21 @@ const Practice = () => {
     }
   };
 
+  const revealAnswer = async (questionId) => {
+    try {
+      const response = await axios.get(`${API}/papers/${paperId}/answers/${questionId}`);
+      setRevealed({ ...revealed, [questionId]: response.data });
+    } catch (error) {
+      toast.error(error.response?.data?.detail || "Failed to load answer");
+    }
+  };
+
   const handleAnswer = (questionId, answer) => {
     setAnswers({ ...answers, [questionId]: answer });
+    dirtyRef.current[questionId] = answer;
+    // Save shortly after the last change so a reload keeps the answer on this question too
+    clearTimeout(saveTimerRef.current);
+    saveTimerRef.current = setTimeout(() => saveProgress(), 1500);
   };
 
   if (loading) {
@@ -196,13 +313,34 @@ const Practice = () => {
                   placeholder="Type your answer here..."
                 />
               )}
+
+              {!assignmentId && (
+                revealed[question.id] ? (
+                  <div className="mt-4 p-3 md:p-4 bg-green-50 border border-green-200 rounded-xl text-sm md:text-base">
+                    <div className="font-medium text-green-900">Answer: {revealed[question.id].correct_answer}</div>
+                    {revealed[question.id].explanation && (
+                      <div className="text-slate-700 mt-1">{revealed[question.id].explanation}</div>
+                    )}
+                  </div>
+                ) : (
+                  <Button
+                    data-testid="reveal-answer-btn"
+                    onClick={() => revealAnswer(question.id)}
+                    variant="outline"
+                    size="sm"
+                    className="mt-4 border-slate-300 hover:border-blue-600 hover:text-blue-600 rounded-xl"
+                  >
+                    Show Answer
+                  </Button>
+                )
+              )}
             </Card>
 
             {/* Navigation - Responsive */}
             <div className="flex justify-between items-center gap-2">
               <Button
                 data-testid="prev-question-btn"
-                onClick={() => setCurrentQuestion(Math.max(0, currentQuestion - 1))}
+                onClick={() => goToQuestion(Math.max(0, currentQuestion - 1))}
                 disabled={currentQuestion === 0}
                 variant="outline"
                 size="sm"
@@ -215,7 +353,7 @@ const Practice = () => {
               {currentQuestion < paper.questions.length - 1 ? (
                 <Button
                   data-testid="next-question-btn"
-                  onClick={() => setCurrentQuestion(currentQuestion + 1)}
+                  onClick={() => goToQuestion(currentQuestion + 1)}
                   size="sm"
                   className="bg-gradient-to-r from-blue-600 to-indigo-600 hover:from-blue-700 hover:to-indigo-700 text-white px-3 md:px-6 py-2 md:py-3 rounded-xl font-semibold text-sm md:text-base"
                 >
@@ -244,7 +382,8 @@ const Practice = () => {
               <div className="grid grid-cols-3 gap-3 md:gap-6 mt-4 md:mt-8">
                 <div>
                   <div className="text-3xl md:text-5xl font-bold">{result.score}</div>
-                  <div className="text-blue-100 mt-1 md:mt-2 text-xs md:text-base">Correct</div>
+                  {/* Includes partial credit for written answers, so it matches the percentage */}
+                  <div className="text-blue-100 mt-1 md:mt-2 text-xs md:text-base">Marks</div>
                 </div>
                 <div>
                   <div className="text-3xl md:text-5xl font-bold">{result.total_questions}</div>
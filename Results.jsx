@@ -13,6 +13,8 @@ const Results = () => {
   const [attempts, setAttempts] = useState([]);
   const [stats, setStats] = useState(null);
   const [loading, setLoading] = useState(true);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
 
   useEffect(() => {
     fetchResults();
@@ -26,6 +28,7 @@ const Results = () => {
       ]);
 
       setAttempts(attemptsRes.data.attempts);
+      setNextCursor(attemptsRes.data.next_cursor);
       setStats(statsRes.data);
     } catch (error) {
       toast.error("Failed to load results");
@@ -34,6 +37,19 @@ const Results = () => {
     }
   };
 
+  const loadMoreAttempts = async () => {
+    setLoadingMore(true);
+    try {
+      const response = await axios.get(`${API}/quiz/attempts`, { params: { cursor: nextCursor } });
+      setAttempts([...attempts, ...response.data.attempts]);
+      setNextCursor(response.data.next_cursor);
+    } catch (error) {
+      toast.error("Failed to load more results");
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const formatDate = (dateString) => {
     const date = new Date(dateString);
     return date.toLocaleDateString('en-US', { 
@@ -145,7 +161,7 @@ const Results = () => {
                         <div>
                           <div className="text-sm text-slate-600">Score</div>
                           <div className="text-2xl font-bold text-slate-900">
-                            {attempt.correct_answers}/{attempt.total_questions}
+                            {attempt.score}/{attempt.total_questions}
                           </div>
                         </div>
                         <div>
@@ -173,6 +189,19 @@ const Results = () => {
                   </div>
                 </Card>
               ))}
+              {nextCursor && (
+                <div className="text-center">
+                  <Button
+                    data-testid="load-more-attempts-btn"
+                    onClick={loadMoreAttempts}
+                    disabled={loadingMore}
+                    variant="outline"
+                    className="border-slate-300 hover:border-blue-600 hover:text-blue-600 rounded-full"
+                  >
+                    {loadingMore ? "Loading..." : "Load More"}
+                  </Button>
+                </div>
+              )}
             </div>
           )}
         </Card>
@@ -12,22 +12,27 @@ const Transactions = () => {
   const navigate = useNavigate();
   const [transactions, setTransactions] = useState([]);
   const [loading, setLoading] = useState(true);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
 
   useEffect(() => {
     fetchTransactions();
   }, []);
 
-  const fetchTransactions = async () => {
+  const fetchTransactions = async (cursor = null) => {
+    if (cursor) setLoadingMore(true);
     try {
       const token = localStorage.getItem("token");
-      const config = { headers: { Authorization: `Bearer ${token}` } };
+      const config = { headers: { Authorization: `Bearer ${token}` }, params: cursor ? { cursor } : {} };
       
       const response = await axios.get(`${API}/transactions`, config);
-      setTransactions(response.data.transactions);
+      setTransactions(cursor ? [...transactions, ...response.data.transactions] : response.data.transactions);
+      setNextCursor(response.data.next_cursor);
     } catch (error) {
       toast.error("Failed to load transactions");
     } finally {
       setLoading(false);
+      setLoadingMore(false);
     }
   };
 
@@ -184,6 +189,18 @@ const Transactions = () => {
                 </div>
               </Card>
             ))}
+            {nextCursor && (
+              <div className="text-center">
+                <Button
+                  onClick={() => fetchTransactions(nextCursor)}
+                  disabled={loadingMore}
+                  variant="outline"
+                  className="border-slate-300 hover:border-blue-600 hover:text-blue-600 rounded-full"
+                >
+                  {loadingMore ? "Loading..." : "Load More"}
+                </Button>
+              </div>
+            )}
           </div>
         )}
       </div>
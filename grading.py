@@ -0,0 +1,373 @@
+"""
+Answer grading engine
+Compiles an answer key once (normalized answers, option text, true/false flags, word sets)
+and grades whole submissions - or many submissions against the same key - in one pass.
+"""
+
+import re
+import math
+import string
+from collections import Counter
+from typing import List, Dict, Any, Iterable, Optional, Tuple
+
+import numpy as np
+
+# Option prefixes stripped during normalization ("A)", "1.", "a ")
+_OPTION_PAREN_RE = re.compile(r'^[a-d]\)\s*', flags=re.IGNORECASE)
+_OPTION_NUMBER_RE = re.compile(r'^[1-4]\.\s*')
+_OPTION_LETTER_RE = re.compile(r'^[a-d]\s*', flags=re.IGNORECASE)
+# An answer that is only an option letter ("C", "c)", "C.") - the OMR/answer-sheet format
+_BARE_OPTION_RE = re.compile(r'^\s*([a-d])\s*[).]?\s*$', flags=re.IGNORECASE)
+# Option letter leading a labeled answer ("B) Paris", "b. Paris")
+_LABELED_OPTION_RE = re.compile(r'^\s*([a-d])\s*[).]', flags=re.IGNORECASE)
+OPTION_LETTERS = "ABCD"
+
+# True/False variations, matched as substrings of the normalized answer
+TRUE_VARIATIONS = ['true', 'सत्य', 'सही', 't', 'yes', 'y']
+FALSE_VARIATIONS = ['false', 'असत्य', 'गलत', 'f', 'no', 'n']
+_TRUE_RE = re.compile('|'.join(map(re.escape, TRUE_VARIATIONS)))
+_FALSE_RE = re.compile('|'.join(map(re.escape, FALSE_VARIATIONS)))
+
+SUBJECTIVE_TYPES = ('short_answer', 'essay')
+# Similarity (word Jaccard, or BM25 cosine when a scorer is used) for a subjective answer to count as correct
+SUBJECTIVE_MATCH_THRESHOLD = 0.7
+# BM25 cosine similarity below which a subjective answer earns no partial credit
+SUBJECTIVE_ZERO_CREDIT_SIMILARITY = 0.2
+# Share of the answer key's (BM25-weighted) terms an answer must cover for full credit;
+# below it credit shrinks in proportion, so a short fragment of the key cannot score highly
+SUBJECTIVE_FULL_COVERAGE = 0.8
+
+# BM25 term-frequency saturation and length normalization
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Punctuation (including Devanagari danda) is split on when tokenizing for similarity scoring
+_PUNCTUATION_TABLE = str.maketrans({c: ' ' for c in string.punctuation + '।॥“”‘’–—'})
+
+
+def normalize_answer(answer: Any) -> str:
+    """Normalize answer for flexible comparison"""
+    if not answer:
+        return ""
+
+    answer = str(answer).strip().lower()
+
+    # Remove common prefixes like "A)", "a)", "1.", etc.
+    answer = _OPTION_PAREN_RE.sub('', answer, count=1)
+    answer = _OPTION_NUMBER_RE.sub('', answer, count=1)
+    answer = _OPTION_LETTER_RE.sub('', answer, count=1)
+
+    # Remove extra whitespace
+    return ' '.join(answer.split())
+
+
+def answer_terms(answer: Any) -> List[str]:
+    """Tokenize an answer for similarity scoring (lowercased, punctuation stripped)"""
+    if not answer:
+        return []
+    return str(answer).lower().translate(_PUNCTUATION_TABLE).split()
+
+
+def _option_text(answer: str):
+    """Normalized text after an option label ("B) Paris" -> "paris"), None if unlabeled"""
+    parts = answer.split(')', 1)
+    return normalize_answer(parts[1]) if len(parts) > 1 else None
+
+
+def _correct_option_letter(correct_answer: Any, options: List[str]) -> Optional[str]:
+    """Letter of the correct MCQ option: its own label, else the option whose text it matches"""
+    match = _LABELED_OPTION_RE.match(str(correct_answer)) or _BARE_OPTION_RE.match(str(correct_answer))
+    if match:
+        return match.group(1).upper()
+    correct_norm = normalize_answer(correct_answer)
+    for position, option in enumerate(options[:len(OPTION_LETTERS)]):
+        if correct_norm and normalize_answer(option) == correct_norm:
+            label = _LABELED_OPTION_RE.match(str(option))
+            return label.group(1).upper() if label else OPTION_LETTERS[position]
+    return None
+
+
+def compile_answer(correct_answer: Any, question_type: str, options: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Precompute everything about a correct answer that grading needs (JSON-serializable)"""
+    correct_norm = normalize_answer(correct_answer)
+    compiled = {"type": question_type, "norm": correct_norm}
+    if question_type == 'true_false':
+        compiled["is_true"] = _TRUE_RE.search(correct_norm) is not None
+        compiled["is_false"] = _FALSE_RE.search(correct_norm) is not None
+    elif question_type == 'mcq':
+        compiled["text"] = _option_text(str(correct_answer))
+        # Answer sheets usually hold just the letter, which is graded against these
+        compiled["options"] = [normalize_answer(option) for option in options or []]
+        compiled["letter"] = _correct_option_letter(correct_answer, options or [])
+    elif question_type in SUBJECTIVE_TYPES:
+        # Sorted unique words: stores compactly and works directly as a set operand
+        compiled["words"] = sorted(set(correct_norm.split()))
+        # Term counts for BM25 similarity scoring (parallel lists keep terms out of field names)
+        counts = Counter(answer_terms(correct_answer))
+        compiled["terms"] = list(counts)
+        compiled["counts"] = list(counts.values())
+    return compiled
+
+
+def compile_answer_key(questions: List[Dict[str, Any]], answer_key: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Compile a paper's answer key into {question_id: compiled answer}"""
+    questions_by_id = {q['id']: q for q in questions}
+    return {
+        ak['question_id']: compile_answer(
+            ak['correct_answer'],
+            questions_by_id.get(ak['question_id'], {}).get('type', 'mcq'),
+            questions_by_id.get(ak['question_id'], {}).get('options')
+        )
+        for ak in answer_key
+    }
+
+
+def match_compiled(user_answer: Any, compiled: Dict[str, Any]) -> bool:
+    """Check a user answer against a compiled correct answer with flexible matching"""
+    question_type = compiled["type"]
+
+    # A bare option letter normalizes to "", so it is compared by letter, never by text
+    if question_type == 'mcq':
+        bare_letter = _BARE_OPTION_RE.match(str(user_answer or ''))
+        if bare_letter:
+            return bare_letter.group(1).upper() == compiled.get("letter")
+
+    user_norm = normalize_answer(user_answer)
+    correct_norm = compiled["norm"]
+
+    # Blank answers are unanswered (an empty string is a substring of every key)
+    if not user_norm:
+        return False
+
+    # Exact match after normalization
+    if user_norm == correct_norm:
+        return True
+
+    # For True/False questions - both true or both false
+    if question_type == 'true_false':
+        if compiled["is_true"] and _TRUE_RE.search(user_norm):
+            return True
+        if compiled["is_false"] and _FALSE_RE.search(user_norm):
+            return True
+        return False
+
+    # For MCQ - answer text contained in either direction, or same text after the option label
+    if question_type == 'mcq':
+        if user_norm in correct_norm or correct_norm in user_norm:
+            return True
+        correct_text = compiled["text"]
+        if correct_text is not None and isinstance(user_answer, str):
+            user_text = _option_text(user_answer)
+            if user_text is not None and user_text == correct_text:
+                return True
+        return False
+
+    # For short answer and essay - at least 70% of words match
+    if question_type in SUBJECTIVE_TYPES:
+        words_user = set(user_norm.split())
+        correct_words = compiled["words"]
+        if not words_user or not correct_words:
+            return False
+        intersection = len(words_user.intersection(correct_words))
+        union = len(words_user) + len(correct_words) - intersection
+        return intersection / union >= SUBJECTIVE_MATCH_THRESHOLD
+
+    return False
+
+
+def check_answer_match(user_answer: str, correct_answer: str, question_type: str,
+                       options: Optional[List[str]] = None) -> bool:
+    """Check if user answer matches correct answer with flexible matching"""
+    return match_compiled(user_answer, compile_answer(correct_answer, question_type, options))
+
+
+def similarity_credit(similarity: float, coverage: float = 1.0) -> float:
+    """Partial credit for a subjective answer: 0 below the similarity floor, full credit at the
+    match threshold with enough of the answer key covered"""
+    credit = (similarity - SUBJECTIVE_ZERO_CREDIT_SIMILARITY) / (SUBJECTIVE_MATCH_THRESHOLD - SUBJECTIVE_ZERO_CREDIT_SIMILARITY)
+    credit *= min(1.0, coverage / SUBJECTIVE_FULL_COVERAGE)
+    return min(1.0, max(0.0, credit))
+
+
+def compute_idf(doc_count: int, df: Dict[str, int]) -> Dict[str, float]:
+    """BM25 inverse document frequencies from per-subject document frequencies"""
+    return {term: math.log(1 + (doc_count - n + 0.5) / (n + 0.5)) for term, n in df.items()}
+
+
+def unseen_term_idf(doc_count: int) -> float:
+    """IDF for a term that appears in none of the subject's answer keys"""
+    return math.log(1 + (doc_count + 0.5) / 0.5)
+
+
+class SubjectiveScorer:
+    """BM25-weighted cosine similarity between student answers and a paper's subjective answer key
+    
+    The answer-key side is vectorized once per paper; a submission's subjective answers are then
+    scored together with a single matrix operation.
+    """
+    
+    def __init__(self, compiled_key: Dict[str, Dict[str, Any]], idf: Optional[Dict[str, float]] = None, doc_count: int = 0):
+        self.idf = idf or {}
+        self.unseen_idf = unseen_term_idf(doc_count)
+        subjective = [(q_id, c) for q_id, c in compiled_key.items() if c["type"] in SUBJECTIVE_TYPES]
+        self.rows = {q_id: row for row, (q_id, _) in enumerate(subjective)}
+        
+        self.vocab: Dict[str, int] = {}
+        for _, compiled in subjective:
+            for term in compiled["terms"]:
+                self.vocab.setdefault(term, len(self.vocab))
+        lengths = [sum(compiled["counts"]) for _, compiled in subjective]
+        self.avg_length = (sum(lengths) / len(lengths)) if lengths and sum(lengths) else 1.0
+        
+        self.key_matrix = np.zeros((len(subjective), len(self.vocab)))
+        for row, (_, compiled) in enumerate(subjective):
+            cols = [self.vocab[term] for term in compiled["terms"]]
+            self.key_matrix[row, cols] = self._weights(compiled["terms"], compiled["counts"], lengths[row])
+        norms = np.linalg.norm(self.key_matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        self.key_matrix /= norms
+    
+    def _weights(self, terms: List[str], counts: List[int], length: int) -> np.ndarray:
+        tf = np.asarray(counts, dtype=float)
+        saturation = tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * length / self.avg_length))
+        return saturation * np.array([self.idf.get(term, self.unseen_idf) for term in terms])
+    
+    def similarities(self, answers: Dict[str, Any]) -> Dict[str, Tuple[float, float]]:
+        """(similarity, coverage) in [0, 1] for every answered subjective question
+        
+        Coverage is the weighted share of answer-key terms the answer contains (recall), which
+        cosine similarity alone ignores.
+        """
+        q_ids = [q_id for q_id in answers if q_id in self.rows]
+        if not q_ids:
+            return {}
+        
+        user_matrix = np.zeros((len(q_ids), len(self.vocab)))
+        # Squared weight of terms outside the answer-key vocabulary (they only lower similarity)
+        extra_sq = np.zeros(len(q_ids))
+        for i, q_id in enumerate(q_ids):
+            counts = Counter(answer_terms(answers[q_id]))
+            if not counts:
+                continue
+            terms = list(counts)
+            weights = self._weights(terms, list(counts.values()), sum(counts.values()))
+            for term, weight in zip(terms, weights):
+                col = self.vocab.get(term)
+                if col is None:
+                    extra_sq[i] += weight * weight
+                else:
+                    user_matrix[i, col] = weight
+        
+        key_rows = self.key_matrix[[self.rows[q_id] for q_id in q_ids]]
+        dots = np.einsum('ij,ij->i', user_matrix, key_rows)
+        norms = np.sqrt(np.einsum('ij,ij->i', user_matrix, user_matrix) + extra_sq)
+        sims = np.divide(dots, norms, out=np.zeros(len(q_ids)), where=norms > 0)
+        key_totals = key_rows.sum(axis=1)
+        covered = np.einsum('ij,ij->i', (user_matrix > 0).astype(float), key_rows)
+        coverage = np.divide(covered, key_totals, out=np.zeros(len(q_ids)), where=key_totals > 0)
+        return dict(zip(q_ids, zip(sims.tolist(), coverage.tolist())))
+
+
+def grade_answers(compiled_key: Dict[str, Dict[str, Any]], answers: Dict[str, Any],
+                  scorer: Optional[SubjectiveScorer] = None) -> Tuple[Dict[str, bool], Dict[str, float]]:
+    """Grade one submission; returns (verdicts, credits) for every question in the key
+    
+    Without a scorer, credit is 1 for a correct answer and 0 otherwise. With a scorer,
+    subjective answers get partial credit from their BM25 similarity to the answer key and how
+    much of it they cover. An answer is correct only with full credit, so correct_answers never
+    counts more than the credited score.
+    """
+    verdicts = dict.fromkeys(compiled_key, False)
+    credits = dict.fromkeys(compiled_key, 0.0)
+    similarities = scorer.similarities(answers) if scorer is not None else {}
+    for q_id, user_answer in answers.items():
+        compiled = compiled_key.get(q_id)
+        if compiled is None:
+            continue
+        similarity = similarities.get(q_id)
+        if similarity is not None and normalize_answer(user_answer) != compiled["norm"]:
+            credits[q_id] = similarity_credit(*similarity)
+            verdicts[q_id] = credits[q_id] >= 1.0
+        elif match_compiled(user_answer, compiled):
+            verdicts[q_id] = True
+            credits[q_id] = 1.0
+    return verdicts, credits
+
+
+def grade_submission(questions: List[Dict[str, Any]], answer_key: List[Dict[str, Any]], answers: Dict[str, Any]) -> Dict[str, Any]:
+    """Grade one submission against a paper"""
+    return grade_submissions(questions, answer_key, [answers])[0]
+
+
+def grade_submissions(questions: List[Dict[str, Any]], answer_key: List[Dict[str, Any]],
+                      submissions: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Grade many submissions against the same paper, compiling the answer key only once"""
+    compiled_key = compile_answer_key(questions, answer_key)
+    return [summarize_verdicts(*grade_answers(compiled_key, answers), len(questions)) for answers in submissions]
+
+
+def summarize_verdicts(verdicts: Dict[str, bool], credits: Dict[str, float], total_questions: int) -> Dict[str, Any]:
+    correct_answers = sum(verdicts.values())
+    score = round(sum(credits.values()), 2)
+    percentage = (score / total_questions * 100) if total_questions > 0 else 0
+    return {
+        "score": score,
+        "correct_answers": correct_answers,
+        "total_questions": total_questions,
+        "percentage": percentage,
+        "verdicts": verdicts,
+        "credits": credits,
+    }
+
+
+# Bump when the compiled answer format changes; stale indexes are rebuilt on first use
+GRADING_INDEX_VERSION = 3
+
+
+def build_grading_index(questions: List[Dict[str, Any]], answer_key: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Build the compact grading data stored with each paper at generation time"""
+    compiled_key = compile_answer_key(questions, answer_key)
+    return {
+        "version": GRADING_INDEX_VERSION,
+        "total_questions": len(questions),
+        # A list rather than a dict keyed by question id, so ids never become Mongo field names
+        "answers": [{"id": q_id, **compiled} for q_id, compiled in compiled_key.items()],
+    }
+
+
+def is_current_grading_index(index: Any) -> bool:
+    return isinstance(index, dict) and index.get("version") == GRADING_INDEX_VERSION
+
+
+def compiled_key_from_index(index: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    return {entry["id"]: entry for entry in index["answers"]}
+
+
+def has_subjective_answers(index: Dict[str, Any]) -> bool:
+    return any(entry["type"] in SUBJECTIVE_TYPES for entry in index["answers"])
+
+
+def grade_with_index(index: Dict[str, Any], answers: Dict[str, Any], scorer: Optional[SubjectiveScorer] = None) -> Dict[str, Any]:
+    """Grade one submission using a stored grading index"""
+    compiled_key = compiled_key_from_index(index)
+    return summarize_verdicts(*grade_answers(compiled_key, answers, scorer), index["total_questions"])
+
+
+def subjective_answer_documents(questions: List[Dict[str, Any]], answer_key: List[Dict[str, Any]]) -> List[List[str]]:
+    """Unique terms of every subjective correct answer - the documents subject IDF is built from"""
+    question_types = {q['id']: q['type'] for q in questions}
+    return [
+        sorted(set(answer_terms(ak['correct_answer'])))
+        for ak in answer_key
+        if question_types.get(ak['question_id']) in SUBJECTIVE_TYPES
+    ]
+
+
+# Labeled ("B) Paris", "b.") or bare ("C" - answer sheets) option letters
+_OPTION_LABEL_RE = re.compile(r'^\s*([a-d])\s*(?:[).]|$)', flags=re.IGNORECASE)
+
+
+def option_label(answer: Any) -> str:
+    """Option letter an MCQ answer picked ("B) Paris" or "b" -> "B"), "other" when unlabeled"""
+    match = _OPTION_LABEL_RE.match(str(answer or ''))
+    return match.group(1).upper() if match else "other"
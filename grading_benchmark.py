@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Grading Engine Microbenchmarks
+Reports throughput in answers per second for per-answer matching,
+single-submission grading and batch grading of many submissions.
+Runs fully offline - no database or network needed.
+"""
+
+import sys
+import time
+import random
+import argparse
+
+from grading import (
+    check_answer_match, grade_submission, grade_submissions, compile_answer_key, grade_answers,
+    build_grading_index, grade_with_index, SubjectiveScorer
+)
+
+QUESTION_TYPE_MIX = ["mcq", "mcq", "true_false", "short_answer", "mcq", "essay"]
+WORDS = ("cell energy mitochondria membrane nucleus protein enzyme reaction "
+         "light chlorophyll glucose oxygen carbon water root stem leaf").split()
+
+
+def make_paper(num_questions):
+    questions = []
+    answer_key = []
+    for i in range(1, num_questions + 1):
+        q_id = f"q{i}"
+        q_type = QUESTION_TYPE_MIX[(i - 1) % len(QUESTION_TYPE_MIX)]
+        questions.append({"id": q_id, "type": q_type})
+        if q_type == "mcq":
+            correct = f"B) {random.choice(WORDS)} {random.choice(WORDS)}"
+        elif q_type == "true_false":
+            correct = random.choice(["True", "False"])
+        else:
+            correct = " ".join(random.choices(WORDS, k=12 if q_type == "short_answer" else 60))
+        answer_key.append({"question_id": q_id, "correct_answer": correct, "explanation": ""})
+    return questions, answer_key
+
+
+def make_submission(questions, answer_key):
+    answers = {}
+    for question, key in zip(questions, answer_key):
+        correct = key["correct_answer"]
+        if random.random() < 0.5:
+            answers[question["id"]] = correct
+        elif question["type"] == "mcq":
+            answers[question["id"]] = f"C) {random.choice(WORDS)}"
+        elif question["type"] == "true_false":
+            answers[question["id"]] = random.choice(["True", "False", "सत्य"])
+        else:
+            answers[question["id"]] = " ".join(random.sample(correct.split(), k=len(correct.split()) // 2))
+    return answers
+
+
+def measure(label, total_answers, fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    print(f"{label:<36} {total_answers / best:>14,.0f} answers/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the grading engine")
+    parser.add_argument("--questions", type=int, default=60)
+    parser.add_argument("--submissions", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    random.seed(42)
+    questions, answer_key = make_paper(args.questions)
+    submissions = [make_submission(questions, answer_key) for _ in range(args.submissions)]
+    total_answers = sum(len(s) for s in submissions)
+    question_types = {q["id"]: q["type"] for q in questions}
+    key_by_id = {ak["question_id"]: ak["correct_answer"] for ak in answer_key}
+    compiled_key = compile_answer_key(questions, answer_key)
+    grading_index = build_grading_index(questions, answer_key)
+    scorer = SubjectiveScorer(compiled_key)
+
+    def per_answer():
+        for answers in submissions:
+            for q_id, user_answer in answers.items():
+                check_answer_match(user_answer, key_by_id[q_id], question_types[q_id])
+
+    def per_submission():
+        for answers in submissions:
+            grade_submission(questions, answer_key, answers)
+
+    def precompiled_key():
+        for answers in submissions:
+            grade_answers(compiled_key, answers)
+
+    def with_scorer():
+        for answers in submissions:
+            grade_answers(compiled_key, answers, scorer)
+
+    def stored_index():
+        for answers in submissions:
+            grade_with_index(grading_index, answers)
+
+    def batch():
+        grade_submissions(questions, answer_key, submissions)
+
+    print(f"{args.submissions} submissions x {args.questions} questions ({total_answers:,} answers)")
+    measure("check_answer_match per answer", total_answers, per_answer, args.repeat)
+    measure("grade_submission per submission", total_answers, per_submission, args.repeat)
+    measure("grade_answers with compiled key", total_answers, precompiled_key, args.repeat)
+    measure("grade_answers with BM25 scorer", total_answers, with_scorer, args.repeat)
+    measure("grade_with_index (stored index)", total_answers, stored_index, args.repeat)
+    measure("grade_submissions batch", total_answers, batch, args.repeat)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Grading Engine Tests
+Covers answer matching as answer sheets submit it: labeled options, bare option
+letters and blank answers. Runs fully offline - python -m pytest grading_test.py
+"""
+
+from grading import check_answer_match, grade_submission, build_grading_index, grade_with_index, option_label
+
+OPTIONS = ["A) London", "B) Paris", "C) Rome", "D) Berlin"]
+QUESTIONS = [
+    {"id": "q1", "type": "mcq", "options": OPTIONS},
+    {"id": "q2", "type": "true_false"},
+    {"id": "q3", "type": "short_answer"},
+]
+ANSWER_KEY = [
+    {"question_id": "q1", "correct_answer": "B) Paris"},
+    {"question_id": "q2", "correct_answer": "True"},
+    {"question_id": "q3", "correct_answer": "plants make food from light"},
+]
+
+
+def test_mcq_correct_answer_forms():
+    for answer in ["B", "b", "B)", "b.", "B) Paris", "Paris", "paris"]:
+        assert check_answer_match(answer, "B) Paris", "mcq", OPTIONS), answer
+
+
+def test_mcq_wrong_letters():
+    for answer in ["A", "C", "D", "d", "c)", "A) London"]:
+        assert not check_answer_match(answer, "B) Paris", "mcq", OPTIONS), answer
+
+
+def test_mcq_letter_resolved_from_unlabeled_key():
+    options = ["London", "Paris", "Rome", "Berlin"]
+    assert check_answer_match("B", "Paris", "mcq", options)
+    assert not check_answer_match("C", "Paris", "mcq", options)
+
+
+def test_blank_answers_are_unanswered():
+    for answer in ["", "   ", None]:
+        assert not check_answer_match(answer, "B) Paris", "mcq", OPTIONS)
+        assert not check_answer_match(answer, "True", "true_false")
+        assert not check_answer_match(answer, "plants make food from light", "short_answer")
+
+
+def test_answer_sheet_grading_with_index():
+    index = build_grading_index(QUESTIONS, ANSWER_KEY)
+    assert grade_with_index(index, {"q1": "B", "q2": "True"})["correct_answers"] == 2
+    wrong = grade_with_index(index, {"q1": "D", "q2": "", "q3": ""})
+    assert wrong["correct_answers"] == 0
+    assert wrong["score"] == 0
+
+
+def test_missing_answers_score_nothing():
+    result = grade_submission(QUESTIONS, ANSWER_KEY, {})
+    assert result["correct_answers"] == 0
+    assert result["verdicts"] == {"q1": False, "q2": False, "q3": False}
+
+
+def test_option_label_reads_labeled_and_bare_letters():
+    for answer, label in [("B) Paris", "B"), ("b. Paris", "B"), ("C", "C"), (" d ", "D"), ("a)", "A")]:
+        assert option_label(answer) == label, answer
+    for answer in ["Paris", "", None, "Berlin", "E"]:
+        assert option_label(answer) == "other", answer
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Index Advisor
+Runs explain() on the query shapes server.py issues and reports any that
+fall back to a collection scan or an in-memory sort.
+Needs the same MONGO_URL / DB_NAME as the app; only reads query plans.
+
+Usage:
+    python index_advisor.py                # report plans for every query shape
+    python index_advisor.py --ensure       # build the declared indexes first
+    python index_advisor.py --strict       # exit non-zero if any shape scans
+"""
+
+import sys
+import asyncio
+import argparse
+from datetime import datetime, timezone
+
+import server
+
+SAMPLE_ID = "advisor-sample"
+
+# (name, collection, filter, sort) - one entry per distinct query shape in server.py
+QUERY_SHAPES = [
+    ("user by id", "users", {"id": SAMPLE_ID}, None),
+    ("user by email", "users", {"email": "advisor@example.com"}, None),
+    ("paper by owner", "question_papers", {"id": SAMPLE_ID, "user_id": SAMPLE_ID}, None),
+    ("paper content", "paper_contents", {"paper_id": SAMPLE_ID}, None),
+    ("papers of user", "question_papers", {"user_id": SAMPLE_ID}, [("created_at", -1), ("id", -1)]),
+    ("attempts of user", "quiz_attempts", {"user_id": SAMPLE_ID}, [("completed_at", -1), ("id", -1)]),
+    ("attempts of paper", "quiz_attempts", {"paper_id": SAMPLE_ID}, None),
+    ("attempts of assignment", "quiz_attempts", {"assignment_id": SAMPLE_ID}, None),
+    ("user stats", "user_stats", {"user_id": SAMPLE_ID}, None),
+    ("item stats of paper", "paper_item_stats", {"paper_id": SAMPLE_ID}, None),
+    ("subject term stats", "subject_term_stats", {"subject": "science"}, None),
+    ("subject term df", "subject_term_df", {"subject": "science"}, None),
+    ("transactions of user", "transactions", {"user_id": SAMPLE_ID}, [("created_at", -1), ("id", -1)]),
+    ("all transactions", "transactions", {}, [("created_at", -1), ("id", -1)]),
+    ("transaction by id", "transactions", {"id": SAMPLE_ID}, None),
+    ("payment order", "payment_orders", {"order_id": SAMPLE_ID}, None),
+    ("all payment orders", "payment_orders", {}, [("created_at", -1), ("order_id", -1)]),
+    ("all users", "users", {}, [("created_at", -1), ("id", -1)]),
+    ("stale quota reservations", "users", {"quota_reservations.reserved_at": {"$lt": datetime.now(timezone.utc)}}, None),
+    ("plan by id", "subscription_plans", {"id": SAMPLE_ID}, None),
+    ("active plans", "subscription_plans", {"is_active": True}, None),
+    ("assignment by id", "assignments", {"id": SAMPLE_ID}, None),
+    ("assignment by join code", "assignments", {"join_code": "ABCD1234"}, None),
+    ("assignments of teacher", "assignments", {"teacher_id": SAMPLE_ID}, [("created_at", -1)]),
+    ("assignment membership", "assignment_members", {"assignment_id": SAMPLE_ID, "student_id": SAMPLE_ID}, None),
+    ("memberships of student", "assignment_members", {"student_id": SAMPLE_ID}, None),
+    ("assignment results", "assignment_results", {"assignment_id": SAMPLE_ID}, [("best_percentage", -1)]),
+    ("open practice session", "practice_sessions",
+     {"user_id": SAMPLE_ID, "paper_id": SAMPLE_ID, "assignment_id": None, "status": "active"}, None),
+    ("practice session by id", "practice_sessions", {"id": SAMPLE_ID, "status": "active"}, None),
+    ("leaderboard top", "leaderboard_entries", {"scope": "paper", "scope_id": SAMPLE_ID},
+     [("percentage", -1), ("achieved_at", 1)]),
+    ("leaderboard buckets", "leaderboard_buckets", {"scope": "paper", "scope_id": SAMPLE_ID}, None),
+    ("leaderboard entry", "leaderboard_entries", {"scope": "paper", "scope_id": SAMPLE_ID, "user_id": SAMPLE_ID}, None),
+    ("refresh token", "refresh_tokens", {"token_hash": SAMPLE_ID, "revoked": False}, None),
+    ("refresh tokens of user", "refresh_tokens", {"user_id": SAMPLE_ID, "revoked": False}, None),
+    ("token revocations", "token_revocations", {"revoked_at": {"$gte": 0}}, None),
+]
+
+
+def plan_nodes(plan):
+    """Yield every stage of a (possibly nested) winning plan, outermost first"""
+    if not isinstance(plan, dict):
+        return
+    yield plan
+    for key in ("inputStage", "queryPlan"):
+        yield from plan_nodes(plan.get(key))
+    for child in plan.get("inputStages", []):
+        yield from plan_nodes(child)
+
+
+async def explain_shape(collection, query, sort):
+    """Return (stage names, index names) of the winning plan"""
+    cursor = server.db[collection].find(query)
+    if sort:
+        cursor = cursor.sort(sort)
+    explained = await cursor.explain()
+    nodes = list(plan_nodes(explained.get("queryPlanner", {}).get("winningPlan", {})))
+    return [node["stage"] for node in nodes if "stage" in node], [node["indexName"] for node in nodes if node.get("indexName")]
+
+
+async def run(args):
+    server.connect_mongo()
+    if args.ensure:
+        result = await server.ensure_indexes()
+        print(f"Indexes ensured: {result['ensured']}, failed: {result['failed']}\n")
+
+    problems = []
+    print(f"{'query shape':<28} {'collection':<22} {'plan':<28} index")
+    for name, collection, query, sort in QUERY_SHAPES:
+        stages, index_names = await explain_shape(collection, query, sort)
+        flags = []
+        if "COLLSCAN" in stages:
+            flags.append("COLLSCAN")
+        if "SORT" in stages:
+            flags.append("in-memory SORT")
+        plan = " > ".join(reversed(stages)) if not flags else " + ".join(flags)
+        print(f"{name:<28} {collection:<22} {plan:<28} {', '.join(index_names) or '-'}")
+        if flags:
+            problems.append(f"{name} ({collection}): {', '.join(flags)}")
+
+    if problems:
+        print(f"\n❌ {len(problems)} query shape(s) without a usable index:")
+        for problem in problems:
+            print(f"   {problem}")
+        return 1 if args.strict else 0
+    print("\n✅ Every query shape uses an index")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report query shapes that scan collections")
+    parser.add_argument("--ensure", action="store_true", help="Build the declared indexes before explaining")
+    parser.add_argument("--strict", action="store_true", help="Exit non-zero if any shape scans")
+    args = parser.parse_args()
+    try:
+        return asyncio.run(run(args))
+    finally:
+        if server.client:
+            server.client.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Keyset Pagination Tests
+Pages through a collection where older documents lack created_at (or share it) and checks
+every document is returned exactly once, in order. Needs the backend requirements
+installed (server.py is imported) - python -m pytest pagination_test.py
+"""
+
+import os
+import asyncio
+
+import pytest
+
+pytest.importorskip("fastapi")
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'pagination_test')
+
+import server  # noqa: E402
+
+
+def _sort_key(value):
+    # BSON order for the types involved: null (and missing) before strings
+    return (0, "") if value is None else (1, value)
+
+
+def _matches(document, query):
+    for field, condition in query.items():
+        if field == "$and":
+            if not all(_matches(document, clause) for clause in condition):
+                return False
+        elif field == "$or":
+            if not any(_matches(document, clause) for clause in condition):
+                return False
+        elif isinstance(condition, dict) and "$lt" in condition:
+            value, bound = document.get(field), condition["$lt"]
+            # Comparison operators only match values of the same type
+            if value is None or bound is None or type(value) is not type(bound) or not value < bound:
+                return False
+        elif document.get(field) != condition:
+            return False
+    return True
+
+
+class _Cursor:
+    def __init__(self, documents):
+        self.documents = documents
+
+    def sort(self, keys):
+        for field, direction in reversed(keys):
+            self.documents.sort(key=lambda document: _sort_key(document.get(field)), reverse=direction < 0)
+        return self
+
+    def limit(self, count):
+        self.documents = self.documents[:count]
+        return self
+
+    async def to_list(self, length):
+        return self.documents[:length]
+
+
+class _Collection:
+    """The find/sort/limit subset paginate uses, with Mongo's null and type-bracketing rules"""
+    def __init__(self, documents):
+        self.documents = documents
+
+    def find(self, query, projection):
+        return _Cursor([dict(document) for document in self.documents if _matches(document, query)])
+
+
+def _page_all(collection, limit):
+    seen, cursor = [], None
+    while True:
+        items, cursor = asyncio.run(server.paginate(collection, {}, {"_id": 0}, cursor, limit))
+        seen.extend(item["id"] for item in items)
+        if cursor is None:
+            return seen
+
+
+def test_mixed_collection_pages_every_document_once():
+    documents = (
+        [{"id": f"new-{i:02d}", "created_at": f"2025-01-{i:02d}T00:00:00+00:00"} for i in range(1, 8)]
+        + [{"id": f"same-{i}", "created_at": "2024-06-01T00:00:00+00:00"} for i in range(4)]
+        + [{"id": f"legacy-{i}"} for i in range(5)]
+        + [{"id": f"legacy-null-{i}", "created_at": None} for i in range(2)]
+    )
+    expected = [document["id"] for document in sorted(
+        documents, key=lambda document: (_sort_key(document.get("created_at")), document["id"]), reverse=True
+    )]
+    for limit in (1, 2, 3, 5, 50):
+        assert _page_all(_Collection(documents), limit) == expected, limit
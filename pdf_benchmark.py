@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+PDF Rendering Benchmark Suite
+Measures render time, peak RSS and output size of every PDF renderer
+(generate_pdf, generate_pdf_from_screenshot in both modes, generate_receipt_pdf)
+on synthetic papers of different sizes, question types and languages.
+Runs fully offline - no database or network needed.
+
+Usage:
+    python pdf_benchmark.py                              # run and compare with the committed baseline
+    python pdf_benchmark.py --save-baseline              # record these results into the baseline
+    python pdf_benchmark.py --compare                    # fail if slower/bigger than baseline
+
+The baseline (pdf_benchmark_baseline.json) is committed with the code. Timings only
+compare on the machine that recorded them, so its environment is stored alongside.
+    python pdf_benchmark.py --sizes 10 50 --languages Hindi --renderers browser-native
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import resource
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone, timedelta
+
+# server.py reads these at import time; the benchmark never touches the database
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'benchmark')
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pdf_benchmark_baseline.json")
+DEFAULT_SIZES = [10, 50, 100, 200]
+DEFAULT_LANGUAGES = ["English", "Hindi", "Marathi", "Tamil", "Telugu"]
+QUESTION_TYPE_MIX = ["mcq", "mcq", "true_false", "short_answer", "mcq", "essay"]
+
+# Per-language sample text: (question, option words, explanation)
+SAMPLE_TEXT = {
+    "English": ("Which of the following statements about the topic is correct?",
+                ["First option", "Second option", "Third option", "Fourth option"],
+                "This is correct because it follows directly from the definition."),
+    "Hindi": ("निम्नलिखित में से कौन सा कथन सही है?",
+              ["पहला विकल्प", "दूसरा विकल्प", "तीसरा विकल्प", "चौथा विकल्प"],
+              "यह उत्तर सही है क्योंकि यह परिभाषा से मेल खाता है।"),
+    "Marathi": ("खालीलपैकी कोणते विधान बरोबर आहे?",
+                ["पहिला पर्याय", "दुसरा पर्याय", "तिसरा पर्याय", "चौथा पर्याय"],
+                "हे उत्तर बरोबर आहे कारण ते व्याख्येशी जुळते."),
+    "Tamil": ("பின்வருவனவற்றில் எந்த கூற்று சரியானது?",
+              ["முதல் விருப்பம்", "இரண்டாவது விருப்பம்", "மூன்றாவது விருப்பம்", "நான்காவது விருப்பம்"],
+              "இது வரையறையுடன் பொருந்துவதால் இந்த பதில் சரியானது."),
+    "Telugu": ("కింది వాటిలో ఏ ప్రకటన సరైనది?",
+               ["మొదటి ఎంపిక", "రెండవ ఎంపిక", "మూడవ ఎంపిక", "నాల్గవ ఎంపిక"],
+               "ఇది నిర్వచనానికి సరిపోలుతుంది కాబట్టి ఈ సమాధానం సరైనది."),
+}
+
+# Renderer name -> languages it serves in the app (None = receipt, language independent)
+RENDERERS = {
+    "reportlab": ["English"],
+    "browser-native": [lang for lang in DEFAULT_LANGUAGES if lang != "English"],
+    "browser-image": [lang for lang in DEFAULT_LANGUAGES if lang != "English"],
+    "receipt": None,
+}
+
+
+def make_synthetic_paper(num_questions=50, language="English"):
+    """Build a paper document shaped like the ones generate_paper stores"""
+    question_text, option_words, explanation = SAMPLE_TEXT.get(language, SAMPLE_TEXT["English"])
+    questions = []
+    answer_key = []
+    for i in range(1, num_questions + 1):
+        q_id = f"q{i}"
+        q_type = QUESTION_TYPE_MIX[(i - 1) % len(QUESTION_TYPE_MIX)]
+        question = {
+            "id": q_id,
+            "type": q_type,
+            "question": f"{i}. {question_text}",
+            "difficulty": "medium",
+            "marks": 5 if q_type == "essay" else 2
+        }
+        if q_type == "mcq":
+            question["options"] = [f"{label}) {word}" for label, word in zip("ABCD", option_words)]
+            correct = question["options"][1]
+        elif q_type == "true_false":
+            correct = "True"
+        else:
+            # Subjective answers are longer, essays much longer
+            correct = " ".join([explanation] * (8 if q_type == "essay" else 2))
+        questions.append(question)
+        answer_key.append({"question_id": q_id, "correct_answer": correct, "explanation": explanation})
+    return {
+        "id": f"benchmark-{language.lower()}-{num_questions}",
+        "user_id": "benchmark-user",
+        "exam_type": "CBSE",
+        "subject": "Science",
+        "topics": ["General"],
+        "paper_title": "Benchmark Paper",
+        "total_marks": sum(q["marks"] for q in questions),
+        "duration_minutes": 180,
+        "language": language,
+        "questions": questions,
+        "answer_key": answer_key,
+        "instructions": f"{question_text}\nAll questions are compulsory."
+    }
+
+
+def make_synthetic_transaction():
+    """Build a transaction document shaped like the ones create_transaction stores"""
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    return {
+        "id": "benchmark-transaction",
+        "transaction_number": "TXN20250101BENCH001",
+        "user_id": "benchmark-user",
+        "user_name": "Benchmark User",
+        "user_email": "benchmark@example.com",
+        "user_mobile": "9999999999",
+        "plan_id": "pro",
+        "plan_name": "Pro",
+        "amount": 599.0,
+        "currency": "INR",
+        "payment_method": "Razorpay",
+        "payment_id": "pay_benchmark",
+        "status": "completed",
+        "validity_start": start.isoformat(),
+        "validity_end": (start + timedelta(days=30)).isoformat(),
+        "created_at": start.isoformat(),
+    }
+
+
+def _peak_rss_mb(who):
+    peak = resource.getrusage(who).ru_maxrss
+    # ru_maxrss is KB on Linux and bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_case(renderer, num_questions, language, runs):
+    """Run one benchmark case; executed in a fresh process so peak RSS is per renderer"""
+    import server
+
+    if renderer == "receipt":
+        transaction = make_synthetic_transaction()
+        render = lambda: server.generate_receipt_pdf(transaction)
+    elif renderer == "reportlab":
+        paper = make_synthetic_paper(num_questions, language)
+        render = lambda: server.generate_pdf(paper, include_answers=True)
+    else:
+        server.BROWSER_PDF_MODE = "image" if renderer == "browser-image" else "native"
+        paper = make_synthetic_paper(num_questions, language)
+        render = lambda: asyncio.run(server.generate_pdf_from_screenshot(paper, include_answers=True))
+
+    timings = []
+    pdf_bytes = b""
+    for _ in range(runs):
+        start = time.perf_counter()
+        pdf_bytes = render()
+        timings.append(time.perf_counter() - start)
+
+    return {
+        "best_s": round(min(timings), 4),
+        "mean_s": round(sum(timings) / len(timings), 4),
+        # Chromium runs in child processes, so count the largest of those too
+        "peak_rss_mb": round(max(_peak_rss_mb(resource.RUSAGE_SELF), _peak_rss_mb(resource.RUSAGE_CHILDREN)), 1),
+        "size_kb": round(len(pdf_bytes) / 1024, 1),
+    }
+
+
+def build_cases(renderers, sizes, languages):
+    cases = []
+    for renderer in renderers:
+        if RENDERERS[renderer] is None:
+            cases.append((renderer, 0, "-"))
+            continue
+        for language in languages:
+            if language not in RENDERERS[renderer]:
+                continue
+            for size in sizes:
+                cases.append((renderer, size, language))
+    return cases
+
+
+def case_key(renderer, size, language):
+    return f"{renderer}/{language}/{size}"
+
+
+def environment_info():
+    return {"machine": platform.machine(), "platform": platform.platform(),
+            "python": platform.python_version(), "cpus": os.cpu_count()}
+
+
+def load_baseline(path):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baseline(path, results):
+    """Merge results into the baseline, so a filtered run only replaces its own cases"""
+    baseline = load_baseline(path) or {}
+    baseline.pop("note", None)
+    baseline["environment"] = environment_info()
+    baseline["recorded_at"] = datetime.now(timezone.utc).isoformat()
+    baseline["results"] = {**baseline.get("results", {}), **results}
+    with open(path, "w") as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    """Print each case against the baseline; return a list of regressions (beyond tolerance,
+    or missing from the baseline - an unmeasured case must not pass silently)"""
+    base_results = baseline.get("results", {})
+    if base_results and baseline.get("environment") != environment_info():
+        print("\n⚠️  Baseline was recorded on a different environment; timings may not be comparable")
+    regressions = []
+    print(f"\n{'case':<32} {'best':>9} {'rss':>9} {'size':>9}   (change vs baseline)")
+    for key, result in results.items():
+        base = base_results.get(key)
+        if not base:
+            print(f"{key:<32} {'(not in baseline)':>29}")
+            regressions.append(f"{key}: not in baseline")
+            continue
+        changes = []
+        for metric in ("best_s", "peak_rss_mb", "size_kb"):
+            change = (result[metric] / base[metric] - 1) if base[metric] else 0.0
+            changes.append(f"{change:>+9.1%}")
+            if base[metric] and result[metric] > base[metric] * (1 + tolerance):
+                regressions.append(f"{key}: {metric} {base[metric]} -> {result[metric]}")
+        print(f"{key:<32} {' '.join(changes)}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark PDF renderers offline")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--languages", nargs="+", default=DEFAULT_LANGUAGES)
+    parser.add_argument("--renderers", nargs="+", choices=list(RENDERERS), default=list(RENDERERS))
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="Store these results as the baseline")
+    parser.add_argument("--compare", action="store_true", help="Exit non-zero on regressions against the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative slowdown/growth (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    baseline = load_baseline(args.baseline)
+    if args.compare and not args.save_baseline and not (baseline or {}).get("results"):
+        # Fail before spending minutes rendering: there is nothing to compare against
+        print(f"Error: baseline {args.baseline} has no recorded results.\n"
+              f"Record one on the reference machine with --save-baseline and commit it.", file=sys.stderr)
+        return 2
+
+    cases = build_cases(args.renderers, args.sizes, args.languages)
+    print(f"Running {len(cases)} cases, {args.runs} runs each")
+    print(f"{'case':<32} {'best (s)':>9} {'mean (s)':>9} {'rss (MB)':>9} {'size (KB)':>10}")
+
+    results = {}
+    spawn = multiprocessing.get_context("spawn")
+    for renderer, size, language in cases:
+        with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as executor:
+            result = executor.submit(run_case, renderer, size, language, args.runs).result()
+        key = case_key(renderer, size, language)
+        results[key] = result
+        print(f"{key:<32} {result['best_s']:>9.3f} {result['mean_s']:>9.3f} "
+              f"{result['peak_rss_mb']:>9.1f} {result['size_kb']:>10.1f}")
+
+    regressions = []
+    if baseline and baseline.get("results"):
+        regressions = compare_to_baseline(results, baseline, args.tolerance)
+    else:
+        print(f"\nBaseline {args.baseline} has no recorded results; run with --save-baseline first")
+
+    if args.save_baseline:
+        save_baseline(args.baseline, results)
+        print(f"\nBaseline saved to {args.baseline}")
+
+    if args.compare and baseline and baseline.get("results"):
+        if regressions:
+            print(f"\n❌ {len(regressions)} regression(s) beyond {args.tolerance:.0%}:")
+            for regression in regressions:
+                print(f"   {regression}")
+            return 1
+        print(f"\n✅ No regressions beyond {args.tolerance:.0%}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,15 +1,22 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request, Query, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import StreamingResponse, FileResponse
+from fastapi.responses import StreamingResponse, FileResponse, Response
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne, ReplaceOne, ReturnDocument, monitoring
+from pymongo.errors import DuplicateKeyError
 import os
+import re
+import time
+import math
+import threading
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict, EmailStr
 from typing import List, Optional, Dict, Any
 import uuid
+from collections import Counter, OrderedDict, deque
 from datetime import datetime, timezone, timedelta
 from passlib.context import CryptContext
 import jwt
@@ -23,31 +30,167 @@ from reportlab.lib import colors
 from reportlab.lib.enums import TA_CENTER, TA_LEFT
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
 from PIL import Image
 from playwright.async_api import async_playwright
 import io
+import csv
+import codecs
 import asyncio
 import base64
 import razorpay
 import hmac
 import hashlib
+import zlib
+import secrets
+from concurrent.futures import ThreadPoolExecutor
+from grading import (
+    build_grading_index, grade_with_index, is_current_grading_index, has_subjective_answers,
+    compiled_key_from_index, compute_idf, subjective_answer_documents, SubjectiveScorer,
+    grade_answers, summarize_verdicts, option_label
+)
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
+# MongoDB connection: the client is created at startup from these settings (see connect_mongo)
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+MONGO_DB_NAME = os.environ['DB_NAME']
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', 100))
+MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', 0))
+MONGO_MAX_IDLE_TIME_MS = int(os.environ.get('MONGO_MAX_IDLE_TIME_MS', 300000))
+# A request waiting longer than this for a free pooled connection fails instead of queueing forever
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', 10000))
+MONGO_CONNECT_TIMEOUT_MS = int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', 10000))
+MONGO_SOCKET_TIMEOUT_MS = int(os.environ.get('MONGO_SOCKET_TIMEOUT_MS', 60000))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', 10000))
+# Wire compression in order of preference; the first one the server also supports is used,
+# and zstd is skipped with a warning when the zstandard module is not installed
+MONGO_COMPRESSORS = os.environ.get('MONGO_COMPRESSORS', 'zstd,zlib')
+MONGO_ZLIB_LEVEL = int(os.environ.get('MONGO_ZLIB_LEVEL', 6))
+MONGO_READ_PREFERENCE = os.environ.get('MONGO_READ_PREFERENCE', 'primary')
+client: Optional[AsyncIOMotorClient] = None
+db = None
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Password hashing: hashes made with a different cost are upgraded on the next login
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', 12))
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS
+)
+# bcrypt releases the GIL, so a thread per core keeps hashing off the event loop
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', os.cpu_count() or 2))
+# Calls waiting for a worker beyond this are rejected with 503 instead of piling up
+PASSWORD_HASH_MAX_QUEUE = int(os.environ.get('PASSWORD_HASH_MAX_QUEUE', 256))
+password_hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
 security = HTTPBearer()
 
 # JWT settings
 JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY')
 JWT_ALGORITHM = os.environ.get('JWT_ALGORITHM', 'HS256')
-ACCESS_TOKEN_EXPIRE_MINUTES = int(os.environ.get('ACCESS_TOKEN_EXPIRE_MINUTES', 1440))
+# Access tokens carry the claims read endpoints need and are short-lived;
+# sessions are extended with rotating refresh tokens
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.environ.get('ACCESS_TOKEN_EXPIRE_MINUTES', 15))
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.environ.get('REFRESH_TOKEN_EXPIRE_DAYS', 30))
+# How often each worker picks up access-token revocations made by other workers
+TOKEN_REVOCATION_POLL_SECONDS = float(os.environ.get('TOKEN_REVOCATION_POLL_SECONDS', 5))
+
+# Bundled fonts for browser-rendered PDFs (no external font fetch, works offline)
+FONTS_DIR = Path(os.environ.get('FONTS_DIR', str(ROOT_DIR / 'fonts')))
+# Stylesheet that serves a family whose bundled files are missing (empty disables the fallback)
+FONTS_FALLBACK_CSS_URL = os.environ.get('FONTS_FALLBACK_CSS_URL', 'https://fonts.googleapis.com/css2')
+BUNDLED_FONTS = {
+    'Noto Sans Devanagari': ['NotoSansDevanagari-Regular.ttf', 'NotoSansDevanagari-Bold.ttf'],
+    'Noto Sans Tamil': ['NotoSansTamil-Regular.ttf', 'NotoSansTamil-Bold.ttf'],
+    'Noto Sans Telugu': ['NotoSansTelugu-Regular.ttf', 'NotoSansTelugu-Bold.ttf'],
+}
+LANGUAGE_FONT_FAMILIES = {
+    'hindi': ['Noto Sans Devanagari'],
+    'marathi': ['Noto Sans Devanagari'],
+    'sanskrit': ['Noto Sans Devanagari'],
+    'nepali': ['Noto Sans Devanagari'],
+    'tamil': ['Noto Sans Tamil'],
+    'telugu': ['Noto Sans Telugu'],
+}
+
+# Browser PDF output: "native" (Chromium page.pdf, A4 pages) or "image" (one JPEG per A4 page)
+BROWSER_PDF_MODE = os.environ.get('BROWSER_PDF_MODE', 'native')
+BROWSER_PDF_IMAGE_DPI = int(os.environ.get('BROWSER_PDF_IMAGE_DPI', 150))
+BROWSER_PDF_JPEG_QUALITY = int(os.environ.get('BROWSER_PDF_JPEG_QUALITY', 80))
+A4_WIDTH_PX = 794
+A4_HEIGHT_PX = 1123
+
+# PDF cache and optional background pre-rendering after generation
+PDF_CACHE_DIR = os.environ.get('PDF_CACHE_DIR', '/app/pdf_cache')
+PDF_PRERENDER_ENABLED = os.environ.get('PDF_PRERENDER_ENABLED', 'false').lower() == 'true'
+PDF_RENDER_CONCURRENCY = int(os.environ.get('PDF_RENDER_CONCURRENCY', 2))
+
+# Receipt PDFs
+RECEIPTS_DIR = os.environ.get('RECEIPTS_DIR', '/app/receipts')
+
+# Subjective answer scoring: how long per-subject IDF weights are reused, and how many
+# vectorized answer keys are kept in memory
+SUBJECT_IDF_TTL_SECONDS = int(os.environ.get('SUBJECT_IDF_TTL_SECONDS', 600))
+PAPER_SCORER_CACHE_SIZE = int(os.environ.get('PAPER_SCORER_CACHE_SIZE', 512))
+
+# Materialized quiz stats: how many recent attempts are kept in each user's stats document
+RECENT_ATTEMPTS_LIMIT = 5
+RECENT_ATTEMPT_FIELDS = ["id", "paper_id", "score", "total_questions", "correct_answers", "percentage", "completed_at"]
+
+# Per-question analytics: longest time-to-answer counted for a single question
+MAX_QUESTION_SECONDS = 3600
+
+# Bulk grading of offline answer sheets: students graded and written per batch
+BULK_GRADING_BATCH_SIZE = int(os.environ.get('BULK_GRADING_BATCH_SIZE', 500))
+
+# Practice sessions: autosaves are merged in memory and written at most once per interval
+SESSION_FLUSH_INTERVAL_SECONDS = float(os.environ.get('SESSION_FLUSH_INTERVAL_SECONDS', 2))
+SESSION_OWNER_CACHE_SIZE = 50000
+# Lifetime of a practice session's save token, which the final save on page close sends
+# (that request cannot refresh an expired access token first)
+SESSION_SAVE_TOKEN_EXPIRE_HOURS = int(os.environ.get('SESSION_SAVE_TOKEN_EXPIRE_HOURS', 12))
+
+# Authenticated user lookups: bounded per-process LRU with a short TTL so
+# changes made through another worker are picked up quickly
+USER_CACHE_TTL_SECONDS = float(os.environ.get('USER_CACHE_TTL_SECONDS', 10))
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 10000))
+
+# Login/signup throttling: failures per IP and per (email, IP) in a sliding window, then
+# exponential backoff. 'mongo' shares the counters between workers. The per-email limit is
+# keyed with the IP so nobody can lock a chosen account out from elsewhere.
+LOGIN_THROTTLE_STORE = os.environ.get('LOGIN_THROTTLE_STORE', 'memory')
+LOGIN_THROTTLE_WINDOW_SECONDS = int(os.environ.get('LOGIN_THROTTLE_WINDOW_SECONDS', 900))
+LOGIN_MAX_FAILURES_PER_EMAIL = int(os.environ.get('LOGIN_MAX_FAILURES_PER_EMAIL', 5))
+LOGIN_MAX_FAILURES_PER_IP = int(os.environ.get('LOGIN_MAX_FAILURES_PER_IP', 30))
+# A whole classroom signs up from one school NAT address: successful signups get a high
+# ceiling, while rejected ones (existing emails) are limited tightly
+SIGNUP_MAX_PER_IP = int(os.environ.get('SIGNUP_MAX_PER_IP', 300))
+SIGNUP_MAX_FAILURES_PER_IP = int(os.environ.get('SIGNUP_MAX_FAILURES_PER_IP', 10))
+LOGIN_BACKOFF_MAX_SECONDS = int(os.environ.get('LOGIN_BACKOFF_MAX_SECONDS', 900))
+# Only enable behind a proxy that sets X-Forwarded-For; otherwise clients could spoof it
+TRUST_FORWARDED_FOR = os.environ.get('TRUST_FORWARDED_FOR', 'false').lower() == 'true'
+
+# List endpoints return pages of at most MAX_PAGE_SIZE with an opaque next_cursor
+DEFAULT_PAGE_SIZE = int(os.environ.get('DEFAULT_PAGE_SIZE', 50))
+MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE', 200))
+
+# Admin dashboard totals come from maintained counters, cached briefly per worker
+# and periodically reconciled against real counts to correct any drift
+ADMIN_STATS_TTL_SECONDS = float(os.environ.get('ADMIN_STATS_TTL_SECONDS', 30))
+COUNTERS_RECONCILE_SECONDS = float(os.environ.get('COUNTERS_RECONCILE_SECONDS', 3600))
+
+# Paper content (questions, answer key) lives in paper_contents, apart from the slim
+# question_papers metadata; 'zlib' compresses the questions, 'none' stores them as plain fields
+PAPER_CONTENT_COMPRESSION = os.environ.get('PAPER_CONTENT_COMPRESSION', 'zlib')
+PAPER_CONTENT_ZLIB_LEVEL = int(os.environ.get('PAPER_CONTENT_ZLIB_LEVEL', 6))
+
+# Paper quota reservations older than this (well past any AI generation) are refunded by a
+# periodic sweep, unless their paper was stored
+QUOTA_RESERVATION_TIMEOUT_SECONDS = int(os.environ.get('QUOTA_RESERVATION_TIMEOUT_SECONDS', 900))
+QUOTA_SWEEP_INTERVAL_SECONDS = float(os.environ.get('QUOTA_SWEEP_INTERVAL_SECONDS', 300))
 
 # Razorpay client
 razorpay_client = razorpay.Client(auth=(os.environ.get('RAZORPAY_KEY_ID', ''), os.environ.get('RAZORPAY_KEY_SECRET', '')))
@@ -133,8 +276,35 @@ class QuizAttempt(BaseModel):
     total_questions: int
     correct_answers: int
     percentage: float
+    assignment_id: Optional[str] = None  # Set when attempted through a classroom assignment
     completed_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
 
+class Assignment(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    paper_id: str
+    teacher_id: str
+    title: str
+    join_code: str = Field(default_factory=lambda: str(uuid.uuid4())[:8].upper())
+    due_at: Optional[str] = None
+    # Precomputed results, maintained on every submit
+    counters: Dict[str, Any] = Field(default_factory=lambda: {
+        "members": 0,
+        "attempts": 0,
+        "students_attempted": 0,
+        "percentage_sum": 0.0,
+        "best_percentage_sum": 0.0,
+        "highest_percentage": 0.0,
+        "score_buckets": {}
+    })
+    created_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
+
+class AssignmentCreate(BaseModel):
+    paper_id: str
+    title: str
+    student_emails: List[EmailStr] = []
+    due_at: Optional[str] = None
+
 class SubscriptionPlan(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -197,19 +367,176 @@ class TransactionCreate(BaseModel):
 
 # ==================== HELPER FUNCTIONS ====================
 
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+_password_hash_stats = {"in_flight": 0, "completed": 0, "rejected": 0, "wait_seconds_total": 0.0}
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+async def _run_password_hash(fn, *args):
+    """Run a bcrypt call on the dedicated pool, tracking queue depth and wait time"""
+    if _password_hash_stats["in_flight"] >= PASSWORD_HASH_WORKERS + PASSWORD_HASH_MAX_QUEUE:
+        _password_hash_stats["rejected"] += 1
+        raise HTTPException(status_code=503, detail="Server busy, please try again")
+    
+    def run():
+        # Stats are only updated on the event loop; the worker just reports when it started
+        return time.monotonic(), fn(*args)
+    
+    submitted_at = time.monotonic()
+    _password_hash_stats["in_flight"] += 1
+    try:
+        started_at, result = await asyncio.get_running_loop().run_in_executor(password_hash_executor, run)
+    finally:
+        _password_hash_stats["in_flight"] -= 1
+    _password_hash_stats["completed"] += 1
+    _password_hash_stats["wait_seconds_total"] += started_at - submitted_at
+    return result
+
+def password_hash_metrics() -> Dict[str, Any]:
+    in_flight = _password_hash_stats["in_flight"]
+    completed = _password_hash_stats["completed"]
+    return {
+        "workers": PASSWORD_HASH_WORKERS,
+        "rounds": BCRYPT_ROUNDS,
+        "running": min(in_flight, PASSWORD_HASH_WORKERS),
+        "queued": max(in_flight - PASSWORD_HASH_WORKERS, 0),
+        "completed": completed,
+        "rejected": _password_hash_stats["rejected"],
+        "average_wait_ms": round(_password_hash_stats["wait_seconds_total"] / completed * 1000, 2) if completed else None
+    }
+
+async def hash_password(password: str) -> str:
+    return await _run_password_hash(pwd_context.hash, password)
+
+async def verify_password(plain_password: str, hashed_password: str) -> tuple:
+    """Return (valid, new_hash); new_hash is set when the stored hash uses an old cost"""
+    return await _run_password_hash(pwd_context.verify_and_update, plain_password, hashed_password)
 
 def create_access_token(data: dict) -> str:
     to_encode = data.copy()
-    expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
+    now = datetime.now(timezone.utc)
+    expire = now + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    # iat_ms orders the token against revocations made within the same second
+    to_encode.update({"exp": expire, "iat": int(now.timestamp()), "iat_ms": int(now.timestamp() * 1000), "typ": "access"})
     encoded_jwt = jwt.encode(to_encode, JWT_SECRET_KEY, algorithm=JWT_ALGORITHM)
     return encoded_jwt
 
+def user_token_claims(user: Dict) -> Dict[str, Any]:
+    """Claims that let read endpoints authorize without loading the user"""
+    return {
+        "sub": user['id'],
+        "email": user['email'],
+        "name": user['name'],
+        "role": user['role'],
+        "active": user.get('is_active', True),
+        "plan": user.get('subscription_plan')
+    }
+
+def _hash_refresh_token(refresh_token: str) -> str:
+    return hashlib.sha256(refresh_token.encode('utf-8')).hexdigest()
+
+async def issue_refresh_token(user_id: str, family_id: Optional[str] = None) -> str:
+    """Store a new refresh token (hashed only); a family links every rotation of one login"""
+    refresh_token = secrets.token_urlsafe(32)
+    now = datetime.now(timezone.utc)
+    await db.refresh_tokens.insert_one({
+        "token_hash": _hash_refresh_token(refresh_token),
+        "user_id": user_id,
+        "family_id": family_id or str(uuid.uuid4()),
+        "revoked": False,
+        "created_at": now.isoformat(),
+        # BSON date so a TTL index can expire old tokens
+        "expires_at": now + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+    })
+    return refresh_token
+
+async def issue_tokens(user: Dict, family_id: Optional[str] = None) -> Dict[str, Any]:
+    return {
+        "token": create_access_token(user_token_claims(user)),
+        "refresh_token": await issue_refresh_token(user['id'], family_id),
+        "expires_in": ACCESS_TOKEN_EXPIRE_MINUTES * 60
+    }
+
+# user_id -> epoch milliseconds; access tokens issued before it are rejected
+_token_revocations: Dict[str, int] = {}
+_token_revocations_seen_at = 0
+_token_revocation_task: Optional[asyncio.Task] = None
+
+async def revoke_access_tokens(user_id: str):
+    """Force the user's access tokens to be refreshed (claims changed or account disabled)"""
+    revoked_at = int(time.time() * 1000)
+    _token_revocations[user_id] = revoked_at
+    await db.token_revocations.update_one(
+        {"user_id": user_id},
+        {"$set": {
+            "revoked_at": revoked_at,
+            # Outstanding access tokens are expired after this anyway
+            "expires_at": datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+        }},
+        upsert=True
+    )
+
+async def revoke_user_sessions(user_id: str):
+    """Log the user out everywhere: revoke refresh tokens and current access tokens"""
+    await db.refresh_tokens.update_many(
+        {"user_id": user_id, "revoked": False},
+        {"$set": {"revoked": True}}
+    )
+    await revoke_access_tokens(user_id)
+
+async def sync_token_revocations():
+    """Load revocations recorded by any worker since the last sync"""
+    global _token_revocations_seen_at
+    cutoff = int(time.time() * 1000) - ACCESS_TOKEN_EXPIRE_MINUTES * 60 * 1000
+    async for row in db.token_revocations.find(
+        {"revoked_at": {"$gte": max(_token_revocations_seen_at, cutoff)}},
+        {"_id": 0, "user_id": 1, "revoked_at": 1}
+    ):
+        _token_revocations[row['user_id']] = max(_token_revocations.get(row['user_id'], 0), row['revoked_at'])
+        # Same-millisecond revocations may arrive on a later poll, so re-read the last one
+        _token_revocations_seen_at = max(_token_revocations_seen_at, row['revoked_at'])
+    for user_id in [uid for uid, revoked_at in _token_revocations.items() if revoked_at < cutoff]:
+        del _token_revocations[user_id]
+
+async def _token_revocation_loop():
+    while True:
+        await asyncio.sleep(TOKEN_REVOCATION_POLL_SECONDS)
+        try:
+            await sync_token_revocations()
+        except Exception as e:
+            logging.error(f"Token revocation sync failed: {str(e)}")
+
+# user_id -> (expires_at, user document); every writer of `users` must invalidate
+_user_cache: "OrderedDict[str, tuple]" = OrderedDict()
+_user_cache_stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+async def get_cached_user(user_id: str) -> Optional[Dict]:
+    """Read a user through the short-lived in-process cache"""
+    cached = _user_cache.get(user_id)
+    if cached and cached[0] > time.monotonic():
+        _user_cache.move_to_end(user_id)
+        _user_cache_stats["hits"] += 1
+        # Handlers may modify current_user, so never hand out the cached dict itself
+        return dict(cached[1])
+    _user_cache_stats["misses"] += 1
+    user = await db.users.find_one({"id": user_id}, {"_id": 0})
+    if user is not None:
+        _user_cache[user_id] = (time.monotonic() + USER_CACHE_TTL_SECONDS, user)
+        _user_cache.move_to_end(user_id)
+        while len(_user_cache) > USER_CACHE_SIZE:
+            _user_cache.popitem(last=False)
+        user = dict(user)
+    return user
+
+def invalidate_user_cache(user_id: str):
+    _user_cache_stats["invalidations"] += 1
+    _user_cache.pop(user_id, None)
+
+def user_cache_metrics() -> Dict[str, Any]:
+    lookups = _user_cache_stats["hits"] + _user_cache_stats["misses"]
+    return {
+        **_user_cache_stats,
+        "size": len(_user_cache),
+        "hit_rate": round(_user_cache_stats["hits"] / lookups, 4) if lookups else None
+    }
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> Dict:
     try:
         token = credentials.credentials
@@ -217,7 +544,7 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         user_id: str = payload.get("sub")
         if user_id is None:
             raise HTTPException(status_code=401, detail="Invalid token")
-        user = await db.users.find_one({"id": user_id}, {"_id": 0})
+        user = await get_cached_user(user_id)
         if user is None:
             raise HTTPException(status_code=401, detail="User not found")
         # Check if user is active
@@ -229,8 +556,121 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     except jwt.JWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
-async def generate_pdf_from_screenshot(paper: Dict[str, Any], include_answers: bool = False) -> bytes:
-    """Generate PDF from screenshot for non-English languages (Hindi, Marathi, etc.)"""
+async def get_token_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> Dict:
+    """Authorize from access-token claims alone (no database read) for read endpoints"""
+    try:
+        payload = jwt.decode(credentials.credentials, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
+    except jwt.ExpiredSignatureError:
+        raise HTTPException(status_code=401, detail="Token expired")
+    except jwt.InvalidTokenError:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    
+    user_id = payload.get("sub")
+    if user_id is None:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    if "active" not in payload:
+        # Token from before claims were embedded
+        return await get_current_user(credentials)
+    # Tokens minted before iat_ms existed only know their second, so count them from its start
+    issued_ms = payload.get("iat_ms", payload.get("iat", 0) * 1000)
+    if issued_ms < _token_revocations.get(user_id, -1):
+        raise HTTPException(status_code=401, detail="Token revoked")
+    if not payload["active"]:
+        raise HTTPException(status_code=403, detail="Your account has been deactivated. Please contact support.")
+    return {
+        "id": user_id,
+        "email": payload.get("email"),
+        "name": payload.get("name"),
+        "role": payload.get("role", "user"),
+        "is_active": True,
+        "subscription_plan": payload.get("plan")
+    }
+
+def encode_cursor(document: Dict[str, Any], sort_field: str, id_field: str) -> str:
+    position = json.dumps([document.get(sort_field), document.get(id_field)], separators=(',', ':'))
+    return base64.urlsafe_b64encode(position.encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        sort_value, id_value = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return sort_value, id_value
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def _after_descending(field: str, value: Any) -> List[Dict[str, Any]]:
+    """Clauses for values strictly after `value` in a descending sort. Missing/null values sort
+    last, and $lt never matches them, so they are matched explicitly (older documents may lack the field)"""
+    if value is None:
+        return []
+    return [{field: {"$lt": value}}, {field: None}]
+
+async def paginate(collection, query: Dict[str, Any], projection: Dict[str, Any], cursor: Optional[str],
+                   limit: int, sort_field: str = "created_at", id_field: str = "id") -> tuple:
+    """Keyset page ordered by (sort_field, id_field) descending; returns (items, next_cursor)"""
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    if cursor:
+        sort_value, id_value = decode_cursor(cursor)
+        # Strictly after the last item of the previous page in (sort_field, id_field) order
+        clauses = _after_descending(sort_field, sort_value)
+        tiebreak = _after_descending(id_field, id_value)
+        if tiebreak:
+            clauses.append({sort_field: sort_value, "$or": tiebreak})
+        if not clauses:
+            return [], None
+        query = {"$and": [query, {"$or": clauses}]}
+    items = await collection.find(query, projection).sort(
+        [(sort_field, -1), (id_field, -1)]
+    ).limit(limit + 1).to_list(limit + 1)
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = encode_cursor(items[-1], sort_field, id_field)
+    return items, next_cursor
+
+# family -> inlined @font-face rules, or None when its bundled files are missing
+_font_face_css_cache: Dict[str, Optional[str]] = {}
+
+def _bundled_font_css(family: str) -> Optional[str]:
+    if family not in _font_face_css_cache:
+        # Encode each family once per process; font files never change at runtime
+        missing = [filename for filename in BUNDLED_FONTS[family] if not (FONTS_DIR / filename).exists()]
+        if missing:
+            fallback = "the remote stylesheet" if FONTS_FALLBACK_CSS_URL else "system fonts"
+            logging.error(f"Bundled fonts missing from {FONTS_DIR} ({', '.join(missing)}); "
+                          f"'{family}' falls back to {fallback}")
+            _font_face_css_cache[family] = None
+        else:
+            family_rules = []
+            for filename in BUNDLED_FONTS[family]:
+                weight = 700 if 'Bold' in filename else 400
+                encoded = base64.b64encode((FONTS_DIR / filename).read_bytes()).decode('ascii')
+                family_rules.append(
+                    f"@font-face {{ font-family: '{family}'; font-weight: {weight}; "
+                    f"src: url(data:font/ttf;base64,{encoded}) format('truetype'); }}"
+                )
+            _font_face_css_cache[family] = '\n'.join(family_rules)
+    return _font_face_css_cache[family]
+
+def get_font_face_css(language: str) -> str:
+    """Return @font-face rules with the bundled Noto fonts inlined as base64 for a language,
+    importing the remote stylesheet for any family that is not bundled on this deploy"""
+    families = LANGUAGE_FONT_FAMILIES.get(language.lower(), list(BUNDLED_FONTS))
+    rules = []
+    remote_families = []
+    for family in families:
+        family_css = _bundled_font_css(family)
+        if family_css is None:
+            remote_families.append(family)
+        else:
+            rules.append(family_css)
+    if remote_families and FONTS_FALLBACK_CSS_URL:
+        query = '&'.join(f"family={family.replace(' ', '+')}:wght@400;700" for family in remote_families)
+        # @import must precede every other rule in the stylesheet
+        rules.insert(0, f"@import url('{FONTS_FALLBACK_CSS_URL}?{query}&display=swap');")
+    return '\n'.join(rules)
+
+def build_paper_html(paper: Dict[str, Any], include_answers: bool = False) -> str:
+    """Build the printable HTML for a question paper (used by the browser renderer)"""
     
     # Create HTML content
     html_content = f"""
@@ -238,8 +678,8 @@ async def generate_pdf_from_screenshot(paper: Dict[str, Any], include_answers: b
     <html>
     <head>
         <meta charset="UTF-8">
-        <link href="https://fonts.googleapis.com/css2?family=Noto+Sans+Devanagari:wght@400;700&family=Noto+Sans+Tamil:wght@400;700&family=Noto+Sans+Telugu:wght@400;700&display=swap" rel="stylesheet">
         <style>
+            {get_font_face_css(paper.get('language', ''))}
             * {{
                 margin: 0;
                 padding: 0;
@@ -328,6 +768,15 @@ async def generate_pdf_from_screenshot(paper: Dict[str, Any], include_answers: b
             .page-break {{
                 page-break-after: always;
             }}
+            @page {{
+                size: A4;
+                margin: 15mm;
+            }}
+            @media print {{
+                body {{
+                    padding: 0;
+                }}
+            }}
             .answer-key {{
                 margin-top: 40px;
             }}
@@ -442,28 +891,67 @@ async def generate_pdf_from_screenshot(paper: Dict[str, Any], include_answers: b
     </html>
     """
     
-    # Generate screenshot using Playwright
-    async with async_playwright() as p:
-        browser = await p.chromium.launch(headless=True)
-        page = await browser.new_page(viewport={'width': 794, 'height': 1123})  # A4 size in pixels at 96 DPI
-        
-        await page.set_content(html_content)
-        await page.wait_for_load_state('networkidle')
-        
-        # Take screenshot
-        screenshot_bytes = await page.screenshot(full_page=True, type='png')
-        await browser.close()
+    return html_content
+
+async def generate_pdf_from_screenshot(paper: Dict[str, Any], include_answers: bool = False) -> bytes:
+    """Generate PDF in a headless browser for non-English languages (Hindi, Marathi, etc.)
     
-    # Convert screenshot to PDF using simpler method
-    img = Image.open(io.BytesIO(screenshot_bytes))
+    Uses Chromium's native A4 print output by default. BROWSER_PDF_MODE=image
+    renders one compressed JPEG per A4 page instead, at BROWSER_PDF_IMAGE_DPI.
+    """
+    html_content = build_paper_html(paper, include_answers=include_answers)
     
-    # Convert to RGB if needed
-    if img.mode != 'RGB':
-        img = img.convert('RGB')
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=True)
+        try:
+            if BROWSER_PDF_MODE == 'image':
+                return await _render_html_to_image_pdf(browser, html_content)
+            page = await browser.new_page()
+            await page.set_content(html_content)
+            # Fonts are inlined, so only wait for them to be decoded - no network round-trips
+            await page.evaluate("document.fonts.ready.then(() => true)")
+            return await page.pdf(format='A4', print_background=True, prefer_css_page_size=True)
+        finally:
+            await browser.close()
+
+async def _render_html_to_image_pdf(browser, html_content: str) -> bytes:
+    """Render HTML as one JPEG-compressed image per A4 page"""
+    scale = BROWSER_PDF_IMAGE_DPI / 96
+    page = await browser.new_page(
+        viewport={'width': A4_WIDTH_PX, 'height': A4_HEIGHT_PX},  # A4 size in pixels at 96 DPI
+        device_scale_factor=scale
+    )
+    await page.set_content(html_content)
+    await page.evaluate("document.fonts.ready.then(() => true)")
+    total_height = await page.evaluate("document.documentElement.scrollHeight")
+    
+    # Capture one A4-sized slice at a time so no full-paper bitmap is ever decoded
+    pages = []
+    for top in range(0, total_height, A4_HEIGHT_PX):
+        height = min(A4_HEIGHT_PX, total_height - top)
+        shot = await page.screenshot(
+            clip={'x': 0, 'y': top, 'width': A4_WIDTH_PX, 'height': height},
+            full_page=True,
+            type='jpeg',
+            quality=BROWSER_PDF_JPEG_QUALITY
+        )
+        img = Image.open(io.BytesIO(shot)).convert('RGB')
+        if height < A4_HEIGHT_PX:
+            # Pad the last slice to a full page so every page prints at A4
+            padded = Image.new('RGB', (img.width, round(A4_HEIGHT_PX * scale)), 'white')
+            padded.paste(img, (0, 0))
+            img = padded
+        pages.append(img)
     
-    # Save as PDF directly
     buffer = io.BytesIO()
-    img.save(buffer, format='PDF', resolution=100.0)
+    pages[0].save(
+        buffer,
+        format='PDF',
+        resolution=float(BROWSER_PDF_IMAGE_DPI),
+        save_all=True,
+        append_images=pages[1:],
+        quality=BROWSER_PDF_JPEG_QUALITY
+    )
     buffer.seek(0)
     return buffer.getvalue()
 
@@ -723,202 +1211,183 @@ def generate_pdf(paper: Dict[str, Any], include_answers: bool = False) -> bytes:
     return buffer.getvalue()
 
 
-def generate_receipt_pdf(transaction: Dict[str, Any]) -> bytes:
-    """Generate a professional receipt PDF for transactions"""
-    buffer = io.BytesIO()
-    doc = SimpleDocTemplate(
-        buffer,
-        pagesize=A4,
-        rightMargin=50,
-        leftMargin=50,
-        topMargin=40,
-        bottomMargin=40
-    )
-    
-    elements = []
-    styles = getSampleStyleSheet()
-    
-    # Title style
-    title_style = ParagraphStyle(
-        'ReceiptTitle',
-        parent=styles['Heading1'],
-        fontSize=24,
-        textColor=colors.HexColor('#2563eb'),
-        spaceAfter=12,
-        alignment=TA_CENTER,
-        fontName='Helvetica-Bold'
-    )
-    
-    # Receipt title
-    elements.append(Paragraph("PAYMENT RECEIPT", title_style))
-    elements.append(Spacer(1, 0.3 * inch))
-    
-    # Company/App info
-    company_style = ParagraphStyle(
-        'Company',
-        parent=styles['Normal'],
-        fontSize=14,
-        textColor=colors.black,
-        alignment=TA_CENTER,
-        fontName='Helvetica-Bold'
-    )
-    elements.append(Paragraph("SOS-Tools - Exam Question Paper Generator", company_style))
-    elements.append(Spacer(1, 0.3 * inch))
-    
-    # Transaction details table
-    transaction_data = [
-        ['Receipt Number:', transaction['transaction_number']],
-        ['Transaction ID:', transaction['id']],
-        ['Date:', datetime.fromisoformat(transaction['created_at']).strftime('%d-%b-%Y %I:%M %p')],
-        ['Payment Status:', transaction['status'].upper()],
-    ]
-    
-    transaction_table = Table(transaction_data, colWidths=[2.5*inch, 4*inch])
-    transaction_table.setStyle(TableStyle([
-        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-        ('FONTNAME', (1, 0), (1, -1), 'Helvetica'),
-        ('FONTSIZE', (0, 0), (-1, -1), 11),
-        ('TEXTCOLOR', (0, 0), (0, -1), colors.HexColor('#475569')),
-        ('TEXTCOLOR', (1, 0), (1, -1), colors.black),
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-        ('TOPPADDING', (0, 0), (-1, -1), 8),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-    ]))
-    elements.append(transaction_table)
-    elements.append(Spacer(1, 0.3 * inch))
-    
-    # Divider
-    elements.append(Paragraph("<hr width='100%' color='#e2e8f0'/>", styles['Normal']))
-    elements.append(Spacer(1, 0.2 * inch))
-    
-    # Customer details
-    customer_heading = ParagraphStyle(
-        'SectionHeading',
-        parent=styles['Heading2'],
-        fontSize=14,
-        textColor=colors.HexColor('#1e293b'),
-        spaceAfter=8,
-        fontName='Helvetica-Bold'
-    )
-    elements.append(Paragraph("Customer Details", customer_heading))
-    
-    customer_data = [
-        ['Name:', transaction['user_name']],
-        ['Email:', transaction['user_email']],
-        ['Mobile:', transaction.get('user_mobile', 'N/A')],
-    ]
-    
-    customer_table = Table(customer_data, colWidths=[2.5*inch, 4*inch])
-    customer_table.setStyle(TableStyle([
-        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-        ('FONTNAME', (1, 0), (1, -1), 'Helvetica'),
-        ('FONTSIZE', (0, 0), (-1, -1), 11),
-        ('TEXTCOLOR', (0, 0), (0, -1), colors.HexColor('#475569')),
-        ('TEXTCOLOR', (1, 0), (1, -1), colors.black),
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-        ('TOPPADDING', (0, 0), (-1, -1), 8),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-    ]))
-    elements.append(customer_table)
-    elements.append(Spacer(1, 0.3 * inch))
-    
-    # Divider
-    elements.append(Paragraph("<hr width='100%' color='#e2e8f0'/>", styles['Normal']))
-    elements.append(Spacer(1, 0.2 * inch))
-    
-    # Subscription details
-    elements.append(Paragraph("Subscription Details", customer_heading))
-    
-    subscription_data = [
-        ['Plan:', transaction['plan_name']],
-        ['Validity:', f"{datetime.fromisoformat(transaction['validity_start']).strftime('%d-%b-%Y')} to {datetime.fromisoformat(transaction['validity_end']).strftime('%d-%b-%Y')}"],
-        ['Duration:', f"{(datetime.fromisoformat(transaction['validity_end']) - datetime.fromisoformat(transaction['validity_start'])).days} days"],
-    ]
-    
-    subscription_table = Table(subscription_data, colWidths=[2.5*inch, 4*inch])
-    subscription_table.setStyle(TableStyle([
-        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-        ('FONTNAME', (1, 0), (1, -1), 'Helvetica'),
-        ('FONTSIZE', (0, 0), (-1, -1), 11),
-        ('TEXTCOLOR', (0, 0), (0, -1), colors.HexColor('#475569')),
-        ('TEXTCOLOR', (1, 0), (1, -1), colors.black),
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-        ('TOPPADDING', (0, 0), (-1, -1), 8),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-    ]))
-    elements.append(subscription_table)
-    elements.append(Spacer(1, 0.3 * inch))
-    
-    # Divider
-    elements.append(Paragraph("<hr width='100%' color='#e2e8f0'/>", styles['Normal']))
-    elements.append(Spacer(1, 0.2 * inch))
-    
-    # Payment details
-    elements.append(Paragraph("Payment Details", customer_heading))
-    
-    payment_data = [
-        ['Amount:', f"₹{transaction['amount']:.2f}"],
-        ['Currency:', transaction['currency']],
-        ['Payment Method:', transaction['payment_method']],
+# Receipt layout never changes, so its geometry is computed once at import and every
+# receipt only replays it (as a PDF form XObject) and stamps the transaction fields.
+RECEIPT_LABEL_COLOR = colors.HexColor('#475569')
+RECEIPT_HEADING_COLOR = colors.HexColor('#1e293b')
+RECEIPT_DIVIDER_COLOR = colors.HexColor('#e2e8f0')
+RECEIPT_VALUE_MAX_WIDTH = 4 * inch - 12
+
+def _build_receipt_layout():
+    """Compute the static receipt drawing ops and the position of every per-transaction field"""
+    page_width, page_height = A4
+    left = 50
+    content_width = page_width - 100
+    label_x = left + 6
+    value_x = left + 2.5 * inch + 6
+    row_height = 27
+    ops = []
+    fields = {}
+    
+    y = page_height - 40 - 24
+    ops.append(('text', 'Helvetica-Bold', 24, colors.HexColor('#2563eb'), page_width / 2, y, "PAYMENT RECEIPT", 'center'))
+    y -= 36 + 0.3 * inch
+    ops.append(('text', 'Helvetica-Bold', 14, colors.black, page_width / 2, y, "SOS-Tools - Exam Question Paper Generator", 'center'))
+    y -= 0.3 * inch + 10
+    
+    sections = [
+        (None, [('transaction_number', 'Receipt Number:'), ('id', 'Transaction ID:'),
+                ('date', 'Date:'), ('status', 'Payment Status:')]),
+        ("Customer Details", [('user_name', 'Name:'), ('user_email', 'Email:'), ('user_mobile', 'Mobile:')]),
+        ("Subscription Details", [('plan_name', 'Plan:'), ('validity', 'Validity:'), ('duration', 'Duration:')]),
+        ("Payment Details", [('amount', 'Amount:'), ('currency', 'Currency:'),
+                             ('payment_method', 'Payment Method:'), ('payment_id', None)]),
     ]
-    
-    if transaction.get('payment_id'):
-        payment_data.append(['Payment ID:', transaction['payment_id']])
-    
-    payment_table = Table(payment_data, colWidths=[2.5*inch, 4*inch])
-    payment_table.setStyle(TableStyle([
-        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-        ('FONTNAME', (1, 0), (1, -1), 'Helvetica'),
-        ('FONTSIZE', (0, 0), (-1, -1), 11),
-        ('TEXTCOLOR', (0, 0), (0, -1), colors.HexColor('#475569')),
-        ('TEXTCOLOR', (1, 0), (1, -1), colors.black),
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-        ('TOPPADDING', (0, 0), (-1, -1), 8),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-    ]))
-    elements.append(payment_table)
-    elements.append(Spacer(1, 0.5 * inch))
+    for idx, (heading, rows) in enumerate(sections):
+        if idx > 0:
+            y -= 0.2 * inch
+            ops.append(('line', left, y, left + content_width, y, RECEIPT_DIVIDER_COLOR, 1))
+            y -= 0.2 * inch + 14
+            ops.append(('text', 'Helvetica-Bold', 14, RECEIPT_HEADING_COLOR, left, y, heading, 'left'))
+            y -= 14
+        for field, label in rows:
+            y -= row_height
+            baseline = y + 10
+            # Optional rows (Payment ID) draw their own label only when the value exists
+            if label:
+                ops.append(('text', 'Helvetica-Bold', 11, RECEIPT_LABEL_COLOR, label_x, baseline, label, 'left'))
+            fields[field] = (label_x, value_x, baseline)
+        y -= 0.1 * inch
     
     # Total amount box
-    total_data = [['TOTAL AMOUNT PAID', f"₹{transaction['amount']:.2f}"]]
-    total_table = Table(total_data, colWidths=[4*inch, 2.5*inch])
-    total_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor('#dbeafe')),
-        ('FONTNAME', (0, 0), (-1, -1), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 14),
-        ('TEXTCOLOR', (0, 0), (-1, -1), colors.HexColor('#1e40af')),
-        ('ALIGN', (0, 0), (0, 0), 'LEFT'),
-        ('ALIGN', (1, 0), (1, 0), 'RIGHT'),
-        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-        ('TOPPADDING', (0, 0), (-1, -1), 12),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
-        ('BOX', (0, 0), (-1, -1), 2, colors.HexColor('#3b82f6')),
-    ]))
-    elements.append(total_table)
-    elements.append(Spacer(1, 0.5 * inch))
+    y -= 0.4 * inch + 40
+    box_width = 6.5 * inch
+    box_x = (page_width - box_width) / 2
+    ops.append(('rect', box_x, y, box_width, 40, colors.HexColor('#dbeafe'), colors.HexColor('#3b82f6'), 2))
+    ops.append(('text', 'Helvetica-Bold', 14, colors.HexColor('#1e40af'), box_x + 6, y + 15, "TOTAL AMOUNT PAID", 'left'))
+    fields['total'] = (None, box_x + box_width - 6, y + 15)
     
     # Footer note
-    footer_style = ParagraphStyle(
-        'Footer',
-        parent=styles['Normal'],
-        fontSize=9,
-        textColor=colors.HexColor('#64748b'),
-        alignment=TA_CENTER,
-        fontName='Helvetica'
-    )
-    elements.append(Paragraph("Thank you for your subscription!", footer_style))
-    elements.append(Spacer(1, 0.1 * inch))
-    elements.append(Paragraph("This is a computer-generated receipt and does not require a signature.", footer_style))
-    
-    # Build PDF
-    doc.build(elements)
-    buffer.seek(0)
+    y -= 0.5 * inch + 9
+    footer_color = colors.HexColor('#64748b')
+    ops.append(('text', 'Helvetica', 9, footer_color, page_width / 2, y, "Thank you for your subscription!", 'center'))
+    y -= 0.1 * inch + 11
+    ops.append(('text', 'Helvetica', 9, footer_color, page_width / 2, y,
+                "This is a computer-generated receipt and does not require a signature.", 'center'))
+    return ops, fields
+
+RECEIPT_LAYOUT_OPS, RECEIPT_FIELD_POSITIONS = _build_receipt_layout()
+
+def _draw_receipt_ops(c: canvas.Canvas, ops):
+    for op in ops:
+        if op[0] == 'text':
+            _, font, size, color, x, y, text, align = op
+            c.setFont(font, size)
+            c.setFillColor(color)
+            if align == 'center':
+                c.drawCentredString(x, y, text)
+            elif align == 'right':
+                c.drawRightString(x, y, text)
+            else:
+                c.drawString(x, y, text)
+        elif op[0] == 'line':
+            _, x1, y1, x2, y2, color, width = op
+            c.setStrokeColor(color)
+            c.setLineWidth(width)
+            c.line(x1, y1, x2, y2)
+        elif op[0] == 'rect':
+            _, x, y, width, height, fill, stroke, stroke_width = op
+            c.setFillColor(fill)
+            c.setStrokeColor(stroke)
+            c.setLineWidth(stroke_width)
+            c.rect(x, y, width, height, stroke=1, fill=1)
+
+def _receipt_field_values(transaction: Dict[str, Any]) -> Dict[str, str]:
+    validity_start = datetime.fromisoformat(transaction['validity_start'])
+    validity_end = datetime.fromisoformat(transaction['validity_end'])
+    amount = f"₹{transaction['amount']:.2f}"
+    return {
+        'transaction_number': transaction['transaction_number'],
+        'id': transaction['id'],
+        'date': datetime.fromisoformat(transaction['created_at']).strftime('%d-%b-%Y %I:%M %p'),
+        'status': transaction['status'].upper(),
+        'user_name': transaction['user_name'],
+        'user_email': transaction['user_email'],
+        'user_mobile': transaction.get('user_mobile') or 'N/A',
+        'plan_name': transaction['plan_name'],
+        'validity': f"{validity_start.strftime('%d-%b-%Y')} to {validity_end.strftime('%d-%b-%Y')}",
+        'duration': f"{(validity_end - validity_start).days} days",
+        'amount': amount,
+        'currency': transaction['currency'],
+        'payment_method': transaction['payment_method'],
+        'payment_id': transaction.get('payment_id') or '',
+        'total': amount,
+    }
+
+def generate_receipt_pdf(transaction: Dict[str, Any]) -> bytes:
+    """Generate a receipt PDF by stamping transaction fields onto the pre-built receipt layout"""
+    buffer = io.BytesIO()
+    c = canvas.Canvas(buffer, pagesize=A4)
+    c.setTitle(f"Receipt {transaction['transaction_number']}")
+    
+    c.beginForm('receipt_layout')
+    _draw_receipt_ops(c, RECEIPT_LAYOUT_OPS)
+    c.endForm()
+    c.doForm('receipt_layout')
+    
+    values = _receipt_field_values(transaction)
+    if values['payment_id']:
+        label_x, _, baseline = RECEIPT_FIELD_POSITIONS['payment_id']
+        c.setFont('Helvetica-Bold', 11)
+        c.setFillColor(RECEIPT_LABEL_COLOR)
+        c.drawString(label_x, baseline, 'Payment ID:')
+    
+    c.setFillColor(colors.black)
+    for field, (_, value_x, baseline) in RECEIPT_FIELD_POSITIONS.items():
+        if field == 'total':
+            continue
+        text = str(values[field])
+        # Shrink long values (emails, names) so they stay inside the value column
+        font_size = 11
+        while font_size > 7 and pdfmetrics.stringWidth(text, 'Helvetica', font_size) > RECEIPT_VALUE_MAX_WIDTH:
+            font_size -= 0.5
+        c.setFont('Helvetica', font_size)
+        c.drawString(value_x, baseline, text)
+    
+    _, total_x, total_baseline = RECEIPT_FIELD_POSITIONS['total']
+    c.setFont('Helvetica-Bold', 14)
+    c.setFillColor(colors.HexColor('#1e40af'))
+    c.drawRightString(total_x, total_baseline, values['total'])
+    
+    c.showPage()
+    c.save()
     return buffer.getvalue()
 
+def write_receipt_file(transaction: Dict[str, Any]) -> str:
+    """Render a transaction's receipt into RECEIPTS_DIR and return its path"""
+    os.makedirs(RECEIPTS_DIR, exist_ok=True)
+    receipt_path = os.path.join(RECEIPTS_DIR, f"{transaction['transaction_number']}.pdf")
+    with open(receipt_path, 'wb') as f:
+        f.write(generate_receipt_pdf(transaction))
+    return receipt_path
+
+def regenerate_receipts(transactions: List[Dict[str, Any]], missing_only: bool = True) -> tuple:
+    """Batch mode: write receipt files for many transactions.
+    Returns (written count, failures); a malformed transaction is recorded and skipped"""
+    written = 0
+    failures = []
+    for transaction in transactions:
+        try:
+            receipt_path = os.path.join(RECEIPTS_DIR, f"{transaction['transaction_number']}.pdf")
+            if missing_only and os.path.exists(receipt_path):
+                continue
+            write_receipt_file(transaction)
+            written += 1
+        except Exception as e:
+            logging.error(f"Receipt regeneration failed for transaction {transaction.get('id')}: {str(e)}")
+            failures.append({"transaction_id": transaction.get('id'), "error": str(e)})
+    return written, failures
+
 
 async def generate_questions_with_ai(paper_config: QuestionPaperGenerate) -> tuple:
     """Generate questions using OpenAI GPT-4o via Emergent LLM Key - Optimized for speed"""
@@ -983,13 +1452,285 @@ Generate standard {paper_config.exam_type} level questions in {paper_config.lang
         logging.error(f"Error generating questions: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to generate questions: {str(e)}")
 
+# ==================== PAPER STORAGE ====================
+
+PAPER_CONTENT_FIELDS = ("questions", "answer_key", "grading_index")
+# Metadata reads never pull content, whichever shape the paper is stored in
+PAPER_METADATA_PROJECTION = {"_id": 0, "questions": 0, "answer_key": 0, "grading_index": 0}
+
+def encode_paper_content(paper_id: str, questions: List[Dict[str, Any]], answer_key: List[Dict[str, Any]],
+                         grading_index: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Build a paper_contents document; only the questions are compressed, since submits and
+    answer reveals read answer_key/grading_index and must not inflate every question"""
+    content = {"paper_id": paper_id, "answer_key": answer_key, "grading_index": grading_index}
+    if PAPER_CONTENT_COMPRESSION == 'zlib':
+        payload = json.dumps(questions, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        content.update(encoding="zlib", payload=zlib.compress(payload, PAPER_CONTENT_ZLIB_LEVEL))
+    else:
+        content.update(encoding="none", questions=questions)
+    return content
+
+async def load_paper_content(paper_id: str, fields=PAPER_CONTENT_FIELDS) -> Dict[str, Any]:
+    """Requested content fields of a paper, from paper_contents or a not yet migrated paper"""
+    wants_questions = "questions" in fields
+    projection = {"_id": 0, "encoding": 1, **{field: 1 for field in fields}}
+    if wants_questions:
+        projection["payload"] = 1
+    stored = await db.paper_contents.find_one({"paper_id": paper_id}, projection)
+    if stored is None:
+        # Old shape: content still embedded in the question_papers document
+        return await db.question_papers.find_one({"id": paper_id}, {"_id": 0, **{f: 1 for f in fields}}) or {}
+    
+    if wants_questions and stored.get('encoding') == 'zlib':
+        stored['questions'] = json.loads(zlib.decompress(stored.pop('payload')))
+    return {field: stored[field] for field in fields if field in stored}
+
+async def load_answer(paper_id: str, question_id: str) -> Optional[Dict[str, Any]]:
+    """One answer key entry, selected by the server rather than loading the whole key"""
+    projection = {"_id": 0, "answer_key": {"$elemMatch": {"question_id": question_id}}}
+    stored = await db.paper_contents.find_one({"paper_id": paper_id}, projection)
+    if stored is None:
+        stored = await db.question_papers.find_one({"id": paper_id}, projection) or {}
+    answers = stored.get('answer_key') or []
+    return answers[0] if answers else None
+
+async def find_paper(query: Dict[str, Any], content_fields=(), projection: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    """Find a paper's metadata and attach the requested content fields"""
+    paper = await db.question_papers.find_one(query, projection or PAPER_METADATA_PROJECTION)
+    if paper and content_fields:
+        paper.update(await load_paper_content(paper['id'], content_fields))
+    return paper
+
+async def save_paper_content(paper_id: str, fields: Dict[str, Any]):
+    """Update uncompressed content fields (grading_index) in whichever shape the paper uses"""
+    result = await db.paper_contents.update_one({"paper_id": paper_id}, {"$set": fields})
+    if result.matched_count == 0:
+        await db.question_papers.update_one({"id": paper_id}, {"$set": fields})
+
+async def migrate_paper_contents(batch_size: int = 200) -> int:
+    """Move embedded content of old-shape papers into paper_contents; returns papers migrated"""
+    migrated = 0
+    papers = db.question_papers.find(
+        {"questions": {"$exists": True}},
+        {"_id": 0, "id": 1, "questions": 1, "answer_key": 1, "grading_index": 1}
+    ).batch_size(batch_size)
+    contents, metadata = [], []
+    async for paper in papers:
+        questions = paper.get('questions', [])
+        content = encode_paper_content(paper['id'], questions, paper.get('answer_key', []), paper.get('grading_index'))
+        contents.append(ReplaceOne({"paper_id": paper['id']}, content, upsert=True))
+        metadata.append(UpdateOne(
+            {"id": paper['id']},
+            {"$unset": {"questions": "", "answer_key": "", "grading_index": ""},
+             "$set": {"question_count": len(questions)}}
+        ))
+        if len(contents) >= batch_size:
+            # Content is written before it is removed, so readers always find it somewhere
+            await db.paper_contents.bulk_write(contents, ordered=False)
+            await db.question_papers.bulk_write(metadata, ordered=False)
+            migrated += len(contents)
+            contents, metadata = [], []
+    if contents:
+        await db.paper_contents.bulk_write(contents, ordered=False)
+        await db.question_papers.bulk_write(metadata, ordered=False)
+        migrated += len(contents)
+    return migrated
+
+@api_router.post("/admin/papers/migrate-content")
+async def run_paper_content_migration(current_user: Dict = Depends(get_current_user)):
+    """Admin moves embedded questions/answer keys of older papers into paper_contents"""
+    if current_user['role'] != 'admin':
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    papers_migrated = await migrate_paper_contents()
+    return {"message": f"Migrated {papers_migrated} papers", "papers_migrated": papers_migrated}
+
+# ==================== PDF CACHE ====================
+
+# Bounds concurrent renders (downloads and pre-renders share the same worker slots)
+_pdf_render_semaphore = asyncio.Semaphore(PDF_RENDER_CONCURRENCY)
+# Renders currently running, keyed by cache path, so a download awaits instead of re-rendering
+_pdf_renders_in_flight: Dict[str, asyncio.Task] = {}
+# paper_id -> number of evictions on this worker, so a render that outlives its paper skips the cache
+_pdf_cache_generation: Dict[str, int] = {}
+
+def pdf_cache_path(paper_id: str, include_answers: bool) -> str:
+    suffix = "answers" if include_answers else "paper"
+    return os.path.join(PDF_CACHE_DIR, f"{paper_id}_{suffix}.pdf")
+
+async def render_paper_pdf(paper: Dict[str, Any], include_answers: bool = False) -> bytes:
+    """Render a paper with the engine for its language, bounded by the render worker limit"""
+    async with _pdf_render_semaphore:
+        if paper.get('language', 'English').lower() == 'english':
+            # Use text-based PDF for English (CPU-bound, so keep it off the event loop)
+            return await asyncio.to_thread(generate_pdf, paper, include_answers)
+        # Use browser-based PDF for non-English languages (Hindi, Marathi, etc.)
+        return await generate_pdf_from_screenshot(paper, include_answers=include_answers)
+
+async def _render_and_cache_pdf(paper: Dict[str, Any], include_answers: bool, cache_path: str) -> bytes:
+    generation = _pdf_cache_generation.get(paper['id'], 0)
+    pdf_bytes = await render_paper_pdf(paper, include_answers=include_answers)
+    # The paper may have been deleted (here or on another worker) while it rendered
+    if _pdf_cache_generation.get(paper['id'], 0) != generation or not await db.question_papers.find_one(
+        {"id": paper['id']}, {"_id": 0, "id": 1}
+    ):
+        return pdf_bytes
+    try:
+        os.makedirs(PDF_CACHE_DIR, exist_ok=True)
+        # Write to a temp file first so readers never see a partial PDF
+        tmp_path = f"{cache_path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(pdf_bytes)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        logging.warning(f"Could not cache PDF {cache_path}: {str(e)}")
+    return pdf_bytes
+
+def _start_pdf_render(paper: Dict[str, Any], include_answers: bool) -> asyncio.Task:
+    cache_path = pdf_cache_path(paper['id'], include_answers)
+    task = _pdf_renders_in_flight.get(cache_path)
+    if task is None:
+        task = asyncio.create_task(_render_and_cache_pdf(paper, include_answers, cache_path))
+        _pdf_renders_in_flight[cache_path] = task
+        task.add_done_callback(lambda _: _pdf_renders_in_flight.pop(cache_path, None))
+    return task
+
+async def get_paper_pdf(paper: Dict[str, Any], include_answers: bool = False) -> bytes:
+    """Return a paper PDF from the cache, joining an in-flight render or starting one"""
+    cache_path = pdf_cache_path(paper['id'], include_answers)
+    if os.path.exists(cache_path):
+        with open(cache_path, 'rb') as f:
+            return f.read()
+    if 'questions' not in paper:
+        # Only a render needs the content; cached downloads are served from metadata alone
+        paper = {**paper, **await load_paper_content(paper['id'], ("questions", "answer_key"))}
+    # Shield so a client disconnect does not cancel a render other requests may be awaiting
+    return await asyncio.shield(_start_pdf_render(paper, include_answers))
+
+def _log_prerender_failure(task: asyncio.Task):
+    if not task.cancelled() and task.exception():
+        logging.error(f"Background PDF pre-render failed: {str(task.exception())}")
+
+def prerender_paper_pdfs(paper: Dict[str, Any]):
+    """Queue background renders of the question paper and answer key PDFs"""
+    for include_answers in (False, True):
+        _start_pdf_render(paper, include_answers).add_done_callback(_log_prerender_failure)
+
+def evict_paper_pdfs(paper_id: str):
+    _pdf_cache_generation[paper_id] = _pdf_cache_generation.get(paper_id, 0) + 1
+    for include_answers in (False, True):
+        try:
+            os.remove(pdf_cache_path(paper_id, include_answers))
+        except FileNotFoundError:
+            pass
+
+# ==================== LOGIN THROTTLING ====================
+
+# key -> timestamps of recent failures (memory store)
+_throttle_failures: Dict[str, deque] = {}
+_throttle_stats = {"allowed": 0, "rejected_ip": 0, "rejected_email": 0, "rejected_signup": 0,
+                   "failures": 0, "unknown_emails": 0}
+# Running average of a real bcrypt verification, used to pad unknown-email rejections
+_password_verify_seconds = 0.25
+
+def client_ip(request: Request) -> str:
+    if TRUST_FORWARDED_FOR:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+async def _recent_failures(key: str, now: float) -> List[float]:
+    cutoff = now - LOGIN_THROTTLE_WINDOW_SECONDS
+    if LOGIN_THROTTLE_STORE == 'mongo':
+        row = await db.login_throttle.find_one({"key": key}, {"_id": 0, "failures": 1})
+        return [t for t in (row or {}).get('failures', []) if t > cutoff]
+    failures = _throttle_failures.get(key)
+    if not failures:
+        return []
+    while failures and failures[0] <= cutoff:
+        failures.popleft()
+    return list(failures)
+
+def _backoff_remaining(failures: List[float], limit: int, now: float) -> float:
+    """Seconds until the next attempt is allowed (0 while under the limit)"""
+    if len(failures) < limit:
+        return 0
+    backoff = min(2 ** (len(failures) - limit), LOGIN_BACKOFF_MAX_SECONDS)
+    return max(failures[-1] + backoff - now, 0)
+
+async def check_throttle(limits: List[tuple]):
+    """Raise 429 before any password work if any (key, limit, stat) is backing off"""
+    now = time.time()
+    for key, limit, stat in limits:
+        retry_after = _backoff_remaining(await _recent_failures(key, now), limit, now)
+        if retry_after > 0:
+            _throttle_stats[stat] += 1
+            raise HTTPException(
+                status_code=429,
+                detail="Too many attempts. Please try again later.",
+                headers={"Retry-After": str(int(retry_after) + 1)}
+            )
+    _throttle_stats["allowed"] += 1
+
+async def record_throttle_failure(*keys: str):
+    now = time.time()
+    _throttle_stats["failures"] += 1
+    for key in keys:
+        if LOGIN_THROTTLE_STORE == 'mongo':
+            await db.login_throttle.update_one(
+                {"key": key},
+                {
+                    "$push": {"failures": {"$each": [now], "$slice": -100}},
+                    "$set": {"expires_at": datetime.now(timezone.utc) + timedelta(seconds=LOGIN_THROTTLE_WINDOW_SECONDS)}
+                },
+                upsert=True
+            )
+            continue
+        _throttle_failures.setdefault(key, deque(maxlen=100)).append(now)
+    # Drop idle keys so a spray of random emails cannot grow memory without bound
+    if len(_throttle_failures) > 100000:
+        cutoff = now - LOGIN_THROTTLE_WINDOW_SECONDS
+        for stale in [k for k, v in _throttle_failures.items() if not v or v[-1] <= cutoff]:
+            del _throttle_failures[stale]
+
+async def clear_throttle(key: str):
+    if LOGIN_THROTTLE_STORE == 'mongo':
+        await db.login_throttle.delete_one({"key": key})
+    else:
+        _throttle_failures.pop(key, None)
+
+async def reject_unknown_email(started_at: float):
+    """Fail like a wrong password would - same delay - but without spending CPU on bcrypt"""
+    _throttle_stats["unknown_emails"] += 1
+    await asyncio.sleep(max(_password_verify_seconds - (time.monotonic() - started_at), 0))
+    raise HTTPException(status_code=401, detail="Invalid email or password")
+
+def login_throttle_metrics() -> Dict[str, Any]:
+    return {
+        **_throttle_stats,
+        "store": LOGIN_THROTTLE_STORE,
+        "tracked_keys": len(_throttle_failures),
+        "password_verify_ms": round(_password_verify_seconds * 1000, 1)
+    }
+
 # ==================== AUTH ROUTES ====================
 
 @api_router.post("/auth/signup")
-async def signup(user_data: UserCreate):
+async def signup(user_data: UserCreate, request: Request):
+    # Checked before the bcrypt hash; only rejected signups count toward the tight limit
+    ip = client_ip(request)
+    signup_key = f"signup-ip:{ip}"
+    failed_signup_key = f"signup-failed-ip:{ip}"
+    await check_throttle([
+        (failed_signup_key, SIGNUP_MAX_FAILURES_PER_IP, "rejected_signup"),
+        (signup_key, SIGNUP_MAX_PER_IP, "rejected_signup")
+    ])
+    
     # Check if user exists
-    existing_user = await db.users.find_one({"email": user_data.email}, {"_id": 0})
+    existing_user = await db.users.find_one({"email": user_data.email}, {"_id": 0, "id": 1})
     if existing_user:
+        await record_throttle_failure(failed_signup_key)
         raise HTTPException(status_code=400, detail="Email already registered")
     
     # Create user
@@ -1000,34 +1741,66 @@ async def signup(user_data: UserCreate):
         role="user"
     )
     user_dict = user.model_dump()
-    user_dict['password'] = hash_password(user_data.password)
+    user_dict['password'] = await hash_password(user_data.password)
     
-    await db.users.insert_one(user_dict)
+    try:
+        await db.users.insert_one(user_dict)
+    except DuplicateKeyError:
+        # Concurrent signup with the same email (users.email is unique)
+        await record_throttle_failure(failed_signup_key)
+        raise HTTPException(status_code=400, detail="Email already registered")
+    await record_throttle_failure(signup_key)
+    await increment_counters(total_users=1)
     
-    # Create token
-    token = create_access_token({"sub": user.id, "email": user.email, "role": user.role})
+    # Create tokens
+    tokens = await issue_tokens(user_dict)
     
     return {
         "message": "User created successfully",
-        "token": token,
+        **tokens,
         "user": {"id": user.id, "email": user.email, "name": user.name, "role": user.role}
     }
 
 @api_router.post("/auth/login")
-async def login(credentials: UserLogin):
+async def login(credentials: UserLogin, request: Request):
+    global _password_verify_seconds
+    started_at = time.monotonic()
+    ip = client_ip(request)
+    ip_key = f"ip:{ip}"
+    email_key = f"email:{credentials.email.lower()}|{ip}"
+    # Rejected before any bcrypt work
+    await check_throttle([
+        (ip_key, LOGIN_MAX_FAILURES_PER_IP, "rejected_ip"),
+        (email_key, LOGIN_MAX_FAILURES_PER_EMAIL, "rejected_email")
+    ])
+    
     user = await db.users.find_one({"email": credentials.email}, {"_id": 0})
-    if not user or not verify_password(credentials.password, user['password']):
+    if not user:
+        await record_throttle_failure(ip_key, email_key)
+        await reject_unknown_email(started_at)
+    
+    verify_started_at = time.monotonic()
+    valid, new_hash = await verify_password(credentials.password, user['password'])
+    _password_verify_seconds = 0.9 * _password_verify_seconds + 0.1 * (time.monotonic() - verify_started_at)
+    if not valid:
+        await record_throttle_failure(ip_key, email_key)
         raise HTTPException(status_code=401, detail="Invalid email or password")
+    await clear_throttle(email_key)
+    
+    if new_hash:
+        # BCRYPT_ROUNDS changed since this password was hashed
+        await db.users.update_one({"id": user['id']}, {"$set": {"password": new_hash}})
+        invalidate_user_cache(user['id'])
     
     # Check if user account is active
     if not user.get('is_active', True):
         raise HTTPException(status_code=403, detail="Your account has been deactivated. Please contact support.")
     
-    token = create_access_token({"sub": user['id'], "email": user['email'], "role": user['role']})
+    tokens = await issue_tokens(user)
     
     return {
         "message": "Login successful",
-        "token": token,
+        **tokens,
         "user": {
             "id": user['id'],
             "email": user['email'],
@@ -1038,6 +1811,47 @@ async def login(credentials: UserLogin):
         }
     }
 
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
+@api_router.post("/auth/refresh")
+async def refresh_tokens(request_data: RefreshRequest):
+    """Exchange a refresh token for new tokens; each refresh token works once"""
+    token_hash = _hash_refresh_token(request_data.refresh_token)
+    stored = await db.refresh_tokens.find_one_and_update(
+        {"token_hash": token_hash, "revoked": False},
+        {"$set": {"revoked": True, "rotated_at": datetime.now(timezone.utc).isoformat()}},
+        projection={"_id": 0}
+    )
+    if not stored:
+        reused = await db.refresh_tokens.find_one({"token_hash": token_hash}, {"_id": 0, "family_id": 1})
+        if reused:
+            # A rotated token was presented again: assume it leaked and end that login
+            await db.refresh_tokens.update_many(
+                {"family_id": reused['family_id'], "revoked": False},
+                {"$set": {"revoked": True}}
+            )
+        raise HTTPException(status_code=401, detail="Invalid refresh token")
+    if stored['expires_at'].replace(tzinfo=timezone.utc) <= datetime.now(timezone.utc):
+        raise HTTPException(status_code=401, detail="Refresh token expired")
+    
+    # Read the user directly: a cached copy on this worker could predate a deactivation
+    user = await db.users.find_one({"id": stored['user_id']}, {"_id": 0})
+    if user is None:
+        raise HTTPException(status_code=401, detail="User not found")
+    if not user.get('is_active', True):
+        raise HTTPException(status_code=403, detail="Your account has been deactivated. Please contact support.")
+    
+    return await issue_tokens(user, family_id=stored['family_id'])
+
+@api_router.post("/auth/logout")
+async def logout(request_data: RefreshRequest):
+    await db.refresh_tokens.update_one(
+        {"token_hash": _hash_refresh_token(request_data.refresh_token)},
+        {"$set": {"revoked": True}}
+    )
+    return {"message": "Logged out"}
+
 @api_router.get("/auth/me")
 async def get_me(current_user: Dict = Depends(get_current_user)):
     return {
@@ -1059,109 +1873,217 @@ async def update_profile(name: str, current_user: Dict = Depends(get_current_use
         {"id": current_user['id']},
         {"$set": {"name": name}}
     )
+    invalidate_user_cache(current_user['id'])
     return {"message": "Profile updated successfully"}
 
-# ==================== QUESTION PAPER ROUTES ====================
+# ==================== PAPER QUOTA ====================
 
-@api_router.post("/papers/generate")
-async def generate_paper(paper_config: QuestionPaperGenerate, current_user: Dict = Depends(get_current_user)):
-    # Check if user has reached their limit (including deleted papers)
-    total_generated = current_user.get('total_papers_generated', 0)
-    papers_limit = current_user.get('papers_limit', 1)
-    
-    # If no subscription, check against free tier limit
-    if not current_user.get('subscription_plan'):
-        if total_generated >= current_user.get('free_papers_limit', 1):
-            raise HTTPException(
-                status_code=403,
-                detail="Free tier limit reached (1 paper). Please upgrade to generate more papers."
-            )
-    else:
-        # If has subscription but limit is not unlimited (-1)
-        if papers_limit != -1 and total_generated >= papers_limit:
-            raise HTTPException(
-                status_code=403,
-                detail=f"Subscription limit reached ({papers_limit} papers). Please upgrade your plan."
-            )
-    
-    # Generate questions using AI
-    questions, answer_key = await generate_questions_with_ai(paper_config)
-    
-    # Create question paper
-    paper = QuestionPaper(
-        user_id=current_user['id'],
-        exam_type=paper_config.exam_type,
-        subject=paper_config.subject,
-        topics=paper_config.topics,
-        paper_title=paper_config.paper_title,
-        total_marks=paper_config.total_marks,
-        duration_minutes=paper_config.duration_minutes,
-        language=paper_config.language,
-        questions=questions,
-        answer_key=answer_key,
-        school_name=paper_config.school_name,
-        exam_date=paper_config.exam_date,
-        max_marks=paper_config.max_marks,
-        time_allowed=paper_config.time_allowed,
-        instructions=paper_config.instructions
-    )
-    
-    paper_dict = paper.model_dump()
-    # Make a copy for MongoDB insertion (to avoid _id pollution)
-    paper_dict_for_db = paper_dict.copy()
-    await db.question_papers.insert_one(paper_dict_for_db)
-    
-    # Update user's paper counts - ALWAYS increment total_papers_generated
-    update_fields = {"$inc": {"total_papers_generated": 1}}
-    if not current_user.get('subscription_plan'):
-        update_fields["$inc"]["free_papers_used"] = 1
-    
-    await db.users.update_one(
-        {"id": current_user['id']},
-        update_fields
-    )
-    
+NO_SUBSCRIPTION = {"$in": [None, ""]}
+
+def _quota_filter(user_id: str, free_tier: bool) -> Dict[str, Any]:
+    """Matches the user only while they still have a paper left in their current tier"""
+    generated = {"$ifNull": ["$total_papers_generated", 0]}
+    if free_tier:
+        return {
+            "id": user_id,
+            "subscription_plan": NO_SUBSCRIPTION,
+            "$expr": {"$lt": [generated, {"$ifNull": ["$free_papers_limit", 1]}]}
+        }
     return {
-        "message": "Question paper generated successfully",
-        "paper": paper_dict
+        "id": user_id,
+        "subscription_plan": {"$nin": [None, ""]},
+        # -1 is unlimited
+        "$or": [
+            {"papers_limit": -1},
+            {"$expr": {"$lt": [generated, {"$ifNull": ["$papers_limit", 1]}]}}
+        ]
     }
 
-@api_router.get("/papers")
-async def get_papers(current_user: Dict = Depends(get_current_user)):
-    papers = await db.question_papers.find(
-        {"user_id": current_user['id']},
-        {"_id": 0, "questions": 0, "answer_key": 0}
-    ).sort("created_at", -1).to_list(100)
-    return {"papers": papers}
+def _quota_increments(free_tier: bool, step: int) -> Dict[str, int]:
+    increments = {"total_papers_generated": step}
+    if free_tier:
+        increments["free_papers_used"] = step
+    return increments
 
-@api_router.get("/papers/{paper_id}")
-async def get_paper(paper_id: str, current_user: Dict = Depends(get_current_user)):
-    paper = await db.question_papers.find_one(
-        {"id": paper_id, "user_id": current_user['id']},
-        {"_id": 0}
+async def reserve_paper_quota(user: Dict, paper_id: str) -> Dict[str, Any]:
+    """Atomically take one paper from the user's quota before generating; 403 when none is left"""
+    # The paper id lets the sweep tell a stored paper from a generation that died
+    reservation = {"id": str(uuid.uuid4()), "paper_id": paper_id, "reserved_at": datetime.now(timezone.utc)}
+    # current_user may be stale, so a miss is re-checked against the stored plan
+    free_tier = not user.get('subscription_plan')
+    for _ in range(2):
+        reservation["free_tier"] = free_tier
+        reserved = await db.users.find_one_and_update(
+            _quota_filter(user['id'], free_tier),
+            {"$inc": _quota_increments(free_tier, 1), "$push": {"quota_reservations": reservation}},
+            projection={"_id": 0, "id": 1}
+        )
+        if reserved:
+            invalidate_user_cache(user['id'])
+            return {**reservation, "user_id": user['id']}
+
+        stored = await db.users.find_one(
+            {"id": user['id']}, {"_id": 0, "subscription_plan": 1, "papers_limit": 1}
+        ) or {}
+        if (not stored.get('subscription_plan')) == free_tier:
+            break
+        free_tier = not free_tier
+
+    if not stored.get('subscription_plan'):
+        raise HTTPException(
+            status_code=403,
+            detail="Free tier limit reached (1 paper). Please upgrade to generate more papers."
+        )
+    raise HTTPException(
+        status_code=403,
+        detail=f"Subscription limit reached ({stored.get('papers_limit', 1)} papers). Please upgrade your plan."
+    )
+
+async def commit_paper_quota(reservation: Dict[str, Any]):
+    """Keep the reserved paper: the generated paper was stored"""
+    await db.users.update_one(
+        {"id": reservation['user_id']},
+        {"$pull": {"quota_reservations": {"id": reservation['id']}}}
+    )
+
+async def release_paper_quota(reservation: Dict[str, Any]) -> bool:
+    """Refund a reservation whose generation failed; only the first release refunds"""
+    result = await db.users.update_one(
+        {"id": reservation['user_id'], "quota_reservations.id": reservation['id']},
+        {"$inc": _quota_increments(reservation['free_tier'], -1),
+         "$pull": {"quota_reservations": {"id": reservation['id']}}}
+    )
+    invalidate_user_cache(reservation['user_id'])
+    return result.modified_count > 0
+
+async def release_stale_quota_reservations() -> int:
+    """Settle reservations left behind by a worker that died: refund them, or keep them
+    when the paper was stored before the worker could commit"""
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=QUOTA_RESERVATION_TIMEOUT_SECONDS)
+    released = 0
+    users = db.users.find(
+        {"quota_reservations.reserved_at": {"$lt": cutoff}},
+        {"_id": 0, "id": 1, "quota_reservations": 1}
+    )
+    async for user in users:
+        for reservation in user.get('quota_reservations', []):
+            reserved_at = reservation['reserved_at']
+            if reserved_at.tzinfo is None:
+                reserved_at = reserved_at.replace(tzinfo=timezone.utc)
+            if reserved_at >= cutoff:
+                continue
+            reservation = {**reservation, "user_id": user['id']}
+            stored = reservation.get('paper_id') and await db.question_papers.find_one(
+                {"id": reservation['paper_id']}, {"_id": 0, "id": 1}
+            )
+            if stored:
+                await commit_paper_quota(reservation)
+            elif await release_paper_quota(reservation):
+                released += 1
+    return released
+
+_quota_sweep_task: Optional[asyncio.Task] = None
+
+async def _quota_sweep_loop():
+    while True:
+        try:
+            released = await release_stale_quota_reservations()
+            if released:
+                logger.info(f"Refunded {released} stale paper quota reservations")
+        except Exception as e:
+            logging.error(f"Quota reservation sweep failed: {str(e)}")
+        await asyncio.sleep(QUOTA_SWEEP_INTERVAL_SECONDS)
+
+# ==================== QUESTION PAPER ROUTES ====================
+
+@api_router.post("/papers/generate")
+async def generate_paper(paper_config: QuestionPaperGenerate, current_user: Dict = Depends(get_current_user)):
+    # Take the paper from the quota (including deleted papers) before paying for the AI call
+    paper_id = str(uuid.uuid4())
+    reservation = await reserve_paper_quota(current_user, paper_id)
+    try:
+        # Generate questions using AI
+        questions, answer_key = await generate_questions_with_ai(paper_config)
+        
+        # Create question paper
+        paper = QuestionPaper(
+            id=paper_id,
+            user_id=current_user['id'],
+            exam_type=paper_config.exam_type,
+            subject=paper_config.subject,
+            topics=paper_config.topics,
+            paper_title=paper_config.paper_title,
+            total_marks=paper_config.total_marks,
+            duration_minutes=paper_config.duration_minutes,
+            language=paper_config.language,
+            questions=questions,
+            answer_key=answer_key,
+            school_name=paper_config.school_name,
+            exam_date=paper_config.exam_date,
+            max_marks=paper_config.max_marks,
+            time_allowed=paper_config.time_allowed,
+            instructions=paper_config.instructions
+        )
+        
+        paper_dict = paper.model_dump()
+        # Slim metadata for listings and quota checks; content is stored separately
+        paper_dict_for_db = {k: v for k, v in paper_dict.items() if k not in PAPER_CONTENT_FIELDS}
+        paper_dict_for_db['question_count'] = len(questions)
+        # Precompute grading data once so quiz submissions never re-normalize the answer key
+        grading_index = build_grading_index(questions, answer_key)
+        await db.paper_contents.insert_one(encode_paper_content(paper.id, questions, answer_key, grading_index))
+        try:
+            await db.question_papers.insert_one(paper_dict_for_db)
+        except BaseException:
+            # Without its metadata nothing can reach the content again
+            await db.paper_contents.delete_one({"paper_id": paper.id})
+            raise
+    except BaseException:
+        # Refund the paper on any failure, including a cancelled request
+        await release_paper_quota(reservation)
+        raise
+    await commit_paper_quota(reservation)
+    await increment_counters(total_papers=1)
+    await record_subject_terms(paper_config.subject, questions, answer_key)
+    
+    # Users almost always download right away, so start rendering both PDFs now
+    if PDF_PRERENDER_ENABLED:
+        prerender_paper_pdfs(paper_dict)
+    
+    return {
+        "message": "Question paper generated successfully",
+        "paper": paper_dict
+    }
+
+@api_router.get("/papers")
+async def get_papers(cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE,
+                     current_user: Dict = Depends(get_token_user)):
+    papers, next_cursor = await paginate(
+        db.question_papers,
+        {"user_id": current_user['id']},
+        PAPER_METADATA_PROJECTION,
+        cursor, limit
+    )
+    return {"papers": papers, "next_cursor": next_cursor}
+
+@api_router.get("/papers/{paper_id}")
+async def get_paper(paper_id: str, current_user: Dict = Depends(get_token_user)):
+    paper = await find_paper(
+        {"id": paper_id, "user_id": current_user['id']},
+        content_fields=("questions", "answer_key")
     )
     if not paper:
         raise HTTPException(status_code=404, detail="Paper not found")
     return paper
 
 @api_router.get("/papers/{paper_id}/download")
-async def download_paper(paper_id: str, include_answers: bool = False, current_user: Dict = Depends(get_current_user)):
-    paper = await db.question_papers.find_one(
-        {"id": paper_id, "user_id": current_user['id']},
-        {"_id": 0}
-    )
+async def download_paper(paper_id: str, include_answers: bool = False, current_user: Dict = Depends(get_token_user)):
+    paper = await find_paper({"id": paper_id, "user_id": current_user['id']})
     if not paper:
         raise HTTPException(status_code=404, detail="Paper not found")
     
-    # Check language and use appropriate PDF generation method
-    language = paper.get('language', 'English').lower()
-    
-    if language == 'english':
-        # Use text-based PDF for English
-        pdf_bytes = generate_pdf(paper, include_answers=include_answers)
-    else:
-        # Use screenshot-based PDF for non-English languages (Hindi, Marathi, etc.)
-        pdf_bytes = await generate_pdf_from_screenshot(paper, include_answers=include_answers)
+    # Served from the PDF cache when pre-rendered, otherwise rendered with the right engine
+    pdf_bytes = await get_paper_pdf(paper, include_answers=include_answers)
     
     # Return as downloadable file with ASCII-safe filename
     import urllib.parse
@@ -1180,23 +2102,13 @@ async def download_paper(paper_id: str, include_answers: bool = False, current_u
     )
 
 @api_router.get("/papers/{paper_id}/download-answers")
-async def download_answer_key(paper_id: str, current_user: Dict = Depends(get_current_user)):
-    paper = await db.question_papers.find_one(
-        {"id": paper_id, "user_id": current_user['id']},
-        {"_id": 0}
-    )
+async def download_answer_key(paper_id: str, current_user: Dict = Depends(get_token_user)):
+    paper = await find_paper({"id": paper_id, "user_id": current_user['id']})
     if not paper:
         raise HTTPException(status_code=404, detail="Paper not found")
     
-    # Check language and use appropriate PDF generation method
-    language = paper.get('language', 'English').lower()
-    
-    if language == 'english':
-        # Use text-based PDF for English
-        pdf_bytes = generate_pdf(paper, include_answers=True)
-    else:
-        # Use screenshot-based PDF for non-English languages
-        pdf_bytes = await generate_pdf_from_screenshot(paper, include_answers=True)
+    # Served from the PDF cache when pre-rendered, otherwise rendered with the right engine
+    pdf_bytes = await get_paper_pdf(paper, include_answers=True)
     
     # Return as downloadable file with ASCII-safe filename
     import urllib.parse
@@ -1219,6 +2131,11 @@ async def delete_paper(paper_id: str, current_user: Dict = Depends(get_current_u
     
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Paper not found")
+    await db.paper_contents.delete_one({"paper_id": paper_id})
+    await increment_counters(total_papers=-1)
+    await delete_paper_assignments(paper_id)
+    
+    evict_paper_pdfs(paper_id)
     
     # NOTE: We do NOT decrement total_papers_generated
     # This ensures users cannot bypass limits by deleting papers
@@ -1228,166 +2145,312 @@ async def delete_paper(paper_id: str, current_user: Dict = Depends(get_current_u
             {"id": current_user['id']},
             {"$inc": {"free_papers_used": -1}}
         )
+        invalidate_user_cache(current_user['id'])
     
     return {"message": "Paper deleted successfully"}
 
+async def delete_paper_assignments(paper_id: str):
+    """Remove assignments of a deleted paper with their members, results and leaderboards
+    (students' quiz attempts stay in their history)"""
+    assignment_ids = [
+        assignment['id']
+        async for assignment in db.assignments.find({"paper_id": paper_id}, {"_id": 0, "id": 1})
+    ]
+    if not assignment_ids:
+        return
+    await db.assignment_members.delete_many({"assignment_id": {"$in": assignment_ids}})
+    await db.assignment_results.delete_many({"assignment_id": {"$in": assignment_ids}})
+    await db.leaderboard_entries.delete_many({"scope": "assignment", "scope_id": {"$in": assignment_ids}})
+    await db.leaderboard_buckets.delete_many({"scope": "assignment", "scope_id": {"$in": assignment_ids}})
+    await db.assignments.delete_many({"id": {"$in": assignment_ids}})
+
 # ==================== QUIZ/PRACTICE ROUTES ====================
 
 class QuizSubmission(BaseModel):
     paper_id: str
     answers: Dict[str, Any]
+    assignment_id: Optional[str] = None  # Attempt a teacher's paper through an assignment
+    time_spent: Dict[str, float] = {}  # Seconds spent per question id
 
-def normalize_answer(answer: str) -> str:
-    """Normalize answer for flexible comparison"""
-    if not answer:
-        return ""
-    
-    answer = str(answer).strip().lower()
-    
-    # Remove common prefixes like "A)", "a)", "1.", etc.
-    import re
-    answer = re.sub(r'^[a-d]\)\s*', '', answer, flags=re.IGNORECASE)
-    answer = re.sub(r'^[1-4]\.\s*', '', answer)
-    answer = re.sub(r'^[a-d]\s*', '', answer, flags=re.IGNORECASE)
-    
-    # Remove extra whitespace
-    answer = ' '.join(answer.split())
-    
-    return answer
+# subject -> (loaded_at, idf, doc_count)
+_subject_idf_cache: Dict[str, tuple] = {}
+# paper_id -> (idf loaded_at, scorer), least recently used first
+_paper_scorer_cache: "OrderedDict[str, tuple]" = OrderedDict()
 
-def check_answer_match(user_answer: str, correct_answer: str, question_type: str) -> bool:
-    """Check if user answer matches correct answer with flexible matching"""
-    
-    # Normalize both answers
-    user_norm = normalize_answer(user_answer)
-    correct_norm = normalize_answer(correct_answer)
-    
-    # Exact match after normalization
-    if user_norm == correct_norm:
-        return True
-    
-    # For True/False questions - handle variations
-    if question_type == 'true_false':
-        # Check if answers are both true or both false
-        true_variations = ['true', 'सत्य', 'सही', 't', 'yes', 'y']
-        false_variations = ['false', 'असत्य', 'गलत', 'f', 'no', 'n']
-        
-        user_is_true = any(var in user_norm for var in true_variations)
-        user_is_false = any(var in user_norm for var in false_variations)
-        correct_is_true = any(var in correct_norm for var in true_variations)
-        correct_is_false = any(var in correct_norm for var in false_variations)
-        
-        if user_is_true and correct_is_true:
-            return True
-        if user_is_false and correct_is_false:
-            return True
-    
-    # For MCQ - check if the answer text is contained in either direction
-    if question_type == 'mcq':
-        # Sometimes user answers with just letter, sometimes with full text
-        if user_norm in correct_norm or correct_norm in user_norm:
-            return True
-        
-        # Extract just the answer text (without option labels)
-        user_parts = user_answer.split(')', 1)
-        correct_parts = correct_answer.split(')', 1)
-        
-        if len(user_parts) > 1 and len(correct_parts) > 1:
-            user_text = normalize_answer(user_parts[1])
-            correct_text = normalize_answer(correct_parts[1])
-            if user_text == correct_text:
-                return True
-    
-    # For short answer and essay - check similarity (at least 70% match)
-    if question_type in ['short_answer', 'essay']:
-        # Calculate simple similarity
-        words_user = set(user_norm.split())
-        words_correct = set(correct_norm.split())
-        
-        if len(words_user) == 0 or len(words_correct) == 0:
-            return False
-        
-        intersection = words_user.intersection(words_correct)
-        union = words_user.union(words_correct)
-        
-        similarity = len(intersection) / len(union) if len(union) > 0 else 0
-        
-        # If 70% or more words match, consider it correct
-        if similarity >= 0.7:
-            return True
-    
-    return False
+def subject_key(subject: str) -> str:
+    return (subject or '').strip().lower()
 
-@api_router.post("/quiz/submit")
-async def submit_quiz(submission: QuizSubmission, current_user: Dict = Depends(get_current_user)):
-    # Get paper
-    paper = await db.question_papers.find_one(
-        {"id": submission.paper_id, "user_id": current_user['id']},
-        {"_id": 0}
+# Document frequencies are one subject_term_df document per (subject, term), so a subject's
+# vocabulary never grows a single document or turns answer text into field names;
+# subject_term_stats only holds each subject's doc_count
+
+async def rebuild_subject_term_stats(subject: str) -> Dict[str, Any]:
+    """Recompute a subject's document frequencies from every stored answer key"""
+    doc_count = 0
+    df = Counter()
+    cursor = db.question_papers.find(
+        {"subject": {"$regex": f"^\\s*{re.escape(subject.strip())}\\s*$", "$options": "i"}},
+        {"_id": 0, "id": 1}
+    )
+    async for paper in cursor:
+        paper = await load_paper_content(paper['id'], ("questions", "answer_key"))
+        documents = subjective_answer_documents(paper.get('questions', []), paper.get('answer_key', []))
+        doc_count += len(documents)
+        df.update(term for document in documents for term in document)
+    
+    key = subject_key(subject)
+    rebuild_id = str(uuid.uuid4())
+    operations = [
+        UpdateOne({"subject": key, "term": term}, {"$set": {"df": n, "rebuild_id": rebuild_id}}, upsert=True)
+        for term, n in df.items()
+    ]
+    for start in range(0, len(operations), 1000):
+        await db.subject_term_df.bulk_write(operations[start:start + 1000], ordered=False)
+    # Terms no longer in any answer key were not touched by this rebuild
+    await db.subject_term_df.delete_many({"subject": key, "rebuild_id": {"$ne": rebuild_id}})
+    await db.subject_term_stats.update_one(
+        {"subject": key},
+        {"$set": {"doc_count": doc_count}, "$unset": {"df": ""}},
+        upsert=True
+    )
+    return {"subject": key, "doc_count": doc_count, "df": dict(df)}
+
+async def record_subject_terms(subject: str, questions: List[Dict[str, Any]], answer_key: List[Dict[str, Any]]):
+    """Add a new paper's subjective answers to its subject's document frequencies"""
+    documents = subjective_answer_documents(questions, answer_key)
+    if not documents:
+        return
+    key = subject_key(subject)
+    result = await db.subject_term_stats.update_one(
+        {"subject": key, "df": {"$exists": False}},
+        {"$inc": {"doc_count": len(documents)}}
+    )
+    if result.matched_count == 0:
+        # First paper seen for this subject (or stats in the old single-document shape):
+        # recount from every stored paper, which includes this one
+        await rebuild_subject_term_stats(subject)
+        return
+    df_inc = Counter(term for document in documents for term in document)
+    await db.subject_term_df.bulk_write([
+        UpdateOne({"subject": key, "term": term}, {"$inc": {"df": n}}, upsert=True)
+        for term, n in df_inc.items()
+    ], ordered=False)
+
+async def get_subject_idf(subject: str) -> tuple:
+    """Return (loaded_at, idf, doc_count) for a subject, reloaded after SUBJECT_IDF_TTL_SECONDS"""
+    key = subject_key(subject)
+    cached = _subject_idf_cache.get(key)
+    now = time.monotonic()
+    if cached and now - cached[0] < SUBJECT_IDF_TTL_SECONDS:
+        return cached
+    
+    stats = await db.subject_term_stats.find_one({"subject": key}, {"_id": 0, "doc_count": 1, "df": 1})
+    if stats is None or 'df' in stats:
+        stats = await rebuild_subject_term_stats(subject)
+    else:
+        stats['df'] = {
+            row['term']: row['df']
+            async for row in db.subject_term_df.find({"subject": key}, {"_id": 0, "term": 1, "df": 1})
+        }
+    entry = (now, compute_idf(stats['doc_count'], stats['df']), stats['doc_count'])
+    _subject_idf_cache[key] = entry
+    return entry
+
+async def get_subjective_scorer(paper_id: str, subject: str, grading_index: Dict[str, Any]) -> Optional[SubjectiveScorer]:
+    """Return the paper's vectorized answer key, or None when it has no subjective questions"""
+    if not has_subjective_answers(grading_index):
+        return None
+    
+    loaded_at, idf, doc_count = await get_subject_idf(subject)
+    cached = _paper_scorer_cache.get(paper_id)
+    if cached and cached[0] == loaded_at:
+        _paper_scorer_cache.move_to_end(paper_id)
+        return cached[1]
+    
+    scorer = SubjectiveScorer(compiled_key_from_index(grading_index), idf, doc_count)
+    _paper_scorer_cache[paper_id] = (loaded_at, scorer)
+    _paper_scorer_cache.move_to_end(paper_id)
+    while len(_paper_scorer_cache) > PAPER_SCORER_CACHE_SIZE:
+        _paper_scorer_cache.popitem(last=False)
+    return scorer
+
+async def get_grading_index(paper_id: str, paper: Dict[str, Any]) -> Dict[str, Any]:
+    """Return a paper's stored grading index, building and storing it for older papers"""
+    grading_index = paper.get('grading_index')
+    if is_current_grading_index(grading_index):
+        return grading_index
+    
+    # Papers generated before grading indexes existed (or with an old format): build once
+    content = await load_paper_content(paper_id, ("questions", "answer_key"))
+    grading_index = build_grading_index(content['questions'], content['answer_key'])
+    await save_paper_content(paper_id, {"grading_index": grading_index})
+    return grading_index
+
+async def grade_and_record_attempt(current_user: Dict, paper_id: str, answers: Dict[str, Any],
+                                   assignment_id: Optional[str] = None,
+                                   time_spent: Optional[Dict[str, float]] = None) -> Dict[str, Any]:
+    """Grade a set of answers, store the attempt and update every derived counter"""
+    # Students attempt a teacher's paper through an assignment; otherwise only own papers
+    assignment = None
+    paper_query = {"id": paper_id, "user_id": current_user['id']}
+    if assignment_id:
+        assignment = await get_accessible_assignment(assignment_id, current_user)
+        if assignment['paper_id'] != paper_id:
+            raise HTTPException(status_code=400, detail="Paper does not belong to this assignment")
+        paper_query = {"id": paper_id}
+    
+    # Get only the grading data (answer_key is returned for the results review)
+    paper = await find_paper(
+        paper_query,
+        content_fields=("grading_index", "answer_key"),
+        projection={"_id": 0, "id": 1, "subject": 1}
     )
     if not paper:
         raise HTTPException(status_code=404, detail="Paper not found")
     
-    # Calculate score
-    correct_answers = 0
-    total_questions = len(paper['questions'])
-    answer_key_dict = {ak['question_id']: ak for ak in paper['answer_key']}
-    
-    # Get question types
-    question_types = {q['id']: q['type'] for q in paper['questions']}
-    
-    for q_id, user_answer in submission.answers.items():
-        if q_id in answer_key_dict:
-            correct_answer = answer_key_dict[q_id]['correct_answer']
-            question_type = question_types.get(q_id, 'mcq')
-            
-            # Use flexible answer matching
-            if check_answer_match(user_answer, correct_answer, question_type):
-                correct_answers += 1
-    
-    percentage = (correct_answers / total_questions * 100) if total_questions > 0 else 0
+    # Calculate score with flexible answer matching (partial credit for subjective answers)
+    grading_index = await get_grading_index(paper_id, paper)
+    scorer = await get_subjective_scorer(paper_id, paper.get('subject', ''), grading_index)
+    graded = grade_with_index(grading_index, answers, scorer=scorer)
+    score = graded['score']
+    correct_answers = graded['correct_answers']
+    total_questions = graded['total_questions']
+    percentage = graded['percentage']
     
     # Create quiz attempt
     attempt = QuizAttempt(
         user_id=current_user['id'],
-        paper_id=submission.paper_id,
-        answers=submission.answers,
-        score=correct_answers,
+        paper_id=paper_id,
+        answers=answers,
+        score=score,
         total_questions=total_questions,
         correct_answers=correct_answers,
-        percentage=percentage
+        percentage=percentage,
+        assignment_id=assignment_id
     )
     
     attempt_dict = attempt.model_dump()
+    # Stats must exist before the attempt does, so a rebuild never reads an attempt that
+    # record_attempt_stats then increments again
+    await ensure_user_stats(current_user['id'])
     await db.quiz_attempts.insert_one(attempt_dict)
+    await increment_counters(total_attempts=1)
+    await record_attempt_stats(attempt_dict)
+    if assignment:
+        await record_assignment_result(assignment['id'], current_user, attempt_dict)
+    await record_attempt_leaderboards(current_user, attempt_dict)
+    await record_item_stats(paper_id, grading_index, answers, graded, time_spent or {})
     
+    return {
+        "attempt_id": attempt.id,
+        "score": score,
+        "total_questions": total_questions,
+        "percentage": round(percentage, 2),
+        "correct_answers": correct_answers,
+        "verdicts": graded['verdicts'],
+        "credits": graded['credits'],
+        "answer_key": paper['answer_key']
+    }
+
+@api_router.post("/quiz/submit")
+async def submit_quiz(submission: QuizSubmission, current_user: Dict = Depends(get_current_user)):
+    result = await grade_and_record_attempt(
+        current_user,
+        submission.paper_id,
+        submission.answers,
+        assignment_id=submission.assignment_id,
+        time_spent=submission.time_spent
+    )
     return {
         "message": "Quiz submitted successfully",
-        "result": {
-            "score": correct_answers,
-            "total_questions": total_questions,
-            "percentage": round(percentage, 2),
-            "correct_answers": correct_answers,
-            "answer_key": paper['answer_key']
-        }
+        "result": result
     }
 
 @api_router.get("/quiz/attempts")
-async def get_attempts(current_user: Dict = Depends(get_current_user)):
-    attempts = await db.quiz_attempts.find(
+async def get_attempts(cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE,
+                       current_user: Dict = Depends(get_token_user)):
+    attempts, next_cursor = await paginate(
+        db.quiz_attempts,
         {"user_id": current_user['id']},
-        {"_id": 0, "answers": 0}
-    ).sort("completed_at", -1).to_list(100)
-    return {"attempts": attempts}
+        {"_id": 0, "answers": 0},
+        cursor, limit, sort_field="completed_at"
+    )
+    return {"attempts": attempts, "next_cursor": next_cursor}
+
+def attempt_summary(attempt: Dict[str, Any]) -> Dict[str, Any]:
+    return {field: attempt[field] for field in RECENT_ATTEMPT_FIELDS}
+
+async def rebuild_user_stats(user_id: str) -> Dict[str, Any]:
+    """Materialize a user's quiz stats from their attempts, unless another rebuild got there first
+    
+    Stats are only ever inserted whole ($setOnInsert) and never removed. Attempts are inserted
+    only after ensure_user_stats has seen the stats document, so every attempt a rebuild can
+    read was stored before stats existed and is never also incremented by record_attempt_stats.
+    """
+    match = {"user_id": user_id}
+    totals = await db.quiz_attempts.aggregate([
+        {"$match": match},
+        {"$group": {
+            "_id": None,
+            "total_attempts": {"$sum": 1},
+            "percentage_sum": {"$sum": "$percentage"},
+            "highest_score": {"$max": "$percentage"}
+        }}
+    ]).to_list(1)
+    recent = await db.quiz_attempts.find(
+        match,
+        {"_id": 0, **{field: 1 for field in RECENT_ATTEMPT_FIELDS}}
+    ).sort("completed_at", -1).to_list(RECENT_ATTEMPTS_LIMIT)
+    
+    stats = {
+        "user_id": user_id,
+        "total_attempts": totals[0]['total_attempts'] if totals else 0,
+        "percentage_sum": totals[0]['percentage_sum'] if totals else 0,
+        "highest_score": totals[0]['highest_score'] if totals else 0,
+        "recent_attempts": recent
+    }
+    try:
+        return await db.user_stats.find_one_and_update(
+            {"user_id": user_id},
+            {"$setOnInsert": stats},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+            projection={"_id": 0}
+        )
+    except DuplicateKeyError:
+        # A concurrent rebuild inserted first; its document stands
+        return await db.user_stats.find_one({"user_id": user_id}, {"_id": 0})
+
+async def ensure_user_stats(user_id: str):
+    """Build the user's stats if missing; called before an attempt is inserted"""
+    if not await db.user_stats.find_one({"user_id": user_id}, {"_id": 0, "user_id": 1}):
+        await rebuild_user_stats(user_id)
+
+async def record_attempt_stats(attempt: Dict[str, Any]):
+    """Fold a new attempt (inserted after ensure_user_stats) into the user's materialized stats"""
+    update = {
+        "$inc": {"total_attempts": 1, "percentage_sum": attempt['percentage']},
+        "$max": {"highest_score": attempt['percentage']},
+        # Newest first, capped so the document never grows with history
+        "$push": {"recent_attempts": {
+            "$each": [attempt_summary(attempt)],
+            "$position": 0,
+            "$slice": RECENT_ATTEMPTS_LIMIT
+        }}
+    }
+    result = await db.user_stats.update_one({"user_id": attempt['user_id']}, update)
+    if result.matched_count == 0:
+        # Stats vanished after ensure_user_stats; a rebuild now reads this attempt itself
+        await rebuild_user_stats(attempt['user_id'])
 
 @api_router.get("/quiz/stats")
-async def get_stats(current_user: Dict = Depends(get_current_user)):
-    attempts = await db.quiz_attempts.find(
-        {"user_id": current_user['id']},
-        {"_id": 0}
-    ).to_list(1000)
+async def get_stats(current_user: Dict = Depends(get_token_user)):
+    stats = await db.user_stats.find_one({"user_id": current_user['id']}, {"_id": 0})
+    if stats is None:
+        stats = await rebuild_user_stats(current_user['id'])
     
-    if not attempts:
+    total_attempts = stats['total_attempts']
+    if not total_attempts:
         return {
             "total_attempts": 0,
             "average_score": 0,
@@ -1395,17 +2458,1033 @@ async def get_stats(current_user: Dict = Depends(get_current_user)):
             "recent_attempts": []
         }
     
-    total_attempts = len(attempts)
-    average_score = sum(a['percentage'] for a in attempts) / total_attempts
-    highest_score = max(a['percentage'] for a in attempts)
-    
     return {
         "total_attempts": total_attempts,
-        "average_score": round(average_score, 2),
-        "highest_score": round(highest_score, 2),
-        "recent_attempts": attempts[:5]
+        "average_score": round(stats['percentage_sum'] / total_attempts, 2),
+        "highest_score": round(stats['highest_score'], 2),
+        "recent_attempts": stats['recent_attempts']
+    }
+
+async def _stream_lines(chunks) -> Any:
+    """Split a streamed UTF-8 body into lines without buffering the whole upload"""
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    pending = ''
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split('\n')
+        for line in lines:
+            yield line + '\n'
+    pending += decoder.decode(b'', final=True)
+    if pending:
+        yield pending
+
+async def _parse_answer_sheets(chunks, input_format: str, question_ids: List[str]) -> Any:
+    """Yield (line_number, student_id, student_name, answers) for each sheet in a CSV/JSONL upload
+    
+    CSV needs a header with student_id (and optionally student_name); answer columns are
+    question ids ("q1") or 1-based question numbers ("1"). Blank cells count as unanswered.
+    JSONL lines look like {"student_id": ..., "student_name": ..., "answers": {...}}.
+    """
+    header = None
+    record = ''
+    line_number = 0
+    async for line in _stream_lines(chunks):
+        line_number += 1
+        if input_format == 'jsonl':
+            if not line.strip():
+                continue
+            try:
+                sheet = json.loads(line)
+            except json.JSONDecodeError:
+                yield line_number, None, None, {}
+                continue
+            if not isinstance(sheet, dict):
+                # Valid JSON but not a sheet object ([1], "x"): reported like any bad row
+                yield line_number, None, None, {}
+                continue
+            yield line_number, sheet.get('student_id'), sheet.get('student_name'), sheet.get('answers') or {}
+            continue
+        
+        # A quoted CSV field may span lines: keep reading until the quotes balance
+        record += line
+        if record.count('"') % 2:
+            continue
+        values = next(csv.reader([record]), [])
+        record = ''
+        if header is None:
+            header = [column.strip() for column in values]
+            continue
+        if not any(value.strip() for value in values):
+            continue
+        row = dict(zip(header, values))
+        answers = {}
+        for column, value in row.items():
+            if column in ('student_id', 'student_name') or not value.strip():
+                continue
+            if column.isdigit() and 0 < int(column) <= len(question_ids):
+                column = question_ids[int(column) - 1]
+            answers[column] = value.strip()
+        yield line_number, (row.get('student_id') or '').strip() or None, row.get('student_name'), answers
+
+def _grade_sheets(compiled_key: Dict[str, Dict[str, Any]], scorer: Optional[SubjectiveScorer],
+                  total_questions: int, sheets: List[tuple]) -> List[Dict[str, Any]]:
+    return [
+        summarize_verdicts(*grade_answers(compiled_key, answers, scorer), total_questions)
+        for _, _, _, answers in sheets
+    ]
+
+@api_router.post("/papers/{paper_id}/bulk-grade")
+async def bulk_grade(paper_id: str, request: Request, upload_format: Optional[str] = Query(None, alias="format"),
+                     current_user: Dict = Depends(get_current_user)):
+    """Grade a streamed CSV or JSONL of offline answer sheets and return a results CSV"""
+    paper = await find_paper(
+        {"id": paper_id, "user_id": current_user['id']},
+        content_fields=("grading_index",),
+        projection={"_id": 0, "id": 1, "subject": 1, "exam_type": 1}
+    )
+    if not paper:
+        raise HTTPException(status_code=404, detail="Paper not found")
+    
+    input_format = upload_format or ('jsonl' if 'json' in request.headers.get('content-type', '') else 'csv')
+    if input_format not in ('csv', 'jsonl'):
+        raise HTTPException(status_code=400, detail="Format must be csv or jsonl")
+    
+    grading_index = await get_grading_index(paper_id, paper)
+    compiled_key = compiled_key_from_index(grading_index)
+    scorer = await get_subjective_scorer(paper_id, paper.get('subject', ''), grading_index)
+    question_ids = [entry['id'] for entry in grading_index['answers']]
+    total_questions = grading_index['total_questions']
+    batch_id = str(uuid.uuid4())
+    graded_at = datetime.now(timezone.utc).isoformat()
+    
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(["student_id", "student_name", "score", "correct_answers", "total_questions", "percentage", "error"] + question_ids)
+    graded_count = 0
+    
+    async def flush(sheets: List[tuple]):
+        # Grade off the event loop, then write the whole batch in one round-trip
+        results = await asyncio.to_thread(_grade_sheets, compiled_key, scorer, total_questions, sheets)
+        documents = []
+        for (_, student_id, student_name, answers), result in zip(sheets, results):
+            writer.writerow([
+                student_id, student_name or '', result['score'], result['correct_answers'],
+                total_questions, round(result['percentage'], 2), ''
+            ] + [round(result['credits'][q_id], 2) for q_id in question_ids])
+            documents.append({
+                "id": str(uuid.uuid4()),
+                "batch_id": batch_id,
+                "paper_id": paper_id,
+                "user_id": current_user['id'],
+                "student_id": student_id,
+                "student_name": student_name,
+                "answers": answers,
+                "score": result['score'],
+                "correct_answers": result['correct_answers'],
+                "total_questions": total_questions,
+                "percentage": result['percentage'],
+                "graded_at": graded_at
+            })
+        if documents:
+            await db.bulk_grading_results.insert_many(documents, ordered=False)
+    
+    sheets = []
+    async for line_number, student_id, student_name, answers in _parse_answer_sheets(request.stream(), input_format, question_ids):
+        if not student_id or not isinstance(answers, dict):
+            writer.writerow([student_id or '', student_name or '', '', '', '', '', f"line {line_number}: missing student_id or invalid row"])
+            continue
+        sheets.append((line_number, str(student_id), student_name, answers))
+        if len(sheets) >= BULK_GRADING_BATCH_SIZE:
+            await flush(sheets)
+            graded_count += len(sheets)
+            sheets = []
+    if sheets:
+        await flush(sheets)
+        graded_count += len(sheets)
+    
+    safe_filename = f"{paper['exam_type']}_Results_{batch_id[:8]}.csv".replace(' ', '_')
+    return StreamingResponse(
+        iter([output.getvalue()]),
+        media_type="text/csv",
+        headers={
+            "Content-Disposition": f"attachment; filename={safe_filename}",
+            "X-Batch-Id": batch_id,
+            "X-Graded-Count": str(graded_count)
+        }
+    )
+
+# ==================== PRACTICE SESSION ROUTES ====================
+
+# Everything needed to attempt a paper - no answer key, grading index or question metadata
+PRACTICE_PAPER_PROJECTION = {
+    "_id": 0, "id": 1, "paper_title": 1, "exam_type": 1, "subject": 1, "language": 1,
+    "total_marks": 1, "duration_minutes": 1, "instructions": 1
+}
+PRACTICE_QUESTION_FIELDS = ("id", "type", "question", "options", "marks")
+# Paper content is written once at generation, so these identify a version of the practice payload
+PRACTICE_VERSION_FIELDS = ("created_at", "updated_at", "question_count")
+
+async def load_practice_questions(paper_id: str) -> List[Dict[str, Any]]:
+    content = await load_paper_content(paper_id, ("questions",))
+    return [
+        {field: question[field] for field in PRACTICE_QUESTION_FIELDS if field in question}
+        for question in content.get('questions', [])
+    ]
+
+async def find_practice_paper(paper_query: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    paper = await db.question_papers.find_one(paper_query, PRACTICE_PAPER_PROJECTION)
+    if paper:
+        paper['questions'] = await load_practice_questions(paper['id'])
+    return paper
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match uses weak comparison: any listed tag (W/ or not) or * matches"""
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in tags or any(tag.removeprefix('W/') == etag.removeprefix('W/') for tag in tags)
+
+async def _practice_paper_query(paper_id: str, assignment_id: Optional[str], current_user: Dict) -> Dict:
+    """Own papers, or a teacher's paper reached through an assignment"""
+    if assignment_id:
+        assignment = await get_accessible_assignment(assignment_id, current_user)
+        if assignment['paper_id'] != paper_id:
+            raise HTTPException(status_code=400, detail="Paper does not belong to this assignment")
+        return {"id": paper_id}
+    return {"id": paper_id, "user_id": current_user['id']}
+
+@api_router.get("/papers/{paper_id}/practice")
+async def get_practice_paper(paper_id: str, request: Request, assignment_id: Optional[str] = None,
+                             current_user: Dict = Depends(get_token_user)):
+    """Question-only payload for attempting a paper, revalidated with an ETag"""
+    paper_query = await _practice_paper_query(paper_id, assignment_id, current_user)
+    paper = await db.question_papers.find_one(
+        paper_query, {**PRACTICE_PAPER_PROJECTION, **{field: 1 for field in PRACTICE_VERSION_FIELDS}}
+    )
+    if not paper:
+        raise HTTPException(status_code=404, detail="Paper not found")
+    
+    # Tag from metadata alone, so a revalidation never loads or serializes the questions
+    version = json.dumps(paper, sort_keys=True, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    etag = '"' + hashlib.sha1(version).hexdigest() + '"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    
+    for field in PRACTICE_VERSION_FIELDS:
+        paper.pop(field, None)
+    paper['questions'] = await load_practice_questions(paper['id'])
+    body = json.dumps(paper, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@api_router.get("/papers/{paper_id}/answers/{question_id}")
+async def reveal_answer(paper_id: str, question_id: str, assignment_id: Optional[str] = None,
+                        current_user: Dict = Depends(get_token_user)):
+    """Answer and explanation for one question"""
+    paper_query = await _practice_paper_query(paper_id, assignment_id, current_user)
+    if assignment_id:
+        # Students only see assignment answers once they have submitted
+        submitted = await db.assignment_results.find_one(
+            {"assignment_id": assignment_id, "student_id": current_user['id']},
+            {"_id": 0, "assignment_id": 1}
+        )
+        if not submitted:
+            raise HTTPException(status_code=403, detail="Submit the assignment to see answers")
+    
+    paper = await db.question_papers.find_one(paper_query, {"_id": 0, "id": 1})
+    if not paper:
+        raise HTTPException(status_code=404, detail="Paper not found")
+    answer = await load_answer(paper_id, question_id)
+    if answer is None:
+        raise HTTPException(status_code=404, detail="Question not found")
+    return answer
+
+class PracticeSessionStart(BaseModel):
+    paper_id: str
+    assignment_id: Optional[str] = None
+
+class PracticeSessionSave(BaseModel):
+    answers: Dict[str, Any] = {}  # Only the answers changed since the last save
+    time_spent: Dict[str, float] = {}  # Running totals for the questions above
+    current_question: Optional[int] = None
+
+class PracticeSessionUnloadSave(PracticeSessionSave):
+    save_token: str  # From session start; the page-close request carries no access token
+
+class PracticeSessionFinalize(BaseModel):
+    answers: Dict[str, Any] = {}  # All answers; saves buffered by another worker may not be stored yet
+    time_spent: Dict[str, float] = {}
+
+# session_id -> pending {field: value} $set, merged until the next flush
+_session_pending_writes: Dict[str, Dict[str, Any]] = {}
+# session_id -> saves popped by a flush whose bulk_write has not finished yet
+_session_flushing: Dict[str, Dict[str, Any]] = {}
+# session_id -> owning user_id, so saves do not need a read per request
+_session_owners: "OrderedDict[str, str]" = OrderedDict()
+_session_flush_task: Optional[asyncio.Task] = None
+
+def _session_updates(save: Any) -> Dict[str, Any]:
+    """Turn a save payload into dotted $set fields (one per answered question)"""
+    updates = {}
+    for field, values in (("answers", save.answers), ("time_spent", save.time_spent)):
+        for q_id, value in values.items():
+            if not q_id or '.' in q_id or q_id.startswith('$'):
+                raise HTTPException(status_code=400, detail=f"Invalid question id: {q_id}")
+            updates[f"{field}.{q_id}"] = value
+    if getattr(save, 'current_question', None) is not None:
+        updates["current_question"] = save.current_question
+    return updates
+
+async def flush_session_writes(session_id: Optional[str] = None):
+    """Write coalesced session saves (one session, or all pending) in a single bulk_write"""
+    session_ids = [session_id] if session_id else list(_session_pending_writes)
+    batch = {}
+    for sid in session_ids:
+        updates = _session_pending_writes.pop(sid, None)
+        if updates:
+            batch[sid] = updates
+    if not batch:
+        return
+    
+    updated_at = datetime.now(timezone.utc).isoformat()
+    operations = [
+        UpdateOne({"id": sid, "status": "active"}, {"$set": {**updates, "updated_at": updated_at}})
+        for sid, updates in batch.items()
+    ]
+    # Visible to finalize while the write is outstanding, since it would miss a claimed session
+    for sid, updates in batch.items():
+        _session_flushing[sid] = updates
+    try:
+        await db.practice_sessions.bulk_write(operations, ordered=False)
+    except Exception:
+        # Put the saves back (newer ones win) so the next flush retries them
+        for sid, updates in batch.items():
+            _session_pending_writes[sid] = {**updates, **_session_pending_writes.get(sid, {})}
+        raise
+    finally:
+        for sid, updates in batch.items():
+            if _session_flushing.get(sid) is updates:
+                del _session_flushing[sid]
+
+async def _session_flush_loop():
+    while True:
+        await asyncio.sleep(SESSION_FLUSH_INTERVAL_SECONDS)
+        try:
+            await flush_session_writes()
+        except Exception as e:
+            logging.error(f"Practice session flush failed: {str(e)}")
+
+def _remember_session_owner(session_id: str, user_id: str):
+    _session_owners[session_id] = user_id
+    _session_owners.move_to_end(session_id)
+    while len(_session_owners) > SESSION_OWNER_CACHE_SIZE:
+        _session_owners.popitem(last=False)
+
+async def _check_session_owner(session_id: str, current_user: Dict):
+    owner = _session_owners.get(session_id)
+    if owner is None:
+        session = await db.practice_sessions.find_one(
+            {"id": session_id, "status": "active"},
+            {"_id": 0, "user_id": 1}
+        )
+        if not session:
+            raise HTTPException(status_code=404, detail="Practice session not found")
+        owner = session['user_id']
+        _remember_session_owner(session_id, owner)
+    if owner != current_user['id']:
+        raise HTTPException(status_code=404, detail="Practice session not found")
+
+def create_session_save_token(session_id: str, user_id: str) -> str:
+    """Token that only authorizes saves to one practice session (no "sub", so no other endpoint accepts it)"""
+    now = datetime.now(timezone.utc)
+    return jwt.encode({
+        "sid": session_id,
+        "uid": user_id,
+        "typ": "session_save",
+        "exp": now + timedelta(hours=SESSION_SAVE_TOKEN_EXPIRE_HOURS),
+        "iat_ms": int(now.timestamp() * 1000)
+    }, JWT_SECRET_KEY, algorithm=JWT_ALGORITHM)
+
+def session_save_token_user(session_id: str, save_token: str) -> str:
+    """Owner of the session a save token was issued for"""
+    try:
+        payload = jwt.decode(save_token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
+    except jwt.ExpiredSignatureError:
+        raise HTTPException(status_code=401, detail="Token expired")
+    except jwt.InvalidTokenError:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    if payload.get("typ") != "session_save" or payload.get("sid") != session_id:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    if payload.get("iat_ms", 0) < _token_revocations.get(payload["uid"], -1):
+        raise HTTPException(status_code=401, detail="Token revoked")
+    return payload["uid"]
+
+@api_router.post("/practice/sessions")
+async def start_practice_session(session_data: PracticeSessionStart, current_user: Dict = Depends(get_current_user)):
+    """Resume the user's open session for a paper, or start a new one"""
+    if session_data.assignment_id:
+        assignment = await get_accessible_assignment(session_data.assignment_id, current_user)
+        if assignment['paper_id'] != session_data.paper_id:
+            raise HTTPException(status_code=400, detail="Paper does not belong to this assignment")
+    else:
+        paper = await db.question_papers.find_one(
+            {"id": session_data.paper_id, "user_id": current_user['id']},
+            {"_id": 0, "id": 1}
+        )
+        if not paper:
+            raise HTTPException(status_code=404, detail="Paper not found")
+    
+    now = datetime.now(timezone.utc).isoformat()
+    session = await db.practice_sessions.find_one_and_update(
+        {
+            "user_id": current_user['id'],
+            "paper_id": session_data.paper_id,
+            "assignment_id": session_data.assignment_id,
+            "status": "active"
+        },
+        {"$setOnInsert": {
+            "id": str(uuid.uuid4()),
+            "answers": {},
+            "time_spent": {},
+            "current_question": 0,
+            "created_at": now,
+            "updated_at": now
+        }},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+        projection={"_id": 0}
+    )
+    _remember_session_owner(session['id'], current_user['id'])
+    
+    # Overlay saves from this worker that have not been flushed yet
+    for field, value in _session_pending_writes.get(session['id'], {}).items():
+        if '.' in field:
+            parent, q_id = field.split('.', 1)
+            session[parent][q_id] = value
+        else:
+            session[field] = value
+    return {"session": session, "save_token": create_session_save_token(session['id'], current_user['id'])}
+
+@api_router.patch("/practice/sessions/{session_id}")
+async def save_practice_session(session_id: str, save: PracticeSessionSave, current_user: Dict = Depends(get_current_user)):
+    """Autosave changed answers; writes are coalesced and flushed periodically"""
+    await _check_session_owner(session_id, current_user)
+    updates = _session_updates(save)
+    if updates:
+        _session_pending_writes.setdefault(session_id, {}).update(updates)
+    return {"message": "Saved"}
+
+@api_router.post("/practice/sessions/{session_id}/unload-save")
+async def unload_save_practice_session(session_id: str, save: PracticeSessionUnloadSave):
+    """Last autosave sent as the page closes, authorized by the session's save token"""
+    user_id = session_save_token_user(session_id, save.save_token)
+    await _check_session_owner(session_id, {"id": user_id})
+    updates = _session_updates(save)
+    if updates:
+        _session_pending_writes.setdefault(session_id, {}).update(updates)
+    return {"message": "Saved"}
+
+@api_router.post("/practice/sessions/{session_id}/finalize")
+async def finalize_practice_session(session_id: str, final: PracticeSessionFinalize, current_user: Dict = Depends(get_current_user)):
+    """Grade the stored session answers and record the attempt"""
+    await _check_session_owner(session_id, current_user)
+    final_updates = _session_updates(final)
+    # Saves still buffered or mid-flush in this worker go into the claim itself,
+    # oldest first, so none of them can miss the session once it stops being active
+    updates = {
+        **_session_flushing.get(session_id, {}),
+        **_session_pending_writes.pop(session_id, {}),
+        **final_updates
+    }
+    
+    # Claim the session so a double submit cannot record two attempts
+    session = await db.practice_sessions.find_one_and_update(
+        {"id": session_id, "user_id": current_user['id'], "status": "active"},
+        {"$set": {**updates, "status": "grading", "updated_at": datetime.now(timezone.utc).isoformat()}},
+        return_document=ReturnDocument.AFTER,
+        projection={"_id": 0}
+    )
+    if not session:
+        raise HTTPException(status_code=409, detail="Practice session already submitted")
+    _session_owners.pop(session_id, None)
+    
+    try:
+        result = await grade_and_record_attempt(
+            current_user,
+            session['paper_id'],
+            session.get('answers', {}),
+            assignment_id=session.get('assignment_id'),
+            time_spent=session.get('time_spent', {})
+        )
+    except Exception:
+        await db.practice_sessions.update_one({"id": session_id}, {"$set": {"status": "active"}})
+        raise
+    
+    await db.practice_sessions.update_one(
+        {"id": session_id},
+        {"$set": {
+            "status": "completed",
+            "attempt_id": result['attempt_id'],
+            "completed_at": datetime.now(timezone.utc).isoformat()
+        }}
+    )
+    return {
+        "message": "Quiz submitted successfully",
+        "result": result
     }
 
+# ==================== ASSIGNMENT ROUTES ====================
+
+async def get_accessible_assignment(assignment_id: str, current_user: Dict) -> Dict[str, Any]:
+    """Return an assignment the user teaches or is a member of (404 otherwise)"""
+    assignment = await db.assignments.find_one({"id": assignment_id}, {"_id": 0})
+    if not assignment:
+        raise HTTPException(status_code=404, detail="Assignment not found")
+    if assignment['teacher_id'] != current_user['id']:
+        member = await db.assignment_members.find_one(
+            {"assignment_id": assignment_id, "student_id": current_user['id']},
+            {"_id": 1}
+        )
+        if not member:
+            raise HTTPException(status_code=404, detail="Assignment not found")
+    return assignment
+
+async def add_assignment_members(assignment_id: str, student_ids: List[str]) -> int:
+    """Enroll students (idempotent); returns how many were newly added"""
+    if not student_ids:
+        return 0
+    joined_at = datetime.now(timezone.utc).isoformat()
+    result = await db.assignment_members.bulk_write([
+        UpdateOne(
+            {"assignment_id": assignment_id, "student_id": student_id},
+            {"$setOnInsert": {"joined_at": joined_at}},
+            upsert=True
+        )
+        for student_id in student_ids
+    ], ordered=False)
+    if result.upserted_count:
+        await db.assignments.update_one(
+            {"id": assignment_id},
+            {"$inc": {"counters.members": result.upserted_count}}
+        )
+    return result.upserted_count
+
+async def record_assignment_result(assignment_id: str, student: Dict, attempt: Dict[str, Any]):
+    """Fold an attempt into the student's assignment result and the assignment counters"""
+    percentage = attempt['percentage']
+    previous = await db.assignment_results.find_one_and_update(
+        {"assignment_id": assignment_id, "student_id": student['id']},
+        {
+            "$inc": {"attempts": 1},
+            "$max": {"best_percentage": percentage},
+            "$set": {
+                "student_name": student['name'],
+                "student_email": student['email'],
+                "last_percentage": percentage,
+                "last_attempt_id": attempt['id'],
+                "last_attempt_at": attempt['completed_at']
+            }
+        },
+        upsert=True,
+        return_document=ReturnDocument.BEFORE,
+        projection={"_id": 0, "best_percentage": 1}
+    )
+    
+    inc = {
+        "counters.attempts": 1,
+        "counters.percentage_sum": percentage,
+        f"counters.score_buckets.{min(int(percentage // 10), 9)}": 1
+    }
+    if previous is None:
+        inc["counters.students_attempted"] = 1
+        inc["counters.best_percentage_sum"] = percentage
+    elif percentage > previous.get('best_percentage', 0):
+        # Keep the sum of every student's best score current without rescanning
+        inc["counters.best_percentage_sum"] = percentage - previous.get('best_percentage', 0)
+    await db.assignments.update_one(
+        {"id": assignment_id},
+        {"$inc": inc, "$max": {"counters.highest_percentage": percentage}}
+    )
+
+@api_router.post("/assignments")
+async def create_assignment(assignment_data: AssignmentCreate, current_user: Dict = Depends(get_current_user)):
+    """Teacher assigns one of their papers to students (by email and/or join code)"""
+    paper = await db.question_papers.find_one(
+        {"id": assignment_data.paper_id, "user_id": current_user['id']},
+        {"_id": 0, "id": 1}
+    )
+    if not paper:
+        raise HTTPException(status_code=404, detail="Paper not found")
+    
+    assignment = Assignment(
+        paper_id=assignment_data.paper_id,
+        teacher_id=current_user['id'],
+        title=assignment_data.title,
+        due_at=assignment_data.due_at
+    )
+    # Join codes are short, so a collision with an existing code is possible: draw a new one
+    for attempt in range(5):
+        assignment_dict = assignment.model_dump()
+        try:
+            await db.assignments.insert_one(assignment_dict.copy())
+            break
+        except DuplicateKeyError:
+            if attempt == 4:
+                raise HTTPException(status_code=503, detail="Could not allocate a join code, please retry")
+            assignment.join_code = Assignment.model_fields['join_code'].default_factory()
+    
+    emails = list(dict.fromkeys(assignment_data.student_emails))
+    students = await db.users.find(
+        {"email": {"$in": emails}},
+        {"_id": 0, "id": 1, "email": 1}
+    ).to_list(len(emails) or 1)
+    added = await add_assignment_members(assignment.id, [student['id'] for student in students])
+    assignment_dict['counters']['members'] = added
+    
+    found = {student['email'] for student in students}
+    return {
+        "message": "Assignment created successfully",
+        "assignment": assignment_dict,
+        "unknown_emails": [email for email in emails if email not in found]
+    }
+
+@api_router.post("/assignments/join")
+async def join_assignment(code: str, current_user: Dict = Depends(get_current_user)):
+    assignment = await db.assignments.find_one(
+        {"join_code": code.strip().upper()},
+        {"_id": 0, "id": 1, "title": 1}
+    )
+    if not assignment:
+        raise HTTPException(status_code=404, detail="Invalid assignment code")
+    await add_assignment_members(assignment['id'], [current_user['id']])
+    return {"message": "Joined assignment successfully", "assignment": assignment}
+
+@api_router.get("/assignments")
+async def get_assignments(current_user: Dict = Depends(get_token_user)):
+    """Assignments the user created (as teacher) and is enrolled in (as student)"""
+    created = await db.assignments.find(
+        {"teacher_id": current_user['id']},
+        {"_id": 0}
+    ).sort("created_at", -1).to_list(100)
+    
+    memberships = await db.assignment_members.find(
+        {"student_id": current_user['id']},
+        {"_id": 0, "assignment_id": 1}
+    ).to_list(100)
+    assigned = await db.assignments.find(
+        {"id": {"$in": [m['assignment_id'] for m in memberships]}},
+        {"_id": 0, "counters": 0, "join_code": 0}
+    ).sort("created_at", -1).to_list(100)
+    
+    return {"created": created, "assigned": assigned}
+
+@api_router.get("/assignments/{assignment_id}/paper")
+async def get_assignment_paper(assignment_id: str, current_user: Dict = Depends(get_token_user)):
+    """Students read the assigned paper (answers are only returned on submit)"""
+    assignment = await get_accessible_assignment(assignment_id, current_user)
+    paper = await find_practice_paper({"id": assignment['paper_id']})
+    if not paper:
+        raise HTTPException(status_code=404, detail="Paper not found")
+    return paper
+
+@api_router.get("/assignments/{assignment_id}/results")
+async def get_assignment_results(assignment_id: str, current_user: Dict = Depends(get_token_user)):
+    """Teacher view: aggregate counters plus one row per student who attempted"""
+    assignment = await db.assignments.find_one(
+        {"id": assignment_id, "teacher_id": current_user['id']},
+        {"_id": 0}
+    )
+    if not assignment:
+        raise HTTPException(status_code=404, detail="Assignment not found")
+    
+    counters = assignment['counters']
+    attempts = counters.get('attempts', 0)
+    students_attempted = counters.get('students_attempted', 0)
+    students = await db.assignment_results.find(
+        {"assignment_id": assignment_id},
+        {"_id": 0, "assignment_id": 0}
+    ).sort("best_percentage", -1).to_list(1000)
+    
+    return {
+        "assignment": {key: value for key, value in assignment.items() if key != 'counters'},
+        "summary": {
+            "members": counters.get('members', 0),
+            "students_attempted": students_attempted,
+            "attempts": attempts,
+            "average_percentage": round(counters.get('percentage_sum', 0) / attempts, 2) if attempts else 0,
+            "average_best_percentage": round(counters.get('best_percentage_sum', 0) / students_attempted, 2) if students_attempted else 0,
+            "highest_percentage": round(counters.get('highest_percentage', 0), 2),
+            # Attempts per 10-point percentage band ("0" = 0-9.99%, ..., "9" = 90-100%)
+            "score_distribution": {str(band): counters.get('score_buckets', {}).get(str(band), 0) for band in range(10)}
+        },
+        "students": students
+    }
+
+# ==================== ANALYTICS ROUTES ====================
+
+async def record_item_stats(paper_id: str, grading_index: Dict[str, Any], answers: Dict[str, Any],
+                            graded: Dict[str, Any], time_spent: Dict[str, float]):
+    """Fold one graded submission into the paper's per-question counters"""
+    operations = []
+    for entry in grading_index['answers']:
+        q_id = entry['id']
+        inc = {"attempts": 1}
+        if q_id in answers:
+            inc["answered"] = 1
+            inc["correct"] = int(graded['verdicts'][q_id])
+            inc["credit_sum"] = graded['credits'][q_id]
+            if entry['type'] == 'mcq':
+                inc[f"options.{option_label(answers[q_id])}"] = 1
+        seconds = time_spent.get(q_id)
+        if seconds and seconds > 0:
+            # Cap so one idle tab cannot skew the average
+            inc["time_sum"] = min(seconds, MAX_QUESTION_SECONDS)
+            inc["time_count"] = 1
+        operations.append(UpdateOne(
+            {"paper_id": paper_id, "question_id": q_id},
+            {"$inc": inc, "$setOnInsert": {"type": entry['type']}},
+            upsert=True
+        ))
+    if operations:
+        await db.paper_item_stats.bulk_write(operations, ordered=False)
+
+async def backfill_paper_item_stats(paper_id: str, attempts: int) -> bool:
+    """Rebuild one paper's per-question counters from its quiz_attempts"""
+    paper = await find_paper(
+        {"id": paper_id},
+        content_fields=("grading_index",),
+        projection={"_id": 0, "id": 1, "subject": 1}
+    )
+    if not paper:
+        return False
+    grading_index = await get_grading_index(paper_id, paper)
+    compiled_key = compiled_key_from_index(grading_index)
+    scorer = await get_subjective_scorer(paper_id, paper.get('subject', ''), grading_index)
+    
+    counters = {
+        q_id: {"type": compiled['type'], "attempts": attempts, "answered": 0,
+               "correct": 0, "credit_sum": 0.0, "options": {}}
+        for q_id, compiled in compiled_key.items()
+    }
+    # Each distinct answer to a question is graded once, however many attempts gave it
+    distinct_answers = db.quiz_attempts.aggregate([
+        {"$match": {"paper_id": paper_id}},
+        {"$project": {"answers": {"$objectToArray": "$answers"}}},
+        {"$unwind": "$answers"},
+        {"$group": {"_id": {"question_id": "$answers.k", "answer": "$answers.v"}, "count": {"$sum": 1}}}
+    ], allowDiskUse=True)
+    async for row in distinct_answers:
+        q_id, answer, count = row['_id']['question_id'], row['_id'].get('answer'), row['count']
+        compiled = compiled_key.get(q_id)
+        if compiled is None:
+            continue
+        verdicts, credits = grade_answers({q_id: compiled}, {q_id: answer}, scorer)
+        question = counters[q_id]
+        question["answered"] += count
+        question["correct"] += count * int(verdicts[q_id])
+        question["credit_sum"] += count * credits[q_id]
+        if compiled['type'] == 'mcq':
+            label = option_label(answer)
+            question["options"][label] = question["options"].get(label, 0) + count
+    
+    operations = [
+        UpdateOne({"paper_id": paper_id, "question_id": q_id}, {"$set": question}, upsert=True)
+        for q_id, question in counters.items()
+    ]
+    if operations:
+        await db.paper_item_stats.bulk_write(operations, ordered=False)
+    return True
+
+async def backfill_item_stats(paper_id: Optional[str] = None) -> int:
+    """Rebuild per-question counters from existing quiz_attempts; returns papers processed
+    
+    Papers are processed one at a time, so memory is bounded by one paper's distinct answers.
+    Time-to-answer is not recorded historically and is left untouched.
+    """
+    papers_processed = 0
+    attempt_counts = db.quiz_attempts.aggregate([
+        {"$match": {"paper_id": paper_id} if paper_id else {}},
+        {"$group": {"_id": "$paper_id", "attempts": {"$sum": 1}}}
+    ], allowDiskUse=True)
+    async for row in attempt_counts:
+        if await backfill_paper_item_stats(row['_id'], row['attempts']):
+            papers_processed += 1
+            _analytics_backfill_job["papers_processed"] = papers_processed
+    return papers_processed
+
+# State of this worker's analytics backfill, started by the admin endpoint
+_analytics_backfill_job: Dict[str, Any] = {"status": "idle"}
+_analytics_backfill_task: Optional[asyncio.Task] = None
+
+async def _run_analytics_backfill(paper_id: Optional[str]):
+    try:
+        papers_processed = await backfill_item_stats(paper_id)
+        _analytics_backfill_job.update(status="completed", papers_processed=papers_processed)
+    except Exception as e:
+        logging.error(f"Analytics backfill failed: {str(e)}")
+        _analytics_backfill_job.update(status="failed", error=str(e))
+    _analytics_backfill_job["finished_at"] = datetime.now(timezone.utc).isoformat()
+
+@api_router.get("/papers/{paper_id}/analytics")
+async def get_paper_analytics(paper_id: str, current_user: Dict = Depends(get_token_user)):
+    """Per-question difficulty, answer distribution and time-to-answer for a paper"""
+    query = {"id": paper_id}
+    if current_user['role'] != 'admin':
+        query["user_id"] = current_user['id']
+    paper = await find_paper(query, content_fields=("questions",), projection={"_id": 0, "id": 1})
+    if not paper:
+        raise HTTPException(status_code=404, detail="Paper not found")
+    
+    item_stats = {
+        item['question_id']: item
+        async for item in db.paper_item_stats.find({"paper_id": paper_id}, {"_id": 0})
+    }
+    
+    questions = []
+    for question in paper.get('questions', []):
+        item = item_stats.get(question['id'], {})
+        attempts = item.get('attempts', 0)
+        answered = item.get('answered', 0)
+        time_count = item.get('time_count', 0)
+        questions.append({
+            "question_id": question['id'],
+            "type": question['type'],
+            "attempts": attempts,
+            "answered": answered,
+            "correct": item.get('correct', 0),
+            # Classical item difficulty: share of all attempts that answered correctly
+            "difficulty": round(item.get('correct', 0) / attempts, 4) if attempts else None,
+            "average_credit": round(item.get('credit_sum', 0) / answered, 4) if answered else None,
+            "option_distribution": item.get('options', {}),
+            "average_time_seconds": round(item.get('time_sum', 0) / time_count, 1) if time_count else None
+        })
+    
+    return {
+        "paper_id": paper_id,
+        "attempts": max((q['attempts'] for q in questions), default=0),
+        "questions": questions
+    }
+
+@api_router.post("/admin/analytics/backfill", status_code=202)
+async def run_analytics_backfill(paper_id: Optional[str] = None, current_user: Dict = Depends(get_current_user)):
+    """Admin starts rebuilding per-question analytics from existing attempts (one paper or all)"""
+    global _analytics_backfill_task
+    if current_user['role'] != 'admin':
+        raise HTTPException(status_code=403, detail="Admin access required")
+    if _analytics_backfill_task and not _analytics_backfill_task.done():
+        raise HTTPException(status_code=409, detail="An analytics backfill is already running")
+    
+    _analytics_backfill_job.clear()
+    _analytics_backfill_job.update(
+        status="running", paper_id=paper_id, papers_processed=0,
+        started_at=datetime.now(timezone.utc).isoformat()
+    )
+    _analytics_backfill_task = asyncio.create_task(_run_analytics_backfill(paper_id))
+    return {"message": "Analytics backfill started", "job": _analytics_backfill_job}
+
+@api_router.get("/admin/analytics/backfill")
+async def get_analytics_backfill(current_user: Dict = Depends(get_token_user)):
+    """Progress of the analytics backfill started on this worker"""
+    if current_user['role'] != 'admin':
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return {"job": _analytics_backfill_job}
+
+# ==================== LEADERBOARD ROUTES ====================
+
+# One entry per user per leaderboard holding their best attempt, ranked on
+# (scope, scope_id, percentage desc, achieved_at asc) so reads never sort attempts.
+# A leaderboard_buckets document per leaderboard counts entries per whole percentage point,
+# so a rank only counts entries inside the caller's own point
+LEADERBOARD_MAX_LIMIT = 100
+
+def leaderboard_bucket(percentage: float) -> int:
+    return max(0, min(100, math.floor(percentage)))
+
+async def move_leaderboard_bucket(scope: str, scope_id: str, old_percentage: Optional[float], new_percentage: float):
+    """Count an entry in its new bucket (and out of its old one, or as a new participant)"""
+    new_bucket = leaderboard_bucket(new_percentage)
+    increments = {f"buckets.{new_bucket}": 1}
+    if old_percentage is None:
+        increments["participants"] = 1
+    elif leaderboard_bucket(old_percentage) == new_bucket:
+        return
+    else:
+        increments[f"buckets.{leaderboard_bucket(old_percentage)}"] = -1
+    await db.leaderboard_buckets.update_one(
+        {"scope": scope, "scope_id": scope_id},
+        {"$inc": increments},
+        upsert=True
+    )
+
+async def rebuild_leaderboard_buckets(match: Dict[str, Any]):
+    """Recount the bucket documents of every leaderboard matching `match`"""
+    boards: Dict[tuple, Dict[str, Any]] = {}
+    counts = db.leaderboard_entries.aggregate([
+        {"$match": match},
+        {"$group": {
+            "_id": {
+                "scope": "$scope", "scope_id": "$scope_id",
+                "bucket": {"$max": [0, {"$min": [100, {"$floor": "$percentage"}]}]}
+            },
+            "count": {"$sum": 1}
+        }}
+    ], allowDiskUse=True)
+    async for row in counts:
+        board = boards.setdefault((row['_id']['scope'], row['_id']['scope_id']), {"participants": 0, "buckets": {}})
+        board['buckets'][str(int(row['_id']['bucket']))] = row['count']
+        board['participants'] += row['count']
+    operations = [
+        ReplaceOne({"scope": scope, "scope_id": scope_id}, {"scope": scope, "scope_id": scope_id, **board}, upsert=True)
+        for (scope, scope_id), board in boards.items()
+    ]
+    for start in range(0, len(operations), 1000):
+        await db.leaderboard_buckets.bulk_write(operations[start:start + 1000], ordered=False)
+
+async def record_leaderboard_entry(scope: str, scope_id: str, user: Dict, attempt: Dict[str, Any]):
+    """Keep the user's best attempt on a paper/assignment leaderboard"""
+    key = {"scope": scope, "scope_id": scope_id, "user_id": user['id']}
+    entry = {
+        "user_name": user['name'],
+        "percentage": attempt['percentage'],
+        "score": attempt['score'],
+        "attempt_id": attempt['id'],
+        "achieved_at": attempt['completed_at']
+    }
+    # Only an improvement replaces the entry; an equal score keeps the earlier time
+    improved = {**key, "percentage": {"$lt": attempt['percentage']}}
+    try:
+        # Nothing matched and the upsert inserted: a new participant
+        previous = await db.leaderboard_entries.find_one_and_update(
+            improved, {"$set": entry}, upsert=True, projection={"_id": 0, "percentage": 1}
+        )
+    except DuplicateKeyError:
+        # The entry exists and is at least as good, or was inserted concurrently
+        previous = await db.leaderboard_entries.find_one_and_update(
+            improved, {"$set": entry}, projection={"_id": 0, "percentage": 1}
+        )
+        if previous is None:
+            return
+    await move_leaderboard_bucket(scope, scope_id, previous and previous['percentage'], attempt['percentage'])
+
+async def record_attempt_leaderboards(user: Dict, attempt: Dict[str, Any]):
+    await record_leaderboard_entry("paper", attempt['paper_id'], user, attempt)
+    if attempt.get('assignment_id'):
+        await record_leaderboard_entry("assignment", attempt['assignment_id'], user, attempt)
+
+async def get_leaderboard(scope: str, scope_id: str, user_id: str, limit: int) -> Dict[str, Any]:
+    """Top-N entries plus the caller's own rank, both answered from the ranking index"""
+    query = {"scope": scope, "scope_id": scope_id}
+    limit = max(1, min(limit, LEADERBOARD_MAX_LIMIT))
+    top = await db.leaderboard_entries.find(
+        query,
+        {"_id": 0, "user_id": 1, "user_name": 1, "percentage": 1, "score": 1, "achieved_at": 1}
+    ).sort([("percentage", -1), ("achieved_at", 1)]).limit(limit).to_list(limit)
+    for rank, entry in enumerate(top, start=1):
+        entry['rank'] = rank
+    
+    buckets = await db.leaderboard_buckets.find_one(query, {"_id": 0, "participants": 1, "buckets": 1})
+    if buckets is None and top:
+        # Leaderboard recorded before bucket counts existed
+        await rebuild_leaderboard_buckets(query)
+        buckets = await db.leaderboard_buckets.find_one(query, {"_id": 0, "participants": 1, "buckets": 1})
+    buckets = buckets or {}
+    
+    me = next((entry for entry in top if entry['user_id'] == user_id), None)
+    if me is None:
+        me = await db.leaderboard_entries.find_one(
+            {**query, "user_id": user_id},
+            {"_id": 0, "user_id": 1, "user_name": 1, "percentage": 1, "score": 1, "achieved_at": 1}
+        )
+        if me:
+            # Everyone in higher buckets, then only the entries ahead within the caller's own bucket
+            bucket = leaderboard_bucket(me['percentage'])
+            ahead = sum(n for b, n in buckets.get('buckets', {}).items() if int(b) > bucket)
+            bucket_floor = bucket if bucket > 0 else float('-inf')
+            bucket_ceiling = bucket + 1 if bucket < 100 else float('inf')
+            ahead += await db.leaderboard_entries.count_documents({**query, "$or": [
+                {"percentage": {"$gt": me['percentage'], "$lt": bucket_ceiling}},
+                {"percentage": me['percentage'], "achieved_at": {"$lt": me['achieved_at']}}
+            ], "percentage": {"$gte": bucket_floor}})
+            me['rank'] = ahead + 1
+    
+    return {
+        "participants": buckets.get('participants', 0),
+        "top": top,
+        "me": me
+    }
+
+async def backfill_leaderboards(paper_id: Optional[str] = None) -> int:
+    """Rebuild leaderboard entries from existing quiz_attempts; returns entries written"""
+    match = {"paper_id": paper_id} if paper_id else {}
+    written = 0
+    # (scope, scope_id) of every leaderboard written, so only their bucket counts are redone
+    boards = set()
+    for scope, field in (("paper", "$paper_id"), ("assignment", "$assignment_id")):
+        scope_match = {**match, "assignment_id": {"$ne": None}} if scope == "assignment" else match
+        operations = []
+        best_attempts = db.quiz_attempts.aggregate([
+            {"$match": scope_match},
+            {"$sort": {"percentage": -1, "completed_at": 1}},
+            {"$group": {
+                "_id": {"scope_id": field, "user_id": "$user_id"},
+                "percentage": {"$first": "$percentage"},
+                "score": {"$first": "$score"},
+                "attempt_id": {"$first": "$id"},
+                "achieved_at": {"$first": "$completed_at"}
+            }},
+            {"$lookup": {"from": "users", "localField": "_id.user_id", "foreignField": "id", "as": "user"}},
+            {"$project": {
+                "percentage": 1, "score": 1, "attempt_id": 1, "achieved_at": 1,
+                "user_name": {"$ifNull": [{"$arrayElemAt": ["$user.name", 0]}, ""]}
+            }}
+        ], allowDiskUse=True)
+        async for row in best_attempts:
+            boards.add((scope, row['_id']['scope_id']))
+            operations.append(UpdateOne(
+                {"scope": scope, "scope_id": row['_id']['scope_id'], "user_id": row['_id']['user_id']},
+                {"$set": {key: row[key] for key in ("user_name", "percentage", "score", "attempt_id", "achieved_at")}},
+                upsert=True
+            ))
+            if len(operations) >= 1000:
+                await db.leaderboard_entries.bulk_write(operations, ordered=False)
+                written += len(operations)
+                operations = []
+        if operations:
+            await db.leaderboard_entries.bulk_write(operations, ordered=False)
+            written += len(operations)
+    
+    if not paper_id:
+        await rebuild_leaderboard_buckets({})
+    elif boards:
+        await rebuild_leaderboard_buckets({"$or": [{"scope": scope, "scope_id": scope_id} for scope, scope_id in boards]})
+    return written
+
+@api_router.get("/papers/{paper_id}/leaderboard")
+async def get_paper_leaderboard(paper_id: str, limit: int = 10, current_user: Dict = Depends(get_token_user)):
+    """Best attempt per participant on a paper (owner or admin)"""
+    query = {"id": paper_id}
+    if current_user['role'] != 'admin':
+        query["user_id"] = current_user['id']
+    paper = await db.question_papers.find_one(query, {"_id": 0, "id": 1})
+    if not paper:
+        raise HTTPException(status_code=404, detail="Paper not found")
+    return await get_leaderboard("paper", paper_id, current_user['id'], limit)
+
+@api_router.get("/assignments/{assignment_id}/leaderboard")
+async def get_assignment_leaderboard(assignment_id: str, limit: int = 10, current_user: Dict = Depends(get_token_user)):
+    """Ranking of the assignment's students, visible to the teacher and members"""
+    await get_accessible_assignment(assignment_id, current_user)
+    return await get_leaderboard("assignment", assignment_id, current_user['id'], limit)
+
+@api_router.post("/admin/leaderboards/backfill")
+async def run_leaderboard_backfill(paper_id: Optional[str] = None, current_user: Dict = Depends(get_current_user)):
+    """Admin rebuilds leaderboards from existing attempts (one paper or all)"""
+    if current_user['role'] != 'admin':
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    entries_written = await backfill_leaderboards(paper_id)
+    return {"message": f"Leaderboards rebuilt ({entries_written} entries)", "entries_written": entries_written}
+
 # ==================== SUBSCRIPTION ROUTES ====================
 
 @api_router.get("/subscriptions/plans")
@@ -1518,7 +3597,7 @@ async def verify_payment(verification: PaymentVerification, current_user: Dict =
         # Update user subscription
         expiry_date = datetime.now(timezone.utc) + timedelta(days=plan['duration_days'])
         
-        await db.users.update_one(
+        previous = await db.users.find_one_and_update(
             {"id": current_user['id']},
             {
                 "$set": {
@@ -1527,8 +3606,13 @@ async def verify_payment(verification: PaymentVerification, current_user: Dict =
                     "papers_limit": plan['papers_limit'],
                     "total_papers_generated": 0  # Reset total count for new subscription
                 }
-            }
+            },
+            projection={"_id": 0, "subscription_plan": 1}
         )
+        invalidate_user_cache(current_user['id'])
+        await count_subscription_change(previous, verification.plan_id)
+        # Outstanding access tokens carry the old plan claim
+        await revoke_access_tokens(current_user['id'])
         
         return {
             "message": "Payment verified and subscription activated",
@@ -1545,32 +3629,119 @@ async def verify_payment(verification: PaymentVerification, current_user: Dict =
 # ==================== ADMIN ROUTES ====================
 
 @api_router.get("/admin/users")
-async def get_all_users(current_user: Dict = Depends(get_current_user)):
+async def get_all_users(cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE,
+                        current_user: Dict = Depends(get_token_user)):
     if current_user['role'] != 'admin':
         raise HTTPException(status_code=403, detail="Admin access required")
     
-    users = await db.users.find(
-        {},
-        {"_id": 0, "password": 0}
-    ).to_list(1000)
-    return {"users": users}
+    users, next_cursor = await paginate(db.users, {}, {"_id": 0, "password": 0}, cursor, limit)
+    return {"users": users, "next_cursor": next_cursor}
 
-@api_router.get("/admin/stats")
-async def get_admin_stats(current_user: Dict = Depends(get_current_user)):
+@api_router.get("/admin/metrics")
+async def get_admin_metrics(current_user: Dict = Depends(get_token_user)):
+    """In-process cache, queue and MongoDB pool/command metrics for this worker"""
     if current_user['role'] != 'admin':
         raise HTTPException(status_code=403, detail="Admin access required")
     
-    total_users = await db.users.count_documents({})
-    total_papers = await db.question_papers.count_documents({})
-    total_attempts = await db.quiz_attempts.count_documents({})
-    active_subscriptions = await db.users.count_documents({"subscription_plan": {"$ne": None}})
-    
     return {
-        "total_users": total_users,
-        "total_papers": total_papers,
-        "total_attempts": total_attempts,
-        "active_subscriptions": active_subscriptions
+        "pid": os.getpid(),
+        "user_cache": user_cache_metrics(),
+        "password_hashing": password_hash_metrics(),
+        "login_throttle": login_throttle_metrics(),
+        "mongo": mongo_metrics()
+    }
+
+ADMIN_COUNTER_FIELDS = ["total_users", "total_papers", "total_attempts", "active_subscriptions"]
+_admin_stats_cache: Dict[str, Any] = {"expires_at": 0, "stats": None}
+_counters_reconcile_task: Optional[asyncio.Task] = None
+# Identifies this worker as holder of the reconcile lease
+_counters_worker_id = str(uuid.uuid4())
+
+async def reconcile_counters() -> Dict[str, int]:
+    """Recount everything and overwrite the maintained counters (fixes drift)"""
+    stats = {
+        "total_users": await db.users.count_documents({}),
+        "total_papers": await db.question_papers.count_documents({}),
+        "total_attempts": await db.quiz_attempts.count_documents({}),
+        "active_subscriptions": await db.users.count_documents({"subscription_plan": {"$nin": [None, ""]}})
     }
+    await db.counters.update_one(
+        {"id": "admin_stats"},
+        {"$set": {**stats, "reconciled_at": datetime.now(timezone.utc).isoformat()}},
+        upsert=True
+    )
+    _admin_stats_cache["expires_at"] = 0
+    return stats
+
+async def increment_counters(**deltas: int):
+    result = await db.counters.update_one({"id": "admin_stats"}, {"$inc": deltas})
+    if result.matched_count == 0:
+        # First write since deploy: seed the counters from real counts
+        await reconcile_counters()
+
+async def count_subscription_change(previous_user: Optional[Dict], new_plan: Optional[str]):
+    """Adjust active_subscriptions when an update sets or removes a user's plan"""
+    if previous_user is None:
+        return
+    delta = int(bool(new_plan)) - int(bool(previous_user.get('subscription_plan')))
+    if delta:
+        await increment_counters(active_subscriptions=delta)
+
+async def acquire_reconcile_lease() -> bool:
+    """Hold the cluster-wide lease for the periodic recount; the holder renews it each cycle"""
+    now = datetime.now(timezone.utc)
+    try:
+        await db.counters.find_one_and_update(
+            {"id": "reconcile_lease", "$or": [{"expires_at": {"$lt": now}}, {"holder": _counters_worker_id}]},
+            # Outlives one interval, so only a dead holder loses it
+            {"$set": {"holder": _counters_worker_id, "expires_at": now + timedelta(seconds=2 * COUNTERS_RECONCILE_SECONDS)}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        # Another live worker holds the lease
+        return False
+    return True
+
+async def _counters_reconcile_loop():
+    while True:
+        try:
+            if await acquire_reconcile_lease():
+                await reconcile_counters()
+        except Exception as e:
+            logging.error(f"Counter reconciliation failed: {str(e)}")
+        await asyncio.sleep(COUNTERS_RECONCILE_SECONDS)
+
+@api_router.get("/admin/stats")
+async def get_admin_stats(current_user: Dict = Depends(get_token_user)):
+    if current_user['role'] != 'admin':
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    if _admin_stats_cache["expires_at"] > time.monotonic():
+        return _admin_stats_cache["stats"]
+    
+    counters = await db.counters.find_one({"id": "admin_stats"}, {"_id": 0})
+    if counters:
+        stats = {field: counters.get(field, 0) for field in ADMIN_COUNTER_FIELDS}
+    else:
+        # Not reconciled yet: collection metadata counts, subscriptions unknown until then
+        stats = {
+            "total_users": await db.users.estimated_document_count(),
+            "total_papers": await db.question_papers.estimated_document_count(),
+            "total_attempts": await db.quiz_attempts.estimated_document_count(),
+            "active_subscriptions": None
+        }
+    
+    _admin_stats_cache["stats"] = stats
+    _admin_stats_cache["expires_at"] = time.monotonic() + ADMIN_STATS_TTL_SECONDS
+    return stats
+
+@api_router.post("/admin/stats/reconcile")
+async def run_counters_reconcile(current_user: Dict = Depends(get_current_user)):
+    """Admin recounts the dashboard totals immediately"""
+    if current_user['role'] != 'admin':
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    return await reconcile_counters()
 
 @api_router.put("/admin/users/{user_id}/role")
 async def update_user_role(user_id: str, role: str, current_user: Dict = Depends(get_current_user)):
@@ -1584,6 +3755,9 @@ async def update_user_role(user_id: str, role: str, current_user: Dict = Depends
         {"id": user_id},
         {"$set": {"role": role}}
     )
+    invalidate_user_cache(user_id)
+    # Outstanding access tokens carry the old role
+    await revoke_access_tokens(user_id)
     
     return {"message": "User role updated successfully"}
 
@@ -1600,7 +3774,14 @@ async def update_user_status(user_id: str, is_active: bool, current_user: Dict =
         {"id": user_id},
         {"$set": {"is_active": is_active}}
     )
+    invalidate_user_cache(user_id)
+    if is_active:
+        # Tokens still carrying the deactivated claim would keep answering 403
+        await revoke_access_tokens(user_id)
+    else:
+        await revoke_user_sessions(user_id)
     
+    return {"message": "User status updated successfully"}
 
 class UserUpdateAdmin(BaseModel):
     free_papers_limit: Optional[int] = None
@@ -1619,7 +3800,8 @@ async def update_user_details(user_id: str, user_update: UserUpdateAdmin, curren
     if user_update.free_papers_limit is not None:
         update_fields["free_papers_limit"] = user_update.free_papers_limit
     if user_update.subscription_plan is not None:
-        update_fields["subscription_plan"] = user_update.subscription_plan
+        # An empty plan removes the subscription
+        update_fields["subscription_plan"] = user_update.subscription_plan or None
     if user_update.subscription_expiry is not None:
         update_fields["subscription_expiry"] = user_update.subscription_expiry
     if user_update.papers_limit is not None:
@@ -1628,13 +3810,19 @@ async def update_user_details(user_id: str, user_update: UserUpdateAdmin, curren
     if not update_fields:
         raise HTTPException(status_code=400, detail="No fields to update")
     
-    result = await db.users.update_one(
+    previous = await db.users.find_one_and_update(
         {"id": user_id},
-        {"$set": update_fields}
+        {"$set": update_fields},
+        projection={"_id": 0, "subscription_plan": 1}
     )
+    invalidate_user_cache(user_id)
     
-    if result.matched_count == 0:
+    if previous is None:
         raise HTTPException(status_code=404, detail="User not found")
+    if "subscription_plan" in update_fields:
+        await count_subscription_change(previous, update_fields["subscription_plan"])
+        # Outstanding access tokens carry the old plan claim
+        await revoke_access_tokens(user_id)
     
     return {"message": "User details updated successfully"}
 
@@ -1683,7 +3871,7 @@ async def create_plan(plan: SubscriptionPlanCreate, current_user: Dict = Depends
     return {"message": "Plan created successfully", "plan": plan_dict}
 
 @api_router.get("/admin/plans")
-async def get_all_plans(current_user: Dict = Depends(get_current_user)):
+async def get_all_plans(current_user: Dict = Depends(get_token_user)):
     if current_user['role'] != 'admin':
         raise HTTPException(status_code=403, detail="Admin access required")
     
@@ -1729,16 +3917,17 @@ async def delete_plan(plan_id: str, current_user: Dict = Depends(get_current_use
     return {"message": "Plan deactivated successfully"}
 
 @api_router.get("/admin/payments")
-async def get_payments(current_user: Dict = Depends(get_current_user)):
+async def get_payments(cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE,
+                       current_user: Dict = Depends(get_token_user)):
     if current_user['role'] != 'admin':
         raise HTTPException(status_code=403, detail="Admin access required")
     
-    payments = await db.payment_orders.find(
-        {},
-        {"_id": 0}
-    ).sort("created_at", -1).to_list(1000)
+    # Orders are keyed by the Razorpay order_id
+    payments, next_cursor = await paginate(
+        db.payment_orders, {}, {"_id": 0}, cursor, limit, id_field="order_id"
+    )
     
-    return {"payments": payments}
+    return {"payments": payments, "next_cursor": next_cursor}
 
 
 # ==================== TRANSACTION ROUTES ====================
@@ -1783,33 +3972,28 @@ async def create_transaction(transaction_data: TransactionCreate, current_user:
     
     transaction_dict = transaction.model_dump()
     
-    # Generate receipt PDF
-    receipt_pdf = generate_receipt_pdf(transaction_dict)
-    
-    # Save receipt to file system
-    receipts_dir = "/app/receipts"
-    os.makedirs(receipts_dir, exist_ok=True)
-    receipt_filename = f"{transaction_dict['transaction_number']}.pdf"
-    receipt_path = os.path.join(receipts_dir, receipt_filename)
-    
-    with open(receipt_path, 'wb') as f:
-        f.write(receipt_pdf)
-    
-    transaction_dict['receipt_url'] = f"/receipts/{receipt_filename}"
+    # Generate receipt PDF and save it to the file system
+    receipt_path = write_receipt_file(transaction_dict)
+    transaction_dict['receipt_url'] = f"/receipts/{os.path.basename(receipt_path)}"
     
     # Save transaction to database
     transaction_dict_for_db = transaction_dict.copy()
     await db.transactions.insert_one(transaction_dict_for_db)
     
     # Update user subscription
-    await db.users.update_one(
+    previous = await db.users.find_one_and_update(
         {"id": user['id']},
         {"$set": {
             "subscription_plan": plan['name'],
             "subscription_expiry": validity_end.isoformat(),
             "papers_limit": plan['papers_limit']
-        }}
+        }},
+        projection={"_id": 0, "subscription_plan": 1}
     )
+    invalidate_user_cache(user['id'])
+    await count_subscription_change(previous, plan['name'])
+    # Outstanding access tokens carry the old plan claim
+    await revoke_access_tokens(user['id'])
     
     return {
         "message": "Transaction created successfully",
@@ -1817,30 +4001,31 @@ async def create_transaction(transaction_data: TransactionCreate, current_user:
     }
 
 @api_router.get("/transactions")
-async def get_user_transactions(current_user: Dict = Depends(get_current_user)):
-    """Get all transactions for current user"""
-    transactions = await db.transactions.find(
+async def get_user_transactions(cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE,
+                                current_user: Dict = Depends(get_token_user)):
+    """Get transactions for current user, newest first"""
+    transactions, next_cursor = await paginate(
+        db.transactions,
         {"user_id": current_user['id']},
-        {"_id": 0}
-    ).sort("created_at", -1).to_list(100)
+        {"_id": 0},
+        cursor, limit
+    )
     
-    return {"transactions": transactions}
+    return {"transactions": transactions, "next_cursor": next_cursor}
 
 @api_router.get("/admin/transactions")
-async def get_all_transactions(current_user: Dict = Depends(get_current_user)):
-    """Admin gets all transactions"""
+async def get_all_transactions(cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE,
+                               current_user: Dict = Depends(get_token_user)):
+    """Admin gets all transactions, newest first"""
     if current_user['role'] != 'admin':
         raise HTTPException(status_code=403, detail="Admin access required")
     
-    transactions = await db.transactions.find(
-        {},
-        {"_id": 0}
-    ).sort("created_at", -1).to_list(1000)
+    transactions, next_cursor = await paginate(db.transactions, {}, {"_id": 0}, cursor, limit)
     
-    return {"transactions": transactions}
+    return {"transactions": transactions, "next_cursor": next_cursor}
 
 @api_router.get("/transactions/{transaction_id}/receipt")
-async def download_receipt(transaction_id: str, current_user: Dict = Depends(get_current_user)):
+async def download_receipt(transaction_id: str, current_user: Dict = Depends(get_token_user)):
     """Download receipt for a transaction"""
     transaction = await db.transactions.find_one({"id": transaction_id}, {"_id": 0})
     
@@ -1851,13 +4036,11 @@ async def download_receipt(transaction_id: str, current_user: Dict = Depends(get
     if transaction['user_id'] != current_user['id'] and current_user['role'] != 'admin':
         raise HTTPException(status_code=403, detail="Access denied")
     
-    receipt_path = f"/app{transaction['receipt_url']}"
+    receipt_path = os.path.join(RECEIPTS_DIR, f"{transaction['transaction_number']}.pdf")
     
     if not os.path.exists(receipt_path):
         # Regenerate receipt if not found
-        receipt_pdf = generate_receipt_pdf(transaction)
-        with open(receipt_path, 'wb') as f:
-            f.write(receipt_pdf)
+        receipt_path = write_receipt_file(transaction)
     
     return FileResponse(
         receipt_path,
@@ -1865,6 +4048,35 @@ async def download_receipt(transaction_id: str, current_user: Dict = Depends(get
         filename=f"Receipt_{transaction['transaction_number']}.pdf"
     )
 
+@api_router.post("/admin/receipts/regenerate")
+async def regenerate_all_receipts(missing_only: bool = True, current_user: Dict = Depends(get_current_user)):
+    """Admin regenerates receipt files in bulk (e.g. after restoring to a fresh volume)"""
+    if current_user['role'] != 'admin':
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    written = 0
+    failures = []
+    batch = []
+    async for transaction in db.transactions.find({}, {"_id": 0}):
+        batch.append(transaction)
+        if len(batch) >= 500:
+            batch_written, batch_failures = await asyncio.to_thread(regenerate_receipts, batch, missing_only)
+            written += batch_written
+            failures.extend(batch_failures)
+            batch = []
+    if batch:
+        batch_written, batch_failures = await asyncio.to_thread(regenerate_receipts, batch, missing_only)
+        written += batch_written
+        failures.extend(batch_failures)
+    
+    return {
+        "message": f"{written} receipts regenerated, {len(failures)} failed",
+        "regenerated": written,
+        "failed": len(failures),
+        # Capped so a systematic failure does not produce a huge response
+        "failures": failures[:100]
+    }
+
 @api_router.put("/profile/mobile")
 async def update_mobile(mobile: str, current_user: Dict = Depends(get_current_user)):
     """Update user mobile number"""
@@ -1872,8 +4084,246 @@ async def update_mobile(mobile: str, current_user: Dict = Depends(get_current_us
         {"id": current_user['id']},
         {"$set": {"mobile": mobile}}
     )
+    invalidate_user_cache(current_user['id'])
     return {"message": "Mobile number updated successfully"}
 
+# ==================== MONGO CLIENT ====================
+
+# Upper bounds (ms) of the latency histogram buckets; the last bucket is unbounded
+LATENCY_BUCKETS_MS = [1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000]
+
+# pymongo calls the listeners from Motor's worker threads, so all updates take this lock
+_mongo_metrics_lock = threading.Lock()
+_mongo_command_latency: Dict[str, Dict[str, Any]] = {}
+_mongo_command_failures: Counter = Counter()
+_mongo_pools: Dict[str, Dict[str, Any]] = {}
+# Checkout start time of the connection the current thread is waiting for
+_checkout_local = threading.local()
+
+def new_latency_histogram() -> Dict[str, Any]:
+    return {"count": 0, "sum_ms": 0.0, "max_ms": 0.0, "buckets": [0] * (len(LATENCY_BUCKETS_MS) + 1)}
+
+def observe_latency(histogram: Dict[str, Any], ms: float):
+    histogram["count"] += 1
+    histogram["sum_ms"] += ms
+    histogram["max_ms"] = max(histogram["max_ms"], ms)
+    for i, bound in enumerate(LATENCY_BUCKETS_MS):
+        if ms <= bound:
+            histogram["buckets"][i] += 1
+            return
+    histogram["buckets"][-1] += 1
+
+def latency_histogram_summary(histogram: Dict[str, Any]) -> Dict[str, Any]:
+    """Histogram as count, mean, max and cumulative counts per bucket bound"""
+    cumulative, buckets = 0, {}
+    for bound, count in zip([str(b) for b in LATENCY_BUCKETS_MS] + ["+Inf"], histogram["buckets"]):
+        cumulative += count
+        buckets[f"le_{bound}"] = cumulative
+    return {
+        "count": histogram["count"],
+        "mean_ms": round(histogram["sum_ms"] / histogram["count"], 3) if histogram["count"] else None,
+        "max_ms": round(histogram["max_ms"], 3),
+        "buckets": buckets
+    }
+
+def _pool_stats(address) -> Dict[str, Any]:
+    key = f"{address[0]}:{address[1]}"
+    if key not in _mongo_pools:
+        _mongo_pools[key] = {
+            "connections": 0, "in_use": 0, "max_in_use": 0, "created": 0, "closed": 0,
+            "cleared": 0, "checkout_failures": Counter(), "checkout_wait": new_latency_histogram()
+        }
+    return _mongo_pools[key]
+
+class CommandLatencyListener(monitoring.CommandListener):
+    """Per-command latency histograms and failure counts"""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        with _mongo_metrics_lock:
+            histogram = _mongo_command_latency.setdefault(event.command_name, new_latency_histogram())
+            observe_latency(histogram, event.duration_micros / 1000)
+
+    def failed(self, event):
+        with _mongo_metrics_lock:
+            histogram = _mongo_command_latency.setdefault(event.command_name, new_latency_histogram())
+            observe_latency(histogram, event.duration_micros / 1000)
+            _mongo_command_failures[event.command_name] += 1
+
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+    """Connection counts, in-use connections and checkout wait per server pool"""
+
+    def pool_created(self, event):
+        with _mongo_metrics_lock:
+            _pool_stats(event.address)
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        with _mongo_metrics_lock:
+            _pool_stats(event.address)["cleared"] += 1
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        with _mongo_metrics_lock:
+            pool = _pool_stats(event.address)
+            pool["created"] += 1
+            pool["connections"] += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with _mongo_metrics_lock:
+            pool = _pool_stats(event.address)
+            pool["closed"] += 1
+            pool["connections"] -= 1
+
+    def connection_check_out_started(self, event):
+        _checkout_local.started = time.perf_counter()
+
+    def connection_check_out_failed(self, event):
+        wait_ms = self._checkout_wait_ms()
+        with _mongo_metrics_lock:
+            pool = _pool_stats(event.address)
+            pool["checkout_failures"][event.reason] += 1
+            if wait_ms is not None:
+                observe_latency(pool["checkout_wait"], wait_ms)
+
+    def connection_checked_out(self, event):
+        wait_ms = self._checkout_wait_ms()
+        with _mongo_metrics_lock:
+            pool = _pool_stats(event.address)
+            pool["in_use"] += 1
+            pool["max_in_use"] = max(pool["max_in_use"], pool["in_use"])
+            if wait_ms is not None:
+                observe_latency(pool["checkout_wait"], wait_ms)
+
+    def connection_checked_in(self, event):
+        with _mongo_metrics_lock:
+            _pool_stats(event.address)["in_use"] -= 1
+
+    @staticmethod
+    def _checkout_wait_ms() -> Optional[float]:
+        # Check-out started and completed/failed are emitted on the same thread
+        started = getattr(_checkout_local, "started", None)
+        _checkout_local.started = None
+        return (time.perf_counter() - started) * 1000 if started is not None else None
+
+def connect_mongo() -> AsyncIOMotorClient:
+    """Create the shared client and db handle from the MONGO_* settings (once per process)"""
+    global client, db
+    if client is None:
+        client = AsyncIOMotorClient(
+            mongo_url,
+            maxPoolSize=MONGO_MAX_POOL_SIZE,
+            minPoolSize=MONGO_MIN_POOL_SIZE,
+            maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+            waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+            connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+            socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+            serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+            compressors=MONGO_COMPRESSORS,
+            zlibCompressionLevel=MONGO_ZLIB_LEVEL,
+            readPreference=MONGO_READ_PREFERENCE,
+            event_listeners=[CommandLatencyListener(), PoolMetricsListener()]
+        )
+        db = client[MONGO_DB_NAME]
+    return client
+
+def mongo_metrics() -> Dict[str, Any]:
+    with _mongo_metrics_lock:
+        return {
+            "max_pool_size": MONGO_MAX_POOL_SIZE,
+            "compressors": MONGO_COMPRESSORS,
+            "pools": {
+                address: {
+                    **{k: v for k, v in pool.items() if k not in ("checkout_failures", "checkout_wait")},
+                    "checkout_failures": dict(pool["checkout_failures"]),
+                    "checkout_wait": latency_histogram_summary(pool["checkout_wait"])
+                }
+                for address, pool in _mongo_pools.items()
+            },
+            "commands": {
+                name: {**latency_histogram_summary(histogram), "failures": _mongo_command_failures[name]}
+                for name, histogram in sorted(_mongo_command_latency.items())
+            }
+        }
+
+# ==================== INDEX MANAGEMENT ====================
+
+# (collection, keys, options) for every query shape the app runs; built idempotently at startup.
+# List indexes end in the (sort field, id) pair that keyset pagination orders by.
+INDEX_SPECS = [
+    ("users", [("id", 1)], {"unique": True}),
+    ("users", [("email", 1)], {"unique": True}),
+    ("users", [("created_at", -1), ("id", -1)], {}),
+    ("users", [("quota_reservations.reserved_at", 1)], {"sparse": True}),
+    # id is unique, so it also serves the {id, user_id} ownership lookups
+    ("question_papers", [("id", 1)], {"unique": True}),
+    ("question_papers", [("user_id", 1), ("created_at", -1), ("id", -1)], {}),
+    ("paper_contents", [("paper_id", 1)], {"unique": True}),
+    ("quiz_attempts", [("id", 1)], {"unique": True}),
+    ("quiz_attempts", [("user_id", 1), ("completed_at", -1), ("id", -1)], {}),
+    ("quiz_attempts", [("paper_id", 1)], {}),
+    ("quiz_attempts", [("assignment_id", 1)], {}),
+    ("transactions", [("id", 1)], {"unique": True}),
+    ("transactions", [("user_id", 1), ("created_at", -1), ("id", -1)], {}),
+    ("transactions", [("created_at", -1), ("id", -1)], {}),
+    ("payment_orders", [("order_id", 1)], {"unique": True}),
+    ("payment_orders", [("created_at", -1), ("order_id", -1)], {}),
+    ("subscription_plans", [("id", 1)], {"unique": True}),
+    ("subscription_plans", [("is_active", 1)], {}),
+    ("counters", [("id", 1)], {"unique": True}),
+    ("user_stats", [("user_id", 1)], {"unique": True}),
+    ("paper_item_stats", [("paper_id", 1), ("question_id", 1)], {"unique": True}),
+    ("subject_term_stats", [("subject", 1)], {"unique": True}),
+    ("subject_term_df", [("subject", 1), ("term", 1)], {"unique": True}),
+    ("assignments", [("id", 1)], {"unique": True}),
+    ("assignments", [("join_code", 1)], {"unique": True}),
+    ("assignments", [("teacher_id", 1), ("created_at", -1)], {}),
+    ("assignment_members", [("assignment_id", 1), ("student_id", 1)], {"unique": True}),
+    ("assignment_members", [("student_id", 1)], {}),
+    ("assignment_results", [("assignment_id", 1), ("student_id", 1)], {"unique": True}),
+    ("assignment_results", [("assignment_id", 1), ("best_percentage", -1)], {}),
+    ("bulk_grading_results", [("batch_id", 1)], {}),
+    ("bulk_grading_results", [("paper_id", 1), ("graded_at", -1)], {}),
+    ("practice_sessions", [("id", 1)], {"unique": True}),
+    # At most one open session per user, paper and assignment
+    ("practice_sessions", [("user_id", 1), ("paper_id", 1), ("assignment_id", 1)],
+     {"unique": True, "partialFilterExpression": {"status": "active"}}),
+    ("leaderboard_entries", [("scope", 1), ("scope_id", 1), ("user_id", 1)], {"unique": True}),
+    ("leaderboard_entries", [("scope", 1), ("scope_id", 1), ("percentage", -1), ("achieved_at", 1)], {}),
+    ("leaderboard_buckets", [("scope", 1), ("scope_id", 1)], {"unique": True}),
+    ("refresh_tokens", [("token_hash", 1)], {"unique": True}),
+    ("refresh_tokens", [("user_id", 1)], {}),
+    ("refresh_tokens", [("family_id", 1)], {}),
+    ("refresh_tokens", [("expires_at", 1)], {"expireAfterSeconds": 0}),
+    ("token_revocations", [("user_id", 1)], {"unique": True}),
+    ("token_revocations", [("revoked_at", 1)], {}),
+    ("token_revocations", [("expires_at", 1)], {"expireAfterSeconds": 0}),
+    ("login_throttle", [("key", 1)], {"unique": True}),
+    ("login_throttle", [("expires_at", 1)], {"expireAfterSeconds": 0}),
+]
+
+async def ensure_indexes() -> Dict[str, int]:
+    """Create every declared index; existing ones are a no-op, failures are logged not fatal"""
+    created, failed = 0, 0
+    for collection, keys, options in INDEX_SPECS:
+        try:
+            await db[collection].create_index(keys, **options)
+            created += 1
+        except Exception as e:
+            # e.g. duplicate values blocking a unique index - the app still works without it
+            failed += 1
+            logging.error(f"Index {collection}{keys} not created: {str(e)}")
+    return {"ensured": created, "failed": failed}
+
 # ==================== INCLUDE ROUTER ====================
 
 app.include_router(api_router)
@@ -1892,6 +4342,51 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Registered first: every other startup handler uses db
+@app.on_event("startup")
+async def connect_db_client():
+    connect_mongo()
+
+@app.on_event("startup")
+async def start_session_flusher():
+    global _session_flush_task
+    _session_flush_task = asyncio.create_task(_session_flush_loop())
+
+@app.on_event("startup")
+async def create_indexes():
+    result = await ensure_indexes()
+    logger.info(f"Indexes ensured: {result['ensured']}, failed: {result['failed']}")
+
+@app.on_event("startup")
+async def start_quota_sweep():
+    global _quota_sweep_task
+    _quota_sweep_task = asyncio.create_task(_quota_sweep_loop())
+
+@app.on_event("startup")
+async def start_counters_reconcile():
+    global _counters_reconcile_task
+    # Runs in the background: recounting large collections must not delay startup
+    _counters_reconcile_task = asyncio.create_task(_counters_reconcile_loop())
+
+@app.on_event("startup")
+async def start_token_revocation_sync():
+    global _token_revocation_task
+    await sync_token_revocations()
+    _token_revocation_task = asyncio.create_task(_token_revocation_loop())
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    if _session_flush_task:
+        _session_flush_task.cancel()
+    if _token_revocation_task:
+        _token_revocation_task.cancel()
+    if _counters_reconcile_task:
+        _counters_reconcile_task.cancel()
+    if _analytics_backfill_task:
+        _analytics_backfill_task.cancel()
+    if _quota_sweep_task:
+        _quota_sweep_task.cancel()
+    # Do not lose autosaves that are still buffered
+    await flush_session_writes()
+    password_hash_executor.shutdown(wait=False)
     client.close()
\ No newline at end of file